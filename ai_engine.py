@@ -1,59 +1,260 @@
 import requests
 import json
 import re
+import time
 import fitz
 import base64
 import logging
-from typing import Optional, Union, Dict, List
+import threading
+from typing import Callable, Optional, Union, Dict, List, Tuple
 from config import Config
+from model_residency import ModelResidencyManager, from_config as residency_from_config
+from ocr_cache import OCRCache, default_path as ocr_cache_path
+from image_preprocess import ImagePreprocessor
+from ocr_backends import BackendError, BackendPool, from_config as backends_from_config
+from media_buffer import MediaBuffer, StreamingJSONBody, as_media
+import receipt_parsers
+import metrics
+import tracing
 
 logger = logging.getLogger(__name__)
 
+EXTRACT_SECONDS = metrics.histogram('financebot_ai_extract_seconds',
+                                    'Duração de AIService.extract_data (pré-processamento + IA).',
+                                    buckets=metrics.AI_BUCKETS)
+PDF_RENDER_SECONDS = metrics.histogram('financebot_pdf_render_seconds',
+                                       'Renderização da primeira página do PDF em imagem.',
+                                       buckets=metrics.HTTP_BUCKETS)
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# Saída estruturada do Ollama (`format`): os seis campos do comprovante
+RECEIPT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "valor": {"type": "number"},
+        "recebedor": {"type": "string"},
+        "banco": {"type": "string"},
+        "pagador": {"type": "string"},
+        "id_transacao": {"type": "string"},
+        "data_texto": {"type": "string"}
+    },
+    "required": ["valor", "recebedor", "banco", "pagador", "id_transacao", "data_texto"]
+}
+
+
+class JSONObjectScanner:
+    """Acumula fragmentos de texto e detecta quando o primeiro objeto JSON fecha."""
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escaped = False
+        self.complete = False
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def feed(self, fragment: str) -> bool:
+        """Retorna True quando o objeto está completo."""
+        for i, ch in enumerate(fragment):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == '\\':
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = self.started
+            elif ch == '{':
+                self.started = True
+                self.depth += 1
+            elif ch == '}' and self.started:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.parts.append(fragment[:i + 1])
+                    self.complete = True
+                    return True
+        self.parts.append(fragment)
+        return False
+
+
 class AIService:
-    def pdf_to_image(self, pdf_base64_str: str) -> Optional[str]:
+    def __init__(self, residency: Optional[ModelResidencyManager] = None, cache: Optional[OCRCache] = None,
+                 preprocessor: Optional[ImagePreprocessor] = None, backends: Optional[BackendPool] = None):
+        # Servidores Ollama (balanceamento, disjuntor e failover)
+        self.backends = backends or backends_from_config()
+
+        # Mantém o modelo quente entre comprovantes (keep_alive por inatividade)
+        self.residency = residency or residency_from_config()
+        self.residency.start()
+
+        # Comprovantes reenviados reaproveitam a extração anterior
+        self.cache = cache or OCRCache(
+            ocr_cache_path(),
+            max_entries=Config.OCR_CACHE_MAX_ENTRIES,
+            max_age_days=Config.OCR_CACHE_MAX_AGE_DAYS
+        )
+
+        # Tokens gerados por comprovante
+        self.token_stats = {'receipts': 0, 'tokens': 0, 'early_stops': 0}
+        self._stats_lock = threading.Lock()
+
+        # Recorte/redimensionamento antes da IA (menos tokens de visão)
+        self.preprocessor = preprocessor or ImagePreprocessor(
+            max_side=Config.IMAGE_MAX_SIDE,
+            grayscale=Config.IMAGE_GRAYSCALE,
+            autocrop=Config.IMAGE_AUTOCROP,
+            jpeg_quality=Config.IMAGE_JPEG_QUALITY
+        )
+
+    def _cached(self, media: Union[MediaBuffer, str, None],
+                extractor: Callable[[MediaBuffer], Union[Dict, str, None]]) -> Union[Dict, str, None]:
+        """Consulta o cache pelo hash da mídia antes de executar a extração."""
+        media = as_media(media)
+        if media is None:
+            return None
+
+        key = self.cache.key_for(media)
+        with tracing.span('ocr_cache.get') as span:
+            cached = self.cache.get(key)
+            span.set(hit=cached is not None)
+        if cached is not None:
+            logger.info("Comprovante já processado anteriormente (cache de OCR).")
+            return cached
+
+        resultado = extractor(media)
+        self.cache.put(key, resultado)
+        return resultado
+
+    def extract_image(self, media: Union[MediaBuffer, str]) -> Union[Dict, str, None]:
+        """Extração de uma imagem de comprovante (com cache por conteúdo). Aceita o handle ou Base64."""
+        return self._cached(media, self.extract_data)
+
+    @tracing.traced('pdf.open')
+    def _open_pdf(self, media: Union[MediaBuffer, str]) -> Optional[fitz.Document]:
+        media = as_media(media)
+        if media is None:
+            logger.error("Erro ao abrir PDF: Base64 inválido.")
+            return None
+        try:
+            doc = fitz.open(stream=media.getvalue(), filetype="pdf")
+        except Exception as e:
+            logger.error(f"Erro ao abrir PDF: {e}")
+            return None
+
+        if doc.page_count < 1:
+            logger.warning("PDF recebido vazio ou inválido.")
+            return None
+        return doc
+
+    @PDF_RENDER_SECONDS.time()
+    @tracing.traced('pdf.render')
+    def _render_first_page(self, doc: fitz.Document) -> Optional[bytes]:
         """
-        Converte a primeira página de um PDF (Base64) para Imagem (Base64/PNG).
-        Utiliza Matrix(2,2) para aumentar o DPI e melhorar a precisão do OCR.
+        Renderiza a página 0 em PNG (bytes crus; o Base64 só é gerado no envio à IA).
+        A escala depende do tamanho da página: o maior lado fica próximo de
+        IMAGE_MAX_SIDE (até Matrix(2,2)).
         """
         try:
-            pdf_data = base64.b64decode(pdf_base64_str)
-            doc = fitz.open(stream=pdf_data, filetype="pdf")
-            
-            if doc.page_count < 1:
-                logger.warning("PDF recebido vazio ou inválido.")
-                return None
-
             page = doc.load_page(0)
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2)) 
-            img_bytes = pix.tobytes("png")
-            
-            return base64.b64encode(img_bytes).decode('utf-8')
+            zoom = self.preprocessor.pdf_zoom(page.rect.width, page.rect.height)
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+            return pix.tobytes("png")
         except Exception as e:
             logger.error(f"Erro na conversão PDF->Img: {e}")
             return None
 
-    def _unload_model(self) -> None:
-        """Libera a VRAM do modelo no servidor Ollama imediatamente após o uso."""
+    def pdf_to_image(self, media: Union[MediaBuffer, str]) -> Optional[str]:
+        """Converte a primeira página de um PDF para Imagem (Base64/PNG)."""
+        doc = self._open_pdf(media)
+        if not doc:
+            return None
+        with doc:
+            img_bytes = self._render_first_page(doc)
+        return base64.b64encode(img_bytes).decode('utf-8') if img_bytes else None
+
+    def extract_from_pdf(self, media: Union[MediaBuffer, str]) -> Union[Dict, str, None]:
+        """Extração de um PDF de comprovante (com cache por conteúdo). Aceita o handle ou Base64."""
+        media = as_media(media)
+        if media is None:
+            return "PDF_ERROR"
+        return self._cached(media, self._extract_pdf)
+
+    def _extract_pdf(self, media: MediaBuffer) -> Union[Dict, str, None]:
+        """
+        Extração em camadas para PDFs:
+        1. Camada de texto nativa (PDFs gerados pelo banco) com parser determinístico.
+        2. Fallback: rasteriza a primeira página e envia para a IA de visão.
+
+        Returns:
+            Mesmo contrato de extract_data, mais 'PDF_ERROR' se o arquivo não puder ser lido.
+        """
+        doc = self._open_pdf(media)
+        if not doc:
+            return "PDF_ERROR"
+
+        with doc:
+            text = self._pdf_text(doc)
+            dados = self.extract_from_text(text)
+            if dados is not None:
+                logger.info("Comprovante PDF lido pela camada de texto (sem IA).")
+                return dados
+
+            img_bytes = self._render_first_page(doc)
+
+        if not img_bytes:
+            return "PDF_ERROR"
+        return self.extract_data(img_bytes)
+
+    def _pdf_text(self, doc: fitz.Document, max_pages: int = 2) -> str:
         try:
-            requests.post(Config.OLLAMA_URL, json={
-                "model": Config.OLLAMA_MODEL,
-                "keep_alive": 0
-            }, timeout=5)
+            return "\n".join(doc.load_page(i).get_text() for i in range(min(doc.page_count, max_pages)))
         except Exception as e:
-            logger.warning(f"Falha ao liberar memória do modelo: {e}")
+            logger.warning(f"Falha ao ler camada de texto do PDF: {e}")
+            return ""
+
+    @tracing.traced('pdf.text_rules')
+    def extract_from_text(self, text: str) -> Union[Dict, str, None]:
+        """
+        Tenta extrair o comprovante de forma determinística a partir de texto,
+        usando as regras por banco registradas em receipt_parsers.
+        Retorna None quando nenhuma regra atinge a confiança mínima (usar a IA).
+        """
+        match = receipt_parsers.parse(text)
+        if match is None or match.confidence < Config.RECEIPT_RULES_MIN_CONFIDENCE:
+            return None
+
+        logger.info(f"Comprovante reconhecido pela regra '{match.rule}' (confiança {match.confidence}).")
+        return self._validate_receiver(self._normalize_fields(dict(match.dados)))
 
-    def extract_data(self, base64_image: str) -> Union[Dict, str, None]:
+    @EXTRACT_SECONDS.time()
+    @tracing.traced('ai.extract_data')
+    def extract_data(self, image: Union[MediaBuffer, bytes, str]) -> Union[Dict, str, None]:
         """
         Envia a imagem para o modelo LLM e extrai dados estruturados JSON.
+        A imagem (handle, bytes ou Base64) é codificada uma única vez, em
+        blocos, durante o envio da requisição.
         
         Returns:
             Dict: Dados extraídos com sucesso.
             str: Mensagem de erro específica (ex: 'INVALID_RECEIVER').
             None: Erro genérico de processamento.
         """
-        if not base64_image or len(base64_image) < 100:
+        if isinstance(image, str):
+            image = as_media(image)
+        if not image or len(image) < 75:
             return None
 
+        with tracing.span('ai.preprocess') as span:
+            span.set(bytes_in=len(image))
+            image = self._preprocess(image)
+            span.set(bytes_out=len(image))
+
         # Injeta o nome do beneficiário configurado no prompt para guiar a IA
         beneficiary_name = Config.BENEFICIARY_NAME
         
@@ -65,31 +266,37 @@ class AIService:
             "3. Do not include markdown formatting (```json) or conversational text.\n"
             "4. Fields required: 'valor' (float), 'recebedor' (string), 'banco' (string), "
             "'pagador' (string), 'id_transacao' (string), 'data_texto' (string dd/mm/yyyy).\n"
-            f"5. Verify if the receiver matches '{beneficiary_name}' or parts of this name."
+            f"5. Verify if the receiver matches '{beneficiary_name}' or parts of this name.\n"
+            "6. If the image is not a payment receipt, return valor 0 and empty strings."
         )
         
         payload = {
             "model": Config.OLLAMA_MODEL,
             "prompt": prompt,
-            "stream": False,
-            "images": [base64_image],
+            "stream": Config.OLLAMA_STREAM,
+            "format": RECEIPT_SCHEMA,
+            "keep_alive": self.residency.keep_alive,
             "options": {
                 "temperature": 0.1,
-                "num_predict": 1024,
+                "num_predict": Config.OLLAMA_NUM_PREDICT,
                 "top_k": 20
             }
         }
-        
+        body = StreamingJSONBody(payload, image)
+
         try:
             logger.info("Enviando imagem para análise da IA...")
-            response = requests.post(Config.OLLAMA_URL, json=payload, timeout=120)
-            
-            if response.status_code != 200:
-                logger.error(f"Erro API Ollama ({response.status_code}): {response.text}")
+            generate = self._generate_streaming if Config.OLLAMA_STREAM else self._generate_blocking
+            raw_text, meta, url = self.backends.request(lambda backend: generate(backend.url, body))
+
+            if raw_text is None:
                 return None
-            
-            raw_text = response.json().get('response', '').strip()
-            return self._parse_llm_response(raw_text)
+
+            self.residency.record_request(meta, url)
+            self._record_tokens(meta)
+            if meta.get('load_duration') is not None:
+                tracing.annotate(load_ms=round(meta['load_duration'] / 1e6, 1))
+            return self._parse_llm_response(raw_text.strip())
 
         except requests.exceptions.Timeout:
             logger.error("Timeout na comunicação com o Ollama.")
@@ -97,40 +304,111 @@ class AIService:
         except Exception as e:
             logger.error(f"Exceção no processamento da IA: {e}")
             return None
-        finally:
-            self._unload_model()
 
+    def _check_status(self, url: str, response: requests.Response) -> bool:
+        """Erros 5xx disparam failover para outro backend; 4xx são definitivos."""
+        if response.status_code >= 500:
+            raise BackendError(f"{url} respondeu {response.status_code}")
+        if response.status_code != 200:
+            logger.error(f"Erro API Ollama ({response.status_code}): {response.text}")
+            return False
+        return True
+
+    def _generate_blocking(self, url: str, body: StreamingJSONBody) -> Tuple[Optional[str], Dict, str]:
+        response = requests.post(url, data=body, headers=JSON_HEADERS, timeout=120)
+        if not self._check_status(url, response):
+            return None, {}, url
+        
+        result = response.json()
+        return result.get('response', ''), result, url
+
+    def _generate_streaming(self, url: str, body: StreamingJSONBody) -> Tuple[Optional[str], Dict, str]:
+        """
+        Lê a resposta em streaming e encerra a conexão assim que um objeto JSON
+        completo chega. Fechar a conexão faz o Ollama cancelar a geração.
+        """
+        scanner = JSONObjectScanner()
+        chunks = 0
+        inicio = time.perf_counter()
+        with requests.post(url, data=body, headers=JSON_HEADERS, stream=True, timeout=120) as response:
+            if not self._check_status(url, response):
+                return None, {}, url
+
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                chunks += 1
+                if chunks == 1:
+                    # Inclui carga do modelo e leitura da imagem (prompt eval)
+                    tracing.annotate(first_token_ms=round((time.perf_counter() - inicio) * 1000, 1))
+
+                if scanner.feed(chunk.get('response', '')):
+                    # Objeto completo: não espera o restante da geração
+                    return scanner.text, {'eval_count': chunks, 'early_stop': not chunk.get('done')}, url
+
+                if chunk.get('done'):
+                    chunk.setdefault('eval_count', chunks)
+                    return scanner.text, chunk, url
+
+        return scanner.text, {'eval_count': chunks}, url
+
+    def _record_tokens(self, meta: Dict) -> None:
+        tokens = meta.get('eval_count', 0)
+        with self._stats_lock:
+            self.token_stats['receipts'] += 1
+            self.token_stats['tokens'] += tokens
+            if meta.get('early_stop'):
+                self.token_stats['early_stops'] += 1
+        logger.info(f"Tokens gerados: {tokens}{' (parada antecipada)' if meta.get('early_stop') else ''}")
+
+    def token_report(self) -> Dict:
+        """Tokens gerados por comprovante (compare OLLAMA_STREAM=true/false)."""
+        with self._stats_lock:
+            receipts = self.token_stats['receipts']
+            return {
+                **self.token_stats,
+                'avg_tokens': round(self.token_stats['tokens'] / receipts, 1) if receipts else 0.0
+            }
+
+    def _preprocess(self, image: Union[MediaBuffer, bytes]) -> Union[MediaBuffer, bytes]:
+        """Retorna o JPEG reduzido ou, se não compensar, a própria mídia original (sem cópia extra)."""
+        image_bytes = image.getvalue() if isinstance(image, MediaBuffer) else image
+        processed, _ = self.preprocessor.process(image_bytes)
+        if processed is image_bytes:
+            return image
+        return processed
+
+    @tracing.traced('ai.parse_response')
     def _parse_llm_response(self, raw_text: str) -> Union[Dict, str, None]:
-        """Processa a string retornada pela LLM, valida o JSON e verifica o beneficiário."""
+        """
+        Processa a string retornada pela LLM, valida o JSON e verifica o beneficiário.
+        Com `format` (JSON schema) a resposta já é JSON puro; o fallback por regex
+        cobre servidores/modelos sem saída estruturada.
+        """
         try:
-            # Extração robusta de JSON (remove texto antes/depois das chaves)
-            match = re.search(r"\{.*\}", raw_text, re.DOTALL)
-            if not match:
-                logger.warning(f"JSON não encontrado na resposta da IA: {raw_text[:50]}...")
-                return "JSON_ERROR"
+            try:
+                data = json.loads(raw_text)
+            except json.JSONDecodeError:
+                # Extração robusta de JSON (remove texto antes/depois das chaves)
+                match = re.search(r"\{.*\}", raw_text, re.DOTALL)
+                if not match:
+                    logger.warning(f"JSON não encontrado na resposta da IA: {raw_text[:50]}...")
+                    return "JSON_ERROR"
 
-            # Tratamento para aspas simples (comum em LLMs menores)
-            json_str = match.group(0).replace("'", '"')
-            data = json.loads(json_str)
+                # Tratamento para aspas simples (comum em LLMs menores)
+                json_str = match.group(0).replace("'", '"')
+                data = json.loads(json_str)
 
-            if "erro" in data:
+            if not isinstance(data, dict) or "erro" in data:
                 return None
 
-            # Normalização de Datas e Valores
-            data['data_completa'] = data.get('data_texto', 'N/A')
-            
-            val = data.get('valor', 0)
-            if isinstance(val, str):
-                # Limpa R$, espaços e converte vírgula para ponto
-                clean_val = re.sub(r'[^\d,.]', '', val).replace(',', '.')
-                try:
-                    val = float(clean_val)
-                except ValueError:
-                    val = 0.0
-            data['valor'] = val
+            # Sem valor nem ID: não é comprovante (instrução 6 do prompt)
+            if not data.get('valor') and not data.get('id_transacao'):
+                return None
 
             # Validação Dinâmica do Beneficiário via Config
-            return self._validate_receiver(data)
+            return self._validate_receiver(self._normalize_fields(data))
 
         except json.JSONDecodeError:
             logger.error("Falha ao decodificar JSON da IA.")
@@ -139,6 +417,21 @@ class AIService:
             logger.error(f"Erro no parsing da resposta: {e}")
             return None
 
+    def _normalize_fields(self, data: Dict) -> Dict:
+        """Normalização de Datas e Valores (comum à IA e aos parsers determinísticos)."""
+        data['data_completa'] = data.get('data_texto', 'N/A')
+        
+        val = data.get('valor', 0)
+        if isinstance(val, str):
+            # Limpa R$, espaços e converte vírgula para ponto
+            clean_val = re.sub(r'[^\d,.]', '', val).replace(',', '.')
+            try:
+                val = float(clean_val)
+            except ValueError:
+                val = 0.0
+        data['valor'] = val
+        return data
+
     def _validate_receiver(self, data: Dict) -> Union[Dict, str]:
         """Verifica se o recebedor no comprovante bate com a configuração."""
         recebedor_ocr = str(data.get('recebedor', '')).lower()
@@ -1,7 +1,16 @@
+import json
+import hmac
 import logging
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, abort
 from bot_controller import FinanceBot
 from scheduler import PaymentScheduler
+from job_queue import QueueFullError
+from config import Config
+import wpp_gateway
+import leader_election
+import webhook_filter
+import metrics
+import tracing
 
 # Configuração de Logging
 logging.basicConfig(
@@ -13,20 +22,155 @@ logger = logging.getLogger(__name__)
 # Silenciar logs excessivos do Werkzeug
 logging.getLogger('werkzeug').setLevel(logging.ERROR)
 
-app = Flask(__name__)
-bot = FinanceBot()
-scheduler = PaymentScheduler()
-
-@app.route('/webhook', methods=['POST'])
-def webhook():
-    try:
-        data = request.json
-        if data:
-            bot.process_webhook(data)
-        return jsonify({"status": "success"}), 200
-    except Exception as e:
-        logger.error(f"Erro Crítico no Webhook: {e}", exc_info=True)
-        return jsonify({"status": "error", "message": str(e)}), 500
+
+def create_app() -> Flask:
+    """
+    Monta a aplicação de um processo (dev server ou worker do gunicorn).
+    O agendador só roda no processo que detém o lease de líder.
+    """
+    app = Flask(__name__)
+    tracing.from_config()
+
+    # Sessão HTTP e fila de saída compartilhadas entre bot e agendador
+    gateway = wpp_gateway.from_config()
+    gateway.start()
+    bot = FinanceBot(gateway)
+    ingest = webhook_filter.from_config(bot.db)
+    scheduler = PaymentScheduler(gateway)
+
+    if Config.SCHEDULER_ENABLED:
+        elector = leader_election.from_config('scheduler', scheduler.start, scheduler.stop)
+        elector.start()
+        app.extensions['leader_elector'] = elector
+
+    app.extensions['finance_bot'] = bot
+    app.extensions['payment_scheduler'] = scheduler
+
+    # Gauges avaliados a cada scrape do /metrics
+    metrics.gauge('financebot_receipt_queue_depth', 'Comprovantes aguardando na fila.',
+                  lambda: bot.receipt_queue.stats()['depth'])
+    metrics.gauge('financebot_receipt_queue_running', 'Comprovantes em processamento.',
+                  lambda: bot.receipt_queue.stats()['running'])
+    metrics.gauge('financebot_outbound_queue_depth', 'Mensagens aguardando envio ao WPPConnect.',
+                  lambda: gateway.stats()['depth'])
+    metrics.gauge('financebot_pending_confirmations', 'Confirmações (enquetes) aguardando o admin.',
+                  bot.db.contar_confirmacoes_pendentes)
+    metrics.gauge('financebot_customer_cache_entries', 'Clientes no cache em memória (inclui negativos).',
+                  lambda: bot.db.cache_stats()['entries'])
+    metrics.gauge('financebot_customer_cache_bytes', 'Memória estimada do cache de clientes.',
+                  lambda: bot.db.cache_stats()['bytes'])
+
+    @app.route('/webhook', methods=['POST'])
+    def webhook():
+        with tracing.trace('webhook') as trace:
+            resposta = _webhook()
+        if trace is not None:
+            resposta = app.make_response(resposta)
+            resposta.headers['X-Correlation-ID'] = trace.correlation_id
+        return resposta
+
+    def _webhook():
+        # Filtro nos bytes crus: eventos ignorados e grupos nem chegam ao parse do JSON
+        with tracing.span('webhook.read'):
+            raw = request.get_data(cache=False)
+        if ingest.precheck(raw):
+            return jsonify({"status": "ignored"}), 200
+
+        try:
+            with tracing.span('webhook.parse'):
+                data = json.loads(raw)
+            del raw  # libera os bytes crus antes do processamento
+            if not isinstance(data, dict):
+                raise ValueError("payload não é um objeto")
+        except ValueError:
+            ingest.reject_invalid()
+            return jsonify({"status": "error", "message": "invalid json"}), 400
+
+        key = webhook_filter.WebhookFilter.event_key(data)
+        # ID da mensagem do WhatsApp como ID de correlação (segue para a fila e os envios)
+        tracing.set_correlation_id(key)
+        if not ingest.claim(key):
+            return jsonify({"status": "duplicate"}), 200
+
+        try:
+            job_id = bot.process_webhook(data)
+            if job_id:
+                return jsonify({"status": "queued", "job_id": job_id}), 200
+            return jsonify({"status": "success"}), 200
+        except QueueFullError:
+            # Backpressure: o WPPConnect reenvia o evento mais tarde
+            ingest.release(key)
+            return jsonify({"status": "busy"}), 503, {"Retry-After": "30"}
+        except Exception as e:
+            ingest.release(key)
+            logger.error(f"Erro Crítico no Webhook: {e}", exc_info=True)
+            return jsonify({"status": "error", "message": str(e)}), 500
+
+    @app.route('/webhook/stats', methods=['GET'])
+    def webhook_stats():
+        return jsonify(ingest.stats()), 200
+
+    @app.route('/jobs/<job_id>', methods=['GET'])
+    def job_status(job_id):
+        job = bot.receipt_queue.status(job_id)
+        if not job:
+            return jsonify({"status": "error", "message": "job not found"}), 404
+        return jsonify(job), 200
+
+    @app.route('/jobs', methods=['GET'])
+    def jobs_stats():
+        return jsonify(bot.receipt_queue.stats()), 200
+
+    @app.route('/outbound', methods=['GET'])
+    def outbound_stats():
+        return jsonify(gateway.stats()), 200
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        return metrics.exposition(), 200, {'Content-Type': metrics.CONTENT_TYPE}
+
+    # --- Diagnóstico (exige X-Debug-Token = DEBUG_TOKEN) ---
+
+    def _exigir_token():
+        token = request.headers.get('X-Debug-Token', '')
+        if not Config.DEBUG_TOKEN or not hmac.compare_digest(token, Config.DEBUG_TOKEN):
+            abort(404)
+
+    @app.route('/debug/slow', methods=['GET'])
+    def debug_slow():
+        _exigir_token()
+        return jsonify(tracing.recent_slow()), 200
+
+    @app.route('/debug/profiler', methods=['GET', 'POST'])
+    def debug_profiler():
+        """POST ?action=start&seconds=60&interval_ms=10 | ?action=stop; GET devolve as pilhas (collapsed)."""
+        _exigir_token()
+        profiler = tracing.profiler
+        if request.method == 'GET':
+            if request.args.get('format') == 'json':
+                return jsonify(profiler.status()), 200
+            return profiler.collapsed(request.args.get('limit', type=int)), 200, {'Content-Type': 'text/plain'}
+
+        action = request.args.get('action', 'start')
+        if action == 'start':
+            interval_ms = request.args.get('interval_ms', type=float)
+            profiler.start(request.args.get('seconds', type=float), interval_ms / 1000 if interval_ms else None)
+        elif action == 'stop':
+            profiler.stop()
+        else:
+            return jsonify({"status": "error", "message": "action deve ser start ou stop"}), 400
+        return jsonify(profiler.status()), 200
+
+    @app.route('/model', methods=['GET'])
+    def model_stats():
+        return jsonify({
+            **bot.ai.residency.stats(),
+            'tokens': bot.ai.token_report(),
+            'backends': bot.ai.backends.stats()
+        }), 200
+
+    return app
+
 
 if __name__ == '__main__':
     print("\n" + "="*50)
@@ -34,9 +178,9 @@ if __name__ == '__main__':
     print("🤖 AI Engine: Active")
     print("⏰ Scheduler: Active")
     print("="*50 + "\n")
-    
-    # Inicia agendador em thread separada
-    scheduler.start()
-    
-    # Em produção, utilize gunicorn ou uWSGI
-    app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
+
+    # Agendador iniciado pela eleição de líder (único processo aqui)
+    app = create_app()
+
+    # Em produção, utilize gunicorn (gunicorn -c gunicorn.conf.py wsgi:app)
+    app.run(host='0.0.0.0', port=5000, debug=False)
@@ -0,0 +1,151 @@
+"""
+Benchmark do esquema indexado (migração v2) contra o esquema legado.
+
+Gera um banco sintético no formato antigo (datas dd/mm, sem índices), mede
+as consultas de duplicidade, cobrança e exclusão, aplica as migrações via
+Database() e mede as consultas equivalentes novamente.
+
+Uso:
+    python benchmarks/bench_db_indexes.py --transacoes 1000000 --clientes 20000
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database  # noqa: E402
+from customer_cache import CustomerCache  # noqa: E402
+
+
+def criar_banco_legado(path: str, n_transacoes: int, n_clientes: int) -> None:
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE financeiro (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, numero TEXT UNIQUE, saldo REAL DEFAULT 0,
+            vencimento TEXT, ultimo_aviso TEXT
+        );
+        CREATE TABLE transacoes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, numero_cliente TEXT, data_registro TEXT,
+            data_comprovante TEXT, tipo TEXT, valor REAL, saldo_anterior REAL, saldo_novo REAL,
+            pagador TEXT, banco TEXT, id_comprovante TEXT UNIQUE
+        );
+    """)
+    rnd = random.Random(42)
+    hoje = date.today()
+
+    clientes = [f"5561{9000000 + i:08d}" for i in range(n_clientes)]
+    conn.executemany(
+        "INSERT INTO financeiro (numero, saldo, vencimento) VALUES (?, ?, ?)",
+        ((num, rnd.randint(-50, 500),
+          (hoje + timedelta(days=rnd.randint(0, 60))).strftime("%d/%m") if rnd.random() < 0.5 else None)
+         for num in clientes)
+    )
+
+    def linhas():
+        for i in range(n_transacoes):
+            dia = hoje - timedelta(days=rnd.randint(0, 720))
+            yield (
+                rnd.choice(clientes),
+                dia.strftime("%d/%m/%Y") + " 10:00:00",
+                dia.strftime("%d/%m/%Y") + f" {i % 24:02d}:{i % 60:02d}:{i % 59:02d}",
+                'Pix IA', 50.0, 100.0, 50.0, 'Pagador', 'Banco',
+                f"E{i:031d}"
+            )
+
+    conn.executemany("""
+        INSERT INTO transacoes (numero_cliente, data_registro, data_comprovante, tipo, valor,
+            saldo_anterior, saldo_novo, pagador, banco, id_comprovante)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, linhas())
+    conn.commit()
+    conn.close()
+
+
+def medir(func, repeticoes: int) -> float:
+    """Tempo médio em milissegundos."""
+    inicio = time.perf_counter()
+    for i in range(repeticoes):
+        func(i)
+    return (time.perf_counter() - inicio) * 1000 / repeticoes
+
+
+def bench_legado(path: str, clientes, repeticoes: int) -> dict:
+    conn = sqlite3.connect(path)
+    hoje, amanha = date.today(), date.today() + timedelta(days=1)
+
+    def duplicidade(i):
+        conn.execute("SELECT id FROM transacoes WHERE id_comprovante = ? OR data_comprovante = ?",
+                     (f"X{i}", f"01/01/1990 {i}")).fetchone()
+
+    def pendentes(_):
+        hoje_str, amanha_str = hoje.strftime("%d/%m"), amanha.strftime("%d/%m")
+        rows = conn.execute(
+            "SELECT numero, saldo, vencimento, ultimo_aviso FROM financeiro WHERE vencimento IS NOT NULL"
+        ).fetchall()
+        [r for r in rows if r[2] in (hoje_str, amanha_str)]
+
+    def historico_cliente(i):
+        conn.execute("SELECT COUNT(*) FROM transacoes WHERE numero_cliente = ?", (clientes[i],)).fetchone()
+
+    res = {
+        'check_duplicidade': medir(duplicidade, repeticoes),
+        'get_pendentes_cobranca': medir(pendentes, repeticoes),
+        'transacoes por cliente (deletar_cliente)': medir(historico_cliente, repeticoes)
+    }
+    conn.close()
+    return res
+
+
+def bench_indexado(db: Database, clientes, repeticoes: int) -> dict:
+    hoje, amanha = date.today().isoformat(), (date.today() + timedelta(days=1)).isoformat()
+
+    def historico_cliente(i):
+        with db._get_connection() as conn:
+            conn.execute("SELECT COUNT(*) FROM transacoes WHERE numero_cliente = ?", (clientes[i],)).fetchone()
+
+    return {
+        'check_duplicidade': medir(lambda i: db.check_duplicidade(f"X{i}", f"01/01/1990 {i}"), repeticoes),
+        'get_pendentes_cobranca': medir(lambda _: db.get_pendentes_cobranca(hoje, amanha, hoje), repeticoes),
+        'transacoes por cliente (deletar_cliente)': medir(historico_cliente, repeticoes)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transacoes', type=int, default=1_000_000)
+    parser.add_argument('--clientes', type=int, default=20_000)
+    parser.add_argument('--repeticoes', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        print(f"Gerando {args.transacoes} transações / {args.clientes} clientes...")
+        inicio = time.perf_counter()
+        criar_banco_legado(path, args.transacoes, args.clientes)
+        print(f"  pronto em {time.perf_counter() - inicio:.1f}s")
+
+        rnd = random.Random(7)
+        clientes = [f"5561{9000000 + rnd.randrange(args.clientes):08d}" for _ in range(args.repeticoes)]
+
+        antes = bench_legado(path, clientes, args.repeticoes)
+
+        inicio = time.perf_counter()
+        db = Database(path, cache=CustomerCache())
+        print(f"Migração aplicada em {time.perf_counter() - inicio:.1f}s")
+        depois = bench_indexado(db, clientes, args.repeticoes)
+        db.close()
+
+    print(f"\n{'Consulta':<45}{'Antes (ms)':>12}{'Depois (ms)':>13}{'Ganho':>9}")
+    for nome in antes:
+        ganho = antes[nome] / depois[nome] if depois[nome] else float('inf')
+        print(f"{nome:<45}{antes[nome]:>12.3f}{depois[nome]:>13.3f}{ganho:>8.0f}x")
+
+
+if __name__ == '__main__':
+    main()
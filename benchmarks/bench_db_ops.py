@@ -0,0 +1,132 @@
+"""
+Micro-benchmarks das operações do Database em um banco sintético grande
+(esquema atual, já migrado): consultas do webhook e do agendador, escritas
+unitárias e em lote e o ciclo de confirmações pendentes.
+
+Uso:
+    python benchmarks/bench_db_ops.py --transacoes 1000000 --clientes 20000
+    python benchmarks/bench_db_ops.py --salvar db_base.json
+    python benchmarks/bench_db_ops.py --comparar db_base.json --tolerancia 0.2
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import cronometrar, imprimir_tabela, salvar, comparar  # noqa: E402
+
+
+def popular(db, n_transacoes: int, n_clientes: int) -> list:
+    """Insere clientes e transações direto no esquema atual (datas ISO)."""
+    rnd = random.Random(42)
+    hoje = date.today()
+    clientes = [f"5561{9000000 + i:08d}" for i in range(n_clientes)]
+
+    def linhas():
+        for i in range(n_transacoes):
+            dia = hoje - timedelta(days=rnd.randint(0, 720))
+            yield (
+                rnd.choice(clientes),
+                dia.isoformat() + " 10:00:00",
+                dia.strftime("%d/%m/%Y") + f" {i % 24:02d}:{i % 60:02d}:{i % 59:02d}",
+                'Pix IA', 50.0, 100.0, 50.0, 'Pagador', 'Banco',
+                f"E{i:031d}"
+            )
+
+    with db.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO financeiro (numero, saldo, vencimento) VALUES (?, ?, ?)",
+            ((num, rnd.randint(-50, 500),
+              (hoje + timedelta(days=rnd.randint(0, 60))).isoformat() if rnd.random() < 0.5 else None)
+             for num in clientes)
+        )
+        conn.executemany("""
+            INSERT INTO transacoes (numero_cliente, data_registro, data_comprovante, tipo, valor,
+                saldo_anterior, saldo_novo, pagador, banco, id_comprovante)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, linhas())
+        conn.execute("ANALYZE")
+    return clientes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transacoes', type=int, default=500_000)
+    parser.add_argument('--clientes', type=int, default=20_000)
+    parser.add_argument('--repeticoes', type=int, default=2000)
+    parser.add_argument('--salvar', help="grava os resultados em JSON (linha de base)")
+    parser.add_argument('--comparar', help="linha de base para detectar regressões de p95")
+    parser.add_argument('--tolerancia', type=float, default=0.2)
+    args = parser.parse_args()
+
+    from database import Database
+    from customer_cache import CustomerCache
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'), cache=CustomerCache())
+        inicio = time.perf_counter()
+        clientes = popular(db, args.transacoes, args.clientes)
+        print(f"Banco sintético: {args.clientes} clientes, {args.transacoes} transações "
+              f"({time.perf_counter() - inicio:.1f}s)")
+
+        rnd = random.Random(7)
+        n = args.repeticoes
+        hoje = date.today()
+        amanha = (hoje + timedelta(days=1)).isoformat()
+        sufixo = datetime.now().strftime('%H%M%S')
+
+        def lancamento(i: int, lote: int = 0) -> dict:
+            return {'numero': rnd.choice(clientes), 'valor': 10, 'sinal': '+', 'tipo': 'Bench',
+                    'id_id': f"BENCH_{sufixo}_{lote}_{i}", 'data_full': None}
+
+        def confirmacao(i: int) -> None:
+            chat = f"{clientes[i % len(clientes)]}@c.us"
+            conf_id = db.criar_confirmacao(chat, lancamento(i), ttl=60)
+            db.vincular_confirmacao(conf_id, f"poll_{sufixo}_{i}")
+            db.consumir_confirmacao(chat, f"poll_{sufixo}_{i}")
+
+        casos = {
+            'get_saldo': (lambda i: db.get_saldo(rnd.choice(clientes)), n),
+            'get_saldo (100 clientes frequentes)': (lambda i: db.get_saldo(clientes[i % 100]), n),
+            'cliente_existe (existe)': (lambda i: db.cliente_existe(rnd.choice(clientes)), n),
+            'cliente_existe (não existe)': (lambda i: db.cliente_existe(f"5511{i:09d}"), n),
+            'check_duplicidade': (lambda i: db.check_duplicidade(f"X{i}", f"01/01/1990 00:00:{i % 60:02d}"), n),
+            'get_devedores': (lambda i: db.get_devedores(), max(1, n // 100)),
+            'get_devedores (página 20 linhas)': (lambda i: db.get_devedores(20, (i % 50) * 20), n),
+            'resumo_devedores': (lambda i: db.resumo_devedores(), max(1, n // 10)),
+            'get_extrato (página 20 linhas)': (lambda i: db.get_extrato(rnd.choice(clientes), 20), n),
+            'contar_transacoes': (lambda i: db.contar_transacoes(rnd.choice(clientes)), n),
+            'get_pendentes_cobranca': (lambda i: db.get_pendentes_cobranca(hoje.isoformat(), amanha,
+                                                                           hoje.isoformat()), max(1, n // 10)),
+            'get_agenda_cobranca': (lambda i: db.get_agenda_cobranca(hoje.isoformat()), max(1, n // 100)),
+            'registrar_transacao': (lambda i: db.registrar_transacao(lancamento(i)), max(1, n // 4)),
+            'registrar_transacoes_lote (500)': (
+                lambda i: db.registrar_transacoes_lote([lancamento(j, i + 1) for j in range(500)]), 10),
+            'confirmação (criar/vincular/consumir)': (confirmacao, max(1, n // 4)),
+        }
+
+        resultados = {}
+        for nome, (func, repeticoes) in casos.items():
+            resultados[nome] = cronometrar(func, repeticoes)
+        db.close()
+
+    imprimir_tabela(resultados, "Operações do Database")
+
+    if args.salvar:
+        salvar(resultados, args.salvar)
+    if args.comparar:
+        regressoes = comparar(resultados, args.comparar, args.tolerancia)
+        for r in regressoes:
+            print(f"REGRESSÃO {r}")
+        if regressoes:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
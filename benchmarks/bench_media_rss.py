@@ -0,0 +1,171 @@
+"""
+Pico de RSS por comprovante em processamento: caminho antigo (Base64 decodificado,
+reprocessado e recodificado dentro de um payload `json=`) contra o caminho com
+MediaBuffer (decodificação em blocos para arquivo temporário e Base64 gerado
+em blocos durante o envio).
+
+Cada modo roda em um subprocesso próprio contra um servidor Ollama falso local
+que apenas lê o corpo da requisição. O valor reportado é o pico de RSS acima
+da linha de base (a string Base64 do webhook já alocada). Com --fila N, mede
+também a memória retida por N comprovantes aguardando na fila.
+
+Uso:
+    python benchmarks/bench_media_rss.py --megapixels 12 --fila 20
+"""
+import io
+import os
+import sys
+import json
+import base64
+import random
+import resource
+import argparse
+import threading
+import tempfile
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class _OllamaFalso(BaseHTTPRequestHandler):
+    def do_POST(self):
+        restante = int(self.headers.get('Content-Length', 0))
+        while restante:
+            restante -= len(self.rfile.read(min(restante, 1 << 20)))
+        corpo = json.dumps({"response": "{}", "done": True}).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args):
+        pass
+
+
+def gerar_imagem_base64(megapixels: float, path: str) -> None:
+    """JPEG com ruído (comprime mal, como foto de celular), salvo em Base64."""
+    from PIL import Image
+
+    lado = int((megapixels * 1_000_000) ** 0.5)
+    rnd = random.Random(1)
+    img = Image.frombytes("L", (lado, lado), rnd.randbytes(lado * lado)).convert("RGB")
+    saida = io.BytesIO()
+    img.save(saida, format='JPEG', quality=95)
+    with open(path, 'wb') as f:
+        f.write(base64.b64encode(saida.getvalue()))
+
+
+def rss_mb() -> float:
+    """RSS atual (Linux)."""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 1e6
+
+
+class PicoRSS:
+    """Amostra o RSS a cada milissegundo enquanto o bloco executa."""
+
+    def __enter__(self) -> "PicoRSS":
+        self.pico = rss_mb()
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._amostrar, daemon=True)
+        self._thread.start()
+        return self
+
+    def _amostrar(self) -> None:
+        while not self._parar.wait(0.001):
+            self.pico = max(self.pico, rss_mb())
+
+    def __exit__(self, *exc) -> None:
+        self._parar.set()
+        self._thread.join()
+        self.pico = max(self.pico, rss_mb())
+
+
+def ler_webhook(path: str) -> str:
+    with open(path) as f:
+        return f.read()
+
+
+def rodar_modo(modo: str, path: str, preprocess: bool, fila: int) -> None:
+    import requests
+    from image_preprocess import ImagePreprocessor
+    from media_buffer import MediaBuffer, StreamingJSONBody
+
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), _OllamaFalso)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{servidor.server_port}/api/generate"
+
+    preprocessor = ImagePreprocessor(max_side=1280, autocrop=False)
+
+    def reduzir(image_bytes: bytes) -> bytes:
+        return preprocessor.process(image_bytes)[0] if preprocess else image_bytes
+    payload = {"model": "bench", "prompt": "x", "stream": False}
+
+    corpo_webhook = ler_webhook(path)
+    base = rss_mb()
+
+    with PicoRSS() as medidor:
+        if modo == 'antigo':
+            image_bytes = base64.b64decode(corpo_webhook)
+            processed = reduzir(image_bytes)
+            image_b64 = corpo_webhook if processed is image_bytes else base64.b64encode(processed).decode()
+            requests.post(url, json={**payload, "images": [image_b64]}, timeout=60)
+            del image_bytes, processed, image_b64
+        else:
+            with MediaBuffer.from_base64(corpo_webhook) as media:
+                if preprocess:
+                    image_bytes = media.getvalue()
+                    processed = reduzir(image_bytes)
+                    image = media if processed is image_bytes else processed
+                    del image_bytes, processed
+                else:
+                    image = media
+                requests.post(url, data=StreamingJSONBody(payload, image),
+                              headers={'Content-Type': 'application/json'}, timeout=60)
+                del image
+
+    pico = medidor.pico - base
+
+    # Comprovantes aguardando na fila: string Base64 (antigo) ou MediaBuffer em disco
+    retido = []
+    for _ in range(fila):
+        corpo = ler_webhook(path)
+        retido.append(corpo if modo == 'antigo' else MediaBuffer.from_base64(corpo))
+        del corpo
+
+    print(json.dumps({'modo': modo, 'pico_extra_mb': round(pico, 1),
+                      'fila_extra_mb': round(max(0.0, rss_mb() - base), 1),
+                      'midia_mb': round(len(corpo_webhook) * 3 / 4 / 1e6, 1)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--megapixels', type=float, default=12.0)
+    parser.add_argument('--sem-preprocess', action='store_true', help="envia a imagem original (sem IMAGE_MAX_SIDE)")
+    parser.add_argument('--fila', type=int, default=10, help="comprovantes aguardando na fila")
+    parser.add_argument('--modo', choices=['antigo', 'buffer'], help=argparse.SUPPRESS)
+    parser.add_argument('--arquivo', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.modo:
+        rodar_modo(args.modo, args.arquivo, not args.sem_preprocess, args.fila)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'webhook.b64')
+        gerar_imagem_base64(args.megapixels, path)
+
+        print(f"{'Modo':<10}{'Mídia (MB)':>12}{'Pico por comprovante (MB)':>28}{f'Com {args.fila} na fila (MB)':>26}")
+        for modo in ('antigo', 'buffer'):
+            cmd = [sys.executable, os.path.abspath(__file__), '--modo', modo, '--arquivo', path,
+                   '--fila', str(args.fila)]
+            if args.sem_preprocess:
+                cmd.append('--sem-preprocess')
+            saida = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+            res = json.loads(saida.strip().splitlines()[-1])
+            print(f"{modo:<10}{res['midia_mb']:>12}{res['pico_extra_mb']:>28}{res['fila_extra_mb']:>26}")
+
+
+if __name__ == '__main__':
+    main()
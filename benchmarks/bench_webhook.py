@@ -0,0 +1,283 @@
+"""
+Teste de carga ponta a ponta do /webhook com WPPConnect e Ollama falsos.
+
+Sobe os stubs locais (benchmarks/stubs.py), cria a aplicação com create_app()
+em um diretório temporário (bancos descartáveis) e reproduz tráfego sintético
+pelo cliente de teste do Flask, em fases por caminho:
+
+    texto    /saldo de clientes e /listar do admin
+    imagem   comprovantes JPEG (únicos, para não cair no cache de OCR)
+    pdf      comprovantes PDF com camada de texto (parser determinístico)
+    enquete  respostas do admin a enquetes de confirmação já enviadas
+    misto    os quatro caminhos intercalados
+
+Para cada caminho reporta p50/p95/p99 e requisições por segundo da resposta
+do webhook e, para as mídias, a latência até o job terminar na fila.
+
+Uso:
+    python benchmarks/bench_webhook.py --requisicoes 200 --concorrencia 8
+    python benchmarks/bench_webhook.py --salvar base.json
+    python benchmarks/bench_webhook.py --comparar base.json --tolerancia 0.2
+"""
+import io
+import os
+import sys
+import time
+import base64
+import random
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import resumir, imprimir_tabela, salvar, comparar  # noqa: E402
+from stubs import WPPConnectStub, OllamaStub, RESPOSTA_PADRAO  # noqa: E402
+
+ADMIN = '5561900000000'
+
+
+def configurar_ambiente(wpp: WPPConnectStub, ollama: OllamaStub, args) -> None:
+    """Precisa rodar antes de importar a aplicação (Config lê o ambiente no import)."""
+    os.environ.update({
+        'WPP_BASE_URL': wpp.base_url,
+        'WPP_SESSION': 'bench',
+        'WPP_TOKEN': 'bench',
+        'OLLAMA_URL': ollama.url,
+        'OLLAMA_MODEL': 'bench',
+        'ADMIN_PHONE': ADMIN,
+        'BENEFICIARY_NAME': RESPOSTA_PADRAO['recebedor'],
+        'SCHEDULER_ENABLED': 'false',
+        'OLLAMA_PREWARM_HOURS': '',
+        'RECEIPT_QUEUE_SIZE': str(args.requisicoes * 4),
+        'RECEIPT_WORKERS': str(args.workers_fila)
+    })
+
+
+def gerar_jpeg() -> bytes:
+    from PIL import Image, ImageDraw
+
+    img = Image.new('RGB', (1080, 1920), 'white')
+    draw = ImageDraw.Draw(img)
+    for i in range(40):
+        draw.text((60, 80 + i * 44), f"Comprovante Pix  linha {i}  R$ 50,00", fill='black')
+    saida = io.BytesIO()
+    img.save(saida, format='JPEG', quality=85)
+    return saida.getvalue()
+
+
+def gerar_pdf(n: int) -> bytes:
+    import fitz
+
+    # E + ISPB + AAAAMMDDHHMM + 11 caracteres (único por evento)
+    e2e = f"E18236120202502011200{random.getrandbits(64):x}"[:32].upper()
+    texto = ("Comprovante de transferência\nNu Pagamentos S.A.\n"
+             "Valor\nR$ 50,00\n01/02/2025\n"
+             f"Destino\nNome\n{RESPOSTA_PADRAO['recebedor']}\n"
+             "Origem\nNome\nCliente Stub\n"
+             f"ID da transação:\n{e2e}\n")
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((50, 72), texto, fontsize=11)
+    dados = doc.tobytes()
+    doc.close()
+    return dados
+
+
+class Trafego:
+    """Monta os eventos do webhook e dispara pelo cliente de teste."""
+
+    def __init__(self, app, wpp: WPPConnectStub, clientes: List[str]):
+        self.app = app
+        self.bot = app.extensions['finance_bot']
+        self.wpp = wpp
+        self.clientes = clientes
+        self.jpeg = gerar_jpeg()
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.jobs: Dict[str, List[str]] = {}
+
+    def _evento(self, **campos) -> Dict:
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+        return {'event': 'onmessage', 'id': f"true_bench_{seq}_{random.getrandbits(48):x}", **campos}
+
+    def _jid(self, numero: str) -> str:
+        return f"{numero}@c.us"
+
+    def texto(self, i: int) -> Dict:
+        if i % 10 == 0:
+            return self._evento(**{'from': self._jid(ADMIN), 'body': '/listar', 'type': 'chat'})
+        numero = self.clientes[i % len(self.clientes)]
+        return self._evento(**{'from': self._jid(numero), 'body': '/saldo', 'type': 'chat'})
+
+    def imagem(self, i: int) -> Dict:
+        # Bytes após o marcador EOI não afetam a decodificação, mas mudam o hash (sem cache)
+        corpo = base64.b64encode(self.jpeg + os.urandom(16)).decode()
+        numero = self.clientes[i % len(self.clientes)]
+        return self._evento(**{'from': self._jid(numero), 'body': corpo, 'type': 'image',
+                               'mimetype': 'image/jpeg'})
+
+    def pdf(self, i: int) -> Dict:
+        corpo = base64.b64encode(gerar_pdf(i)).decode()
+        numero = self.clientes[i % len(self.clientes)]
+        return self._evento(**{'from': self._jid(numero), 'body': corpo, 'type': 'document',
+                               'mimetype': 'application/pdf'})
+
+    def enquete(self, i: int) -> Dict:
+        poll_id = self.wpp.enquetes.get(timeout=30)
+        return self._evento(**{'event': 'onpollresponse', 'from': self._jid(ADMIN), 'chatId': self._jid(ADMIN),
+                               'sender': self._jid(ADMIN), 'msgId': {'_serialized': poll_id},
+                               'selectedOptions': [{'name': 'Confirmar ✅'}], 'timestamp': int(time.time())})
+
+    def preparar_enquetes(self, n: int) -> None:
+        """Cria n confirmações pendentes para o admin e espera as enquetes saírem (fora da medição)."""
+        self.aguardar_fila()
+        while not self.wpp.enquetes.empty():
+            self.wpp.enquetes.get_nowait()
+        for i in range(n):
+            numero = self.clientes[i % len(self.clientes)]
+            info = {'numero': numero, 'valor': 10, 'sinal': '+', 'tipo': 'Manual Admin',
+                    'id_id': f"BENCH_{self._evento()['id']}"}
+            self.bot._request_confirmation(f"{ADMIN}@c.us", info, f"Lançar +R$10 para {numero}?")
+        limite = time.monotonic() + 30
+        while self.wpp.enquetes.qsize() < n and time.monotonic() < limite:
+            time.sleep(0.01)
+
+    def enviar(self, caminho: str, evento: Dict) -> float:
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        inicio = time.perf_counter()
+        resposta = client.post('/webhook', json=evento)
+        duracao = time.perf_counter() - inicio
+        job_id = (resposta.get_json() or {}).get('job_id')
+        if job_id:
+            with self._lock:
+                self.jobs.setdefault(caminho, []).append(job_id)
+        return duracao
+
+    def aguardar_fila(self, timeout: float = 300) -> None:
+        limite = time.monotonic() + timeout
+        while time.monotonic() < limite:
+            stats = self.bot.receipt_queue.stats()
+            if not stats['depth'] and not stats['running']:
+                return
+            time.sleep(0.05)
+
+    def latencia_jobs(self, caminho: str) -> List[float]:
+        amostras = []
+        for job_id in self.jobs.get(caminho, []):
+            job = self.bot.receipt_queue.status(job_id)
+            if job and job.get('finished_at'):
+                amostras.append(job['finished_at'] - job['enqueued_at'])
+        return amostras
+
+
+def rodar_fase(trafego: Trafego, plano: List[Tuple[str, Callable[[int], Dict]]], concorrencia: int
+               ) -> Dict[str, List[float]]:
+    """Gera os eventos antes (fora da medição) e dispara em paralelo."""
+    eventos = [(caminho, gerar(i)) for i, (caminho, gerar) in enumerate(plano)]
+    amostras: Dict[str, List[float]] = {}
+    with ThreadPoolExecutor(max_workers=concorrencia) as pool:
+        for caminho, duracao in zip([c for c, _ in eventos],
+                                    pool.map(lambda ev: trafego.enviar(*ev), eventos)):
+            amostras.setdefault(caminho, []).append(duracao)
+    return amostras
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requisicoes', type=int, default=100, help="eventos por caminho")
+    parser.add_argument('--concorrencia', type=int, default=8)
+    parser.add_argument('--clientes', type=int, default=500)
+    parser.add_argument('--latencia-ia', type=float, default=0.3, help="latência média do Ollama falso (s)")
+    parser.add_argument('--jitter-ia', type=float, default=0.1)
+    parser.add_argument('--latencia-wpp', type=float, default=0.0)
+    parser.add_argument('--workers-fila', type=int, default=2)
+    parser.add_argument('--salvar', help="grava os resultados em JSON (linha de base)")
+    parser.add_argument('--comparar', help="linha de base para detectar regressões de p95")
+    parser.add_argument('--tolerancia', type=float, default=0.2)
+    args = parser.parse_args()
+    args.salvar = args.salvar and os.path.abspath(args.salvar)
+    args.comparar = args.comparar and os.path.abspath(args.comparar)
+
+    wpp = WPPConnectStub(args.latencia_wpp).start()
+    ollama = OllamaStub(args.latencia_ia, args.jitter_ia).start()
+    configurar_ambiente(wpp, ollama, args)
+
+    tmp = tempfile.TemporaryDirectory()
+    os.chdir(tmp.name)
+
+    import logging
+    from app import create_app
+    from database import Database
+    logging.getLogger().setLevel(logging.WARNING)
+
+    clientes = [f"5561{9_0000_0000 + i}" for i in range(args.clientes)]
+    db = Database()
+    for numero in clientes:
+        db.set_saldo(numero, 100.0)
+
+    app = create_app()
+    trafego = Trafego(app, wpp, clientes)
+    n = args.requisicoes
+
+    amostras: Dict[str, List[float]] = {}
+    duracoes: Dict[str, float] = {}
+
+    def medir(nome: str, plano) -> None:
+        inicio = time.perf_counter()
+        resultado = rodar_fase(trafego, plano, args.concorrencia)
+        total = time.perf_counter() - inicio
+        for caminho, valores in resultado.items():
+            chave = f"{nome}/{caminho}" if nome == 'misto' else caminho
+            amostras[chave] = valores
+            duracoes[chave] = total
+
+    medir('texto', [('texto', trafego.texto)] * n)
+    trafego.preparar_enquetes(n)
+    medir('enquete', [('enquete', trafego.enquete)] * n)
+    medir('imagem', [('imagem', trafego.imagem)] * n)
+    medir('pdf', [('pdf', trafego.pdf)] * n)
+    trafego.aguardar_fila()
+
+    trafego.preparar_enquetes(n // 4)
+    misto = [('texto', trafego.texto), ('imagem', trafego.imagem), ('pdf', trafego.pdf), ('enquete', trafego.enquete)]
+    medir('misto', [misto[i % 4] for i in range(n // 4 * 4)])
+    trafego.aguardar_fila()
+
+    resultados = {caminho: resumir(valores, duracoes[caminho]) for caminho, valores in amostras.items()}
+    for caminho in ('imagem', 'pdf'):
+        jobs = trafego.latencia_jobs(caminho)
+        if jobs:
+            resultados[f"{caminho} (até o job terminar)"] = resumir(jobs, max(jobs))
+
+    imprimir_tabela(resultados, f"Webhook: {n} eventos por caminho, concorrência {args.concorrencia}, "
+                                f"IA {args.latencia_ia}s ± {args.jitter_ia}s")
+    print(f"\nMensagens enviadas ao WPPConnect: {wpp.enviadas}")
+
+    for extensao in ('leader_elector',):
+        if extensao in app.extensions:
+            app.extensions[extensao].stop()
+    app.extensions['finance_bot'].receipt_queue.stop()
+    wpp.stop()
+    ollama.stop()
+
+    if args.salvar:
+        salvar(resultados, args.salvar)
+    if args.comparar:
+        regressoes = comparar(resultados, args.comparar, args.tolerancia)
+        for r in regressoes:
+            print(f"REGRESSÃO {r}")
+        if regressoes:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
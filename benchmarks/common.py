@@ -0,0 +1,71 @@
+"""
+Utilitários compartilhados pelos benchmarks: percentis, tabela de resultados
+e comparação com uma linha de base salva (detecção de regressões).
+"""
+import json
+import math
+import time
+from typing import Callable, Dict, List, Optional
+
+
+def percentil(ordenadas: List[float], p: float) -> float:
+    if not ordenadas:
+        return 0.0
+    # Nearest-rank
+    return ordenadas[max(0, math.ceil(p / 100 * len(ordenadas)) - 1)]
+
+
+def resumir(amostras_s: List[float], duracao_s: Optional[float] = None) -> Dict[str, float]:
+    """Latências (segundos) -> p50/p95/p99/máx em ms e requisições por segundo."""
+    ordenadas = sorted(amostras_s)
+    duracao = duracao_s if duracao_s is not None else sum(ordenadas)
+    return {
+        'n': len(ordenadas),
+        'rps': round(len(ordenadas) / duracao, 1) if duracao else 0.0,
+        'p50_ms': round(percentil(ordenadas, 50) * 1000, 3),
+        'p95_ms': round(percentil(ordenadas, 95) * 1000, 3),
+        'p99_ms': round(percentil(ordenadas, 99) * 1000, 3),
+        'max_ms': round(ordenadas[-1] * 1000, 3) if ordenadas else 0.0
+    }
+
+
+def cronometrar(func: Callable[[int], None], repeticoes: int) -> Dict[str, float]:
+    """Executa `func(i)` sequencialmente e resume a latência de cada chamada."""
+    amostras = []
+    inicio_total = time.perf_counter()
+    for i in range(repeticoes):
+        inicio = time.perf_counter()
+        func(i)
+        amostras.append(time.perf_counter() - inicio)
+    return resumir(amostras, time.perf_counter() - inicio_total)
+
+
+def imprimir_tabela(resultados: Dict[str, Dict[str, float]], titulo: str) -> None:
+    print(f"\n{titulo}")
+    print(f"{'Caminho':<40}{'n':>7}{'RPS':>10}{'p50 (ms)':>11}{'p95 (ms)':>11}{'p99 (ms)':>11}{'máx (ms)':>11}")
+    for nome, r in resultados.items():
+        print(f"{nome:<40}{r['n']:>7}{r['rps']:>10}{r['p50_ms']:>11}{r['p95_ms']:>11}{r['p99_ms']:>11}{r['max_ms']:>11}")
+
+
+def salvar(resultados: Dict, path: str) -> None:
+    with open(path, 'w') as f:
+        json.dump(resultados, f, indent=2, ensure_ascii=False)
+
+
+def comparar(resultados: Dict[str, Dict[str, float]], baseline_path: str, tolerancia: float) -> List[str]:
+    """
+    Compara o p95 de cada caminho com a linha de base. Retorna as regressões
+    (p95 acima de `tolerancia` em relação à base, ex: 0.2 = +20%).
+    """
+    with open(baseline_path) as f:
+        base = json.load(f)
+
+    regressoes = []
+    for nome, r in resultados.items():
+        anterior = base.get(nome)
+        if not anterior or not anterior.get('p95_ms'):
+            continue
+        variacao = r['p95_ms'] / anterior['p95_ms'] - 1
+        if variacao > tolerancia:
+            regressoes.append(f"{nome}: p95 {anterior['p95_ms']}ms -> {r['p95_ms']}ms (+{variacao:.0%})")
+    return regressoes
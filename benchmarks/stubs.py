@@ -0,0 +1,139 @@
+"""
+Servidores locais que substituem o WPPConnect e o Ollama nos benchmarks.
+Ambos rodam em threads, em portas livres de 127.0.0.1.
+"""
+import json
+import time
+import queue
+import random
+import uuid
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Optional
+
+# Resposta padrão da IA; {n} vira um contador (IDs de transação distintos, sem alerta de duplicidade)
+RESPOSTA_PADRAO = {
+    "valor": 50.0,
+    "recebedor": "Fulano Beneficiario",
+    "banco": "Banco Stub",
+    "pagador": "Cliente Stub",
+    "id_transacao": "STUB{n:012d}",
+    "data_texto": "01/02/2025"
+}
+
+
+class _Servidor:
+    def __init__(self, handler):
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self._httpd.daemon_threads = True
+        self._httpd.stub = self
+        self.port = self._httpd.server_port
+
+    def start(self) -> "_Servidor":
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _ler_json(self) -> Dict:
+        tamanho = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(tamanho)) if tamanho else {}
+
+    def _responder(self, status: int, corpo: bytes, content_type: str = 'application/json') -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args):
+        pass
+
+
+class _WPPHandler(_Handler):
+    def do_POST(self):
+        stub: WPPConnectStub = self.server.stub
+        payload = self._ler_json()
+        endpoint = self.path.rsplit('/', 1)[-1]
+        phone = str(payload.get('phone', '')).split('@')[0]
+        msg_id = f"true_{phone}@c.us_{uuid.uuid4().hex[:20].upper()}"
+        stub.registrar(endpoint, payload, msg_id)
+        corpo = json.dumps({"status": "success", "response": [{"id": msg_id}]}).encode()
+        self._responder(201, corpo)
+
+
+class WPPConnectStub(_Servidor):
+    """Aceita send-message/send-poll-message e guarda os IDs das enquetes enviadas."""
+
+    def __init__(self, latencia: float = 0.0):
+        super().__init__(_WPPHandler)
+        self.latencia = latencia
+        self.enviadas = 0
+        self.enquetes: "queue.Queue[str]" = queue.Queue()
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/api"
+
+    def registrar(self, endpoint: str, payload: Dict, msg_id: str) -> None:
+        if self.latencia:
+            time.sleep(self.latencia)
+        with self._lock:
+            self.enviadas += 1
+        if endpoint == 'send-poll-message':
+            self.enquetes.put(msg_id)
+
+
+class _OllamaHandler(_Handler):
+    def do_POST(self):
+        stub: OllamaStub = self.server.stub
+        payload = self._ler_json()
+        if 'prompt' not in payload:
+            # Pré-aquecimento/descarga (só model + keep_alive)
+            self._responder(200, json.dumps({"done": True, "load_duration": 1}).encode())
+            return
+
+        texto = stub.proxima_resposta()
+        time.sleep(stub.sortear_latencia())
+
+        if payload.get('stream'):
+            partes = [texto[i:i + 8] for i in range(0, len(texto), 8)]
+            linhas = [json.dumps({"response": p, "done": False}) for p in partes]
+            linhas.append(json.dumps({"response": "", "done": True, "eval_count": len(partes),
+                                      "load_duration": 1_000_000}))
+            self._responder(200, ("\n".join(linhas) + "\n").encode(), 'application/x-ndjson')
+        else:
+            self._responder(200, json.dumps({"response": texto, "done": True, "eval_count": 40,
+                                             "load_duration": 1_000_000}).encode())
+
+
+class OllamaStub(_Servidor):
+    """Responde /api/generate com JSON fixo após uma latência configurável (média ± jitter)."""
+
+    def __init__(self, latencia: float = 0.5, jitter: float = 0.1, resposta: Optional[Dict] = None):
+        super().__init__(_OllamaHandler)
+        self.latencia = latencia
+        self.jitter = jitter
+        self.resposta = resposta or RESPOSTA_PADRAO
+        self._contador = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/api/generate"
+
+    def sortear_latencia(self) -> float:
+        return max(0.0, random.uniform(self.latencia - self.jitter, self.latencia + self.jitter))
+
+    def proxima_resposta(self) -> str:
+        with self._lock:
+            self._contador += 1
+            n = self._contador
+        return json.dumps({k: v.format(n=n) if isinstance(v, str) else v for k, v in self.resposta.items()})
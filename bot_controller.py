@@ -1,55 +1,101 @@
-import requests
 import math
 import re
 import logging
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Union
 
 from config import Config
-from database import Database
+from database import Database, iso_to_br
 from ai_engine import AIService
+from job_queue import ReceiptQueue, QueueFullError
+from media_buffer import MediaBuffer
+import bulk_import
+from bulk_import import Lote, LoteInvalido
+import wpp_gateway
+from wpp_gateway import WPPGateway, DeliveryCallback
+import metrics
+import tracing
 
 logger = logging.getLogger(__name__)
 
+_NAO_DIGITO = re.compile(r'\D')
+
+OCR_RESULTS = metrics.counter('financebot_ocr_results', 'Resultado da extração dos comprovantes.', ['result'])
+
+
+def _resultado_ocr(dados: Union[Dict, str, None]) -> str:
+    if isinstance(dados, dict):
+        return 'dict'
+    if dados in ('INVALID_RECEIVER', 'JSON_ERROR', 'PDF_ERROR'):
+        return dados.lower()
+    return 'discarded'
+
+def _eh_csv(data: Dict[str, Any]) -> bool:
+    return ('csv' in str(data.get('mimetype', '')).lower()
+            or str(data.get('filename', '')).lower().endswith('.csv'))
+
+
+def _numero_pagina(texto: str, padrao: int = 1) -> int:
+    """Número de página/quantidade informado no comando (inválido vira `padrao`, mínimo 1)."""
+    try:
+        return max(1, int(texto))
+    except ValueError:
+        return padrao
+
 class FinanceBot:
-    def __init__(self):
+    def __init__(self, gateway: Optional[WPPGateway] = None):
         self.db = Database()
+        if gateway is None:
+            gateway = wpp_gateway.from_config()
+            gateway.start()
+        self.gateway = gateway
+        self._admin_suffix = _NAO_DIGITO.sub('', Config.ADMIN_PHONE)[-8:]
         self.ai = AIService()
-        self.pending_confirmations: Dict[str, Dict] = {}
+        self.receipt_queue = ReceiptQueue(
+            workers=Config.RECEIPT_WORKERS,
+            max_size=Config.RECEIPT_QUEUE_SIZE
+        )
+        self.receipt_queue.start()
 
     def send_text(self, to: str, msg: str) -> None:
-        """Envia mensagem de texto via API do WhatsApp."""
-        try:
-            payload = {"phone": to, "message": msg}
-            requests.post(f"{Config.WPP_API_URL}/send-message", headers=Config.HEADERS, json=payload)
-        except Exception as e:
-            logger.error(f"Falha ao enviar mensagem para {to}: {e}")
+        """Enfileira mensagem de texto no gateway (entrega assíncrona, em ordem por chat)."""
+        self.gateway.send_text(to, msg)
 
-    def send_poll(self, to: str, text: str) -> None:
+    def send_poll(self, to: str, text: str, callback: Optional[DeliveryCallback] = None) -> None:
         """Cria enquete de confirmação."""
-        phone = to.split('@')[0]
-        payload = {
-            "phone": phone,
-            "name": text,
-            "choices": ["Confirmar ✅", "Cancelar ❌"],
-            "options": {"selectableCount": 1}
-        }
-        try:
-            requests.post(f"{Config.WPP_API_URL}/send-poll-message", headers=Config.HEADERS, json=payload)
-        except Exception as e:
-            logger.error(f"Falha ao enviar enquete para {to}: {e}")
+        self.gateway.send_poll(to, text, ["Confirmar ✅", "Cancelar ❌"], callback)
+
+    def _request_confirmation(self, chat_id: str, info: Dict, question: str) -> None:
+        """
+        Guarda a operação no banco (compartilhado entre processos, com TTL) e
+        envia a enquete; após a entrega, a confirmação é vinculada ao ID da enquete.
+        """
+        conf_id = self.db.criar_confirmacao(chat_id, info, Config.CONFIRMATION_TTL_SECONDS)
+
+        def vincular(resposta: Optional[Dict]) -> None:
+            poll_id = wpp_gateway.message_id(resposta)
+            if poll_id:
+                self.db.vincular_confirmacao(conf_id, poll_id)
+            else:
+                logger.warning(f"Enquete para {chat_id} sem ID na resposta; a confirmação será resolvida pelo chat.")
 
-    def process_webhook(self, data: Dict[str, Any]) -> None:
+        self.send_poll(chat_id, question, vincular)
+
+    @tracing.traced('process_webhook')
+    def process_webhook(self, data: Dict[str, Any]) -> Optional[str]:
+        """
+        Roteia o evento recebido. Comandos de texto são respondidos na hora;
+        imagens e PDFs vão para a fila de comprovantes.
+        Retorna o ID do job quando uma mídia é enfileirada.
+        """
         event = data.get('event')
         sender = data.get('from', '')
         chat_id = data.get('chatId') or sender
         is_group = "@g.us" in chat_id
         body = str(data.get('body', '')).strip()
         
-        # Verificação de Admin
-        sender_clean = re.sub(r'\D', '', sender)
-        admin_clean = re.sub(r'\D', '', Config.ADMIN_PHONE)
-        is_admin = sender_clean.endswith(admin_clean[-8:])
+        # Verificação de Admin (sufixo calculado uma única vez no __init__)
+        is_admin = _NAO_DIGITO.sub('', sender).endswith(self._admin_suffix)
 
         if is_group:
             return # Ignora grupos
@@ -69,23 +115,68 @@ class FinanceBot:
             elif command == '/del':
                 self._cmd_del(chat_id, body, is_admin)
             elif command == '/listar':
-                self._cmd_listar(chat_id, is_admin)
+                self._cmd_listar(chat_id, body, is_admin)
+            elif command == '/extrato':
+                self._cmd_extrato(chat_id, body, is_admin)
+            elif command == '/lote':
+                self._cmd_lote(chat_id, body, is_admin)
             
-            # Processamento de Mídia
+            # Processamento de Mídia (assíncrono)
             elif data.get('type') == 'image':
-                self._handle_image(chat_id, data.get('body'), is_admin)
-            elif data.get('type') == 'document':
-                self._handle_document(chat_id, data, is_admin)
+                return self._enqueue_receipt('image', self._handle_image, chat_id, data.get('body'), is_admin)
+            elif data.get('type') == 'document' and is_admin and _eh_csv(data):
+                return self._enqueue_receipt('csv', self._handle_csv, chat_id, data.get('body'), is_admin)
+            elif data.get('type') == 'document' and 'pdf' in data.get('mimetype', ''):
+                return self._enqueue_receipt('document', self._handle_document, chat_id, data.get('body'), is_admin)
+        return None
+
+    def _enqueue_receipt(self, kind: str, handler, chat_id: str, body: Any, is_admin: bool) -> Optional[str]:
+        """
+        Aplica o filtro de segurança e envia a mídia para a fila de processamento.
+        Propaga QueueFullError para o webhook sinalizar backpressure ao WPPConnect.
+        """
+        target_num = chat_id.split('@')[0]
+
+        # Filtro de Segurança (antes de ocupar a fila)
+        if not is_admin and not self.db.cliente_existe(target_num):
+            return None
+
+        # A fila guarda os bytes decodificados (em disco se grandes), não a string Base64
+        try:
+            with tracing.span('media.decode') as span:
+                media = MediaBuffer.from_base64(body or '')
+                span.set(bytes=len(media))
+        except ValueError as e:
+            logger.warning(f"Mídia ({kind}) de {target_num} descartada: {e}")
+            return None
+
+        try:
+            # O job continua o trace desta mensagem (mesmo ID de correlação) no worker
+            job = tracing.continue_in_job(handler, f"receipt.{kind}")
+            job_id = self.receipt_queue.submit(kind, job, chat_id, media, is_admin)
+        except QueueFullError:
+            media.close()
+            raise
+        logger.info(f"Comprovante ({kind}) de {target_num} enfileirado. Job: {job_id}")
+        return job_id
 
     def _handle_poll(self, data: Dict, chat_id: str, is_admin: bool) -> None:
         opts = data.get('selectedOptions', [])
-        if not opts or chat_id not in self.pending_confirmations:
+        if not opts:
             return
 
+        # Consumo atômico: a enquete é resolvida uma única vez, em qualquer processo
+        info = self.db.consumir_confirmacao(chat_id, wpp_gateway.message_id(data.get('msgId')))
         choice = opts[0].get('name') if isinstance(opts[0], dict) else str(opts[0])
+        if not info:
+            # Expirada, já respondida ou não identificável: nunca aplicar outra pendente
+            if "Confirmar" in choice:
+                self.send_text(chat_id, "⌛ Enquete expirada ou já respondida. Nada foi gravado; envie o comando de novo.")
+            return
         
-        if "Confirmar" in choice:
-            info = self.pending_confirmations.pop(chat_id)
+        if "Confirmar" in choice and info.get('lote'):
+            self._aplicar_lote(chat_id, Lote.from_dict(info))
+        elif "Confirmar" in choice:
             saldo_ant, saldo_novo = self.db.registrar_transacao(info)
             
             # Feedback Matemático
@@ -106,7 +197,6 @@ class FinanceBot:
                 # Log para Admin
                 self.send_text(Config.ADMIN_JID, f"📢 LOG: {info['numero']}\n{msg}")
         else:
-            self.pending_confirmations.pop(chat_id)
             self.send_text(chat_id, "🚫 Operação cancelada.")
 
     def _cmd_saldo(self, chat_id: str, body: str, is_admin: bool) -> None:
@@ -124,7 +214,7 @@ class FinanceBot:
             status = "✅ *Tudo em dia!*" if saldo_int == 0 else f"💎 *Crédito: R${abs(saldo_int)}*"
             self.send_text(chat_id, f"{status}\nSem pendências atuais.")
         else:
-            venc_str = vencimento if vencimento else "_A definir_"
+            venc_str = iso_to_br(vencimento) if vencimento else "_A definir_"
             msg = (f"💳 *Extrato Financeiro*\n"
                    f"━━━━━━━━━━━━━━━━\n"
                    f"👤 Cliente: {target}\n"
@@ -163,7 +253,9 @@ class FinanceBot:
                 "  _Lança débito para um cliente específico._\n"
                 "  Ex: `/bf 556199998888 50`\n\n"
                 "• `/saldo [numero]`\n"
-                "  _Consulta o extrato de um cliente._\n\n"
+                "  _Consulta o saldo de um cliente._\n\n"
+                "• `/extrato [numero] [página]`\n"
+                "  _Histórico de lançamentos (mais recentes primeiro)._\n\n"
                 "🛠️ *GESTÃO DE CONTAS*\n"
                 "• `/bf set [numero] [valor]`\n"
                 "  _Define o saldo EXATO (sobrescreve)._\n"
@@ -173,8 +265,15 @@ class FinanceBot:
                 "  Ex: `/bf cobrar 556199998888 25/12`\n\n"
                 "• `/del [numero]`\n"
                 "  _Apaga cliente e histórico._\n\n"
+                "📦 *EM MASSA*\n"
+                "• `/lote` + uma operação por linha\n"
+                "  _`[numero] [valor]`, `set [numero] [valor]` ou `cobrar [numero] [dd/mm]`._\n"
+                "  _Também aceita um CSV (colunas numero, valor, saldo, vencimento)._\n"
+                "  _Não misture `set` e ajuste do mesmo número; vencimentos entram por último._\n"
+                "  _Uma única enquete confirma tudo; clientes não são notificados._\n\n"
                 "📊 *RELATÓRIOS*\n"
-                "• `/listar` - Ranking de devedores."
+                "• `/listar [página]` - Ranking de devedores.\n"
+                "• `/listar top [n]` - Os N maiores devedores."
             )
             self.send_text(chat_id, msg)
             return
@@ -204,11 +303,11 @@ class FinanceBot:
             try:
                 val = float(val_str.replace(',', '.'))
                 sinal = "+" if val >= 0 else "-"
-                self.pending_confirmations[chat_id] = {
+                info = {
                     'numero': target, 'valor': abs(val), 'sinal': sinal,
                     'tipo': 'Manual Admin', 'id_id': f"MAN_{int(datetime.now().timestamp())}"
                 }
-                self.send_poll(chat_id, f"Lançar {sinal}R${int(abs(val))} para {target}?")
+                self._request_confirmation(chat_id, info, f"Lançar {sinal}R${int(abs(val))} para {target}?")
             except ValueError:
                 self.send_text(chat_id, "❌ Valor inválido.")
             return
@@ -225,11 +324,11 @@ class FinanceBot:
                 val = math.ceil(val + (val * (pct / 100)))
 
             target = chat_id.split('@')[0]
-            self.pending_confirmations[chat_id] = {
+            info = {
                 'numero': target, 'valor': val, 'sinal': sinal,
                 'tipo': 'Manual', 'id_id': f"MAN_{int(datetime.now().timestamp())}"
             }
-            self.send_poll(chat_id, f"Lançar R${int(val)} ({sinal})?")
+            self._request_confirmation(chat_id, info, f"Lançar R${int(val)} ({sinal})?")
         except ValueError:
             self.send_text(chat_id, "❌ Erro de formato.")
 
@@ -242,43 +341,136 @@ class FinanceBot:
         except IndexError:
             self.send_text(chat_id, "❌ Use: /del [numero]")
 
-    def _cmd_listar(self, chat_id: str, is_admin: bool) -> None:
+    def _cmd_listar(self, chat_id: str, body: str, is_admin: bool) -> None:
+        """/listar [página] ou /listar top [n]. Total e contagem vêm do SQLite; só a página é lida."""
         if not is_admin: return
-        devedores = self.db.get_devedores()
-        if not devedores:
+        parts = body.split()
+        quantidade, total = self.db.resumo_devedores()
+        if not quantidade:
             self.send_text(chat_id, "✅ Nenhuma dívida ativa.")
             return
-            
-        msg = "📋 *Ranking de Devedores*\n\n"
-        total = 0.0
-        for num, saldo in devedores:
-            msg += f"👤 {num}: R${int(saldo)}\n"
-            total += saldo
-        msg += f"\n💰 *Total: R${int(total)}*"
-        self.send_text(chat_id, msg)
 
-    def _handle_document(self, chat_id: str, data: Dict, is_admin: bool) -> None:
-        mimetype = data.get('mimetype', '')
-        if 'pdf' in mimetype:
-            logger.info(f"PDF recebido de {chat_id}. Convertendo...")
-            img_base64 = self.ai.pdf_to_image(data.get('body'))
-            if img_base64:
-                self._handle_image(chat_id, img_base64, is_admin)
+        if len(parts) > 1 and parts[1].lower() == 'top':
+            limite = min(_numero_pagina(parts[2] if len(parts) > 2 else '', 10), Config.REPORT_MAX_TOP, quantidade)
+            offset, titulo, rodape = 0, f"📋 *Top {limite} Devedores*", None
+        else:
+            paginas = math.ceil(quantidade / Config.REPORT_PAGE_SIZE)
+            pagina = min(_numero_pagina(parts[1] if len(parts) > 1 else '1'), paginas)
+            limite, offset = Config.REPORT_PAGE_SIZE, (pagina - 1) * Config.REPORT_PAGE_SIZE
+            titulo = f"📋 *Ranking de Devedores* (página {pagina}/{paginas})"
+            rodape = f"➡️ Próxima: `/listar {pagina + 1}`" if pagina < paginas else None
+
+        linhas = [titulo, ""]
+        for posicao, (num, saldo) in enumerate(self.db.get_devedores(limite, offset), offset + 1):
+            linhas.append(f"{posicao}. 👤 {num}: R${int(saldo)}")
+        linhas += ["", f"💰 *Total: R${int(total)}* ({quantidade} clientes)"]
+        if rodape:
+            linhas.append(rodape)
+        self.send_text(chat_id, "\n".join(linhas))
+
+    def _cmd_extrato(self, chat_id: str, body: str, is_admin: bool) -> None:
+        """/extrato [página] (próprio cliente) ou /extrato [numero] [página] (admin)."""
+        target = chat_id.split('@')[0]
+        pagina_str = '1'
+        for arg in body.split()[1:]:
+            # Mesmo critério do /bf: argumentos longos são números de telefone
+            if is_admin and len(arg) > 9:
+                target = arg
             else:
-                self.send_text(chat_id, "❌ Falha ao ler PDF.")
+                pagina_str = arg
+
+        quantidade = self.db.contar_transacoes(target)
+        if not quantidade:
+            self.send_text(chat_id, f"📭 Nenhuma movimentação para {target}.")
+            return
+
+        paginas = math.ceil(quantidade / Config.REPORT_PAGE_SIZE)
+        pagina = min(_numero_pagina(pagina_str), paginas)
+        historico = self.db.get_extrato(target, Config.REPORT_PAGE_SIZE, (pagina - 1) * Config.REPORT_PAGE_SIZE)
+
+        linhas = [f"🧾 *Extrato de {target}* (página {pagina}/{paginas})", "━━━━━━━━━━━━━━━━"]
+        for _, data_registro, tipo, valor, saldo_ant, saldo_novo in historico:
+            sinal = "-" if saldo_novo < saldo_ant else "+"
+            # 'AAAA-MM-DD HH:MM:SS' -> 'dd/mm/aa HH:MM'
+            quando = (f"{data_registro[8:10]}/{data_registro[5:7]}/{data_registro[2:4]} {data_registro[11:16]}"
+                      if data_registro else "?")
+            linhas.append(f"{quando} • {tipo}\n   {sinal} R${int(valor)} → R${int(saldo_novo)}")
+        if pagina < paginas:
+            proxima = f"{target} {pagina + 1}" if is_admin else str(pagina + 1)
+            linhas += ["", f"➡️ Mais antigas: `/extrato {proxima}`"]
+        self.send_text(chat_id, "\n".join(linhas))
+
+    def _cmd_lote(self, chat_id: str, body: str, is_admin: bool) -> None:
+        """/lote seguido de uma operação por linha (mesma sintaxe do /bf)."""
+        if not is_admin: return
+        linhas = body.splitlines()
+        # A primeira linha pode ter uma operação depois do comando
+        linhas[0] = linhas[0].strip()[len('/lote'):]
+        try:
+            lote = bulk_import.parse_linhas(linhas, Config.BULK_MAX_ROWS)
+        except LoteInvalido as e:
+            self.send_text(chat_id, bulk_import.formatar_erros(e))
+            return
+        self._request_confirmation(chat_id, lote.to_dict(), lote.resumo())
+
+    @tracing.traced('handle_csv')
+    def _handle_csv(self, chat_id: str, media: MediaBuffer, is_admin: bool) -> None:
+        """Lote enviado como documento CSV pelo admin (executado pelos workers da fila)."""
+        with media:
+            conteudo = media.getvalue()
+        try:
+            lote = bulk_import.parse_csv(conteudo, Config.BULK_MAX_ROWS)
+        except LoteInvalido as e:
+            self.send_text(chat_id, bulk_import.formatar_erros(e))
+            return
+        logger.info(f"Lote CSV recebido: {len(lote)} operações para {lote.clientes()} clientes.")
+        self._request_confirmation(chat_id, lote.to_dict(), lote.resumo())
 
-    def _handle_image(self, chat_id: str, base64_img: str, is_admin: bool) -> None:
+    def _aplicar_lote(self, chat_id: str, lote: Lote) -> None:
+        try:
+            ajustes, saldos, vencimentos = self.db.aplicar_lote(lote.ajustes, lote.saldos, lote.vencimentos)
+        except Exception as e:
+            logger.error(f"Erro ao aplicar lote: {e}")
+            self.send_text(chat_id, "❌ Falha ao aplicar o lote. Nada foi gravado.")
+            return
+
+        msg = (f"✅ *Lote aplicado* ({lote.clientes()} clientes)\n\n"
+               f"Ajustes: {ajustes}\n"
+               f"Saldos definidos: {saldos}\n"
+               f"Vencimentos: {vencimentos}")
+        if vencimentos < len(lote.vencimentos):
+            msg += f"\n⚠️ {len(lote.vencimentos) - vencimentos} vencimento(s) ignorado(s): cliente sem cadastro."
+        self.send_text(chat_id, msg)
+
+    @tracing.traced('handle_document')
+    def _handle_document(self, chat_id: str, media: MediaBuffer, is_admin: bool) -> None:
         target_num = chat_id.split('@')[0]
+        logger.info(f"PDF recebido de {target_num}. Extraindo...")
+        with media:
+            dados = self.ai.extract_from_pdf(media)
+        if dados == "PDF_ERROR":
+            OCR_RESULTS.inc(_resultado_ocr(dados))
+            self.send_text(chat_id, "❌ Falha ao ler PDF.")
+            return
+        self._process_receipt(chat_id, dados)
 
-        # 1. Filtro de Segurança
-        if not is_admin and not self.db.cliente_existe(target_num):
-            return 
+    @tracing.traced('handle_image')
+    def _handle_image(self, chat_id: str, media: MediaBuffer, is_admin: bool) -> None:
+        """Executado pelos workers da fila (filtro de segurança já aplicado no enfileiramento)."""
+        target_num = chat_id.split('@')[0]
 
-        # 2. Processamento Silencioso (Não avisa nada ainda)
+        # Processamento Silencioso (Não avisa nada ainda)
         logger.info(f"Processando imagem recebida de {target_num}...")
-        dados = self.ai.extract_data(base64_img)
-        
-        # 3. Decisão baseada no retorno da IA
+        with media:
+            dados = self.ai.extract_image(media)
+        self._process_receipt(chat_id, dados)
+
+    def _process_receipt(self, chat_id: str, dados: Union[Dict, str, None]) -> None:
+        """Decide o destino do comprovante a partir do resultado da extração (IA ou texto)."""
+        target_num = chat_id.split('@')[0]
+        OCR_RESULTS.inc(_resultado_ocr(dados))
+
+        # Decisão baseada no retorno da extração
         if isinstance(dados, dict):
             # CENÁRIO: É UM COMPROVANTE VÁLIDO
             
@@ -297,7 +489,7 @@ class FinanceBot:
             val = math.ceil(dados['valor'])
             
             # Prepara objeto de confirmação para o Admin
-            self.pending_confirmations[Config.ADMIN_JID] = {
+            info = {
                 'numero': target_num,     
                 'valor': val, 
                 'sinal': '-',
@@ -316,7 +508,7 @@ class FinanceBot:
                          f"🆔 ID: ...{str(dados.get('id_transacao'))[-6:]}\n\n"
                          f"Confirmar abatimento?")
             
-            self.send_poll(Config.ADMIN_JID, msg_admin)
+            self._request_confirmation(Config.ADMIN_JID, info, msg_admin)
             
         elif dados == "INVALID_RECEIVER":
             # CENÁRIO: Comprovante, mas conta errada
@@ -0,0 +1,228 @@
+import io
+import re
+import math
+import csv
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from database import to_iso_date
+from receipt_parsers import fold
+
+_NAO_DIGITO = re.compile(r'\D')
+# '1.234' / '-12.345.678': pontos como separador de milhar (padrão brasileiro, como em '1.234,56')
+_MILHAR = re.compile(r'[+-]?\d{1,3}(\.\d{3})+')
+
+# Colunas aceitas no CSV (cabeçalho sem acento/maiúsculas) -> campo do lote
+_COLUNAS = {
+    'numero': 'numero', 'telefone': 'numero', 'cliente': 'numero',
+    'valor': 'valor', 'ajuste': 'valor',
+    'saldo': 'saldo',
+    'vencimento': 'vencimento', 'cobrar': 'vencimento',
+}
+
+# Erros listados na resposta ao admin (o restante só é contado)
+MAX_ERROS_EXIBIDOS = 10
+
+
+class LoteInvalido(ValueError):
+    """Lote com linhas inválidas ou vazio; `erros` traz (linha, motivo)."""
+
+    def __init__(self, erros: List[Tuple[int, str]]):
+        super().__init__(f"{len(erros)} linha(s) inválida(s)")
+        self.erros = erros
+
+
+@dataclass
+class Lote:
+    """
+    Operações em massa do admin, já validadas. Serializável em JSON (vai para
+    a confirmação pendente) no mesmo formato consumido por Database.aplicar_lote.
+    """
+    ajustes: List[Dict] = field(default_factory=list)
+    saldos: List[Tuple[str, float]] = field(default_factory=list)
+    vencimentos: List[Tuple[str, str]] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.ajustes) + len(self.saldos) + len(self.vencimentos)
+
+    def clientes(self) -> int:
+        return len({n for n, _ in self.saldos} | {d['numero'] for d in self.ajustes}
+                   | {n for n, _ in self.vencimentos})
+
+    def resumo(self) -> str:
+        """Texto da enquete de confirmação (uma única para o lote inteiro)."""
+        debitos = sum(d['valor'] for d in self.ajustes if d['sinal'] == '+')
+        abatimentos = sum(d['valor'] for d in self.ajustes if d['sinal'] == '-')
+        partes = []
+        if self.ajustes:
+            partes.append(f"{len(self.ajustes)} ajustes (+R${int(debitos)} / -R${int(abatimentos)})")
+        if self.saldos:
+            partes.append(f"{len(self.saldos)} saldos definidos")
+        if self.vencimentos:
+            partes.append(f"{len(self.vencimentos)} vencimentos")
+        return f"Aplicar lote para {self.clientes()} clientes? " + ", ".join(partes)
+
+    def to_dict(self) -> Dict:
+        return {'lote': True, 'ajustes': self.ajustes, 'saldos': self.saldos, 'vencimentos': self.vencimentos}
+
+    @classmethod
+    def from_dict(cls, dados: Dict) -> "Lote":
+        return cls(dados['ajustes'], [tuple(s) for s in dados['saldos']],
+                   [tuple(v) for v in dados['vencimentos']])
+
+
+def _numero(texto: str) -> str:
+    numero = _NAO_DIGITO.sub('', texto)
+    # Mesmo critério do /bf remoto: números de telefone têm mais de 9 dígitos
+    if len(numero) <= 9:
+        raise ValueError(f"número inválido: {texto!r}")
+    return numero
+
+
+def _valor(texto: str) -> float:
+    """
+    Aceita '150', '-50', '10.5', '10,50', '1.234' e '1.234,56' (com ou sem 'R$').
+    Ponto seguido de exatamente três dígitos é milhar ('1.234' = 1234).
+    """
+    limpo = texto.replace('R$', '').replace(' ', '')
+    if ',' in limpo:
+        limpo = limpo.replace('.', '').replace(',', '.')
+    elif _MILHAR.fullmatch(limpo):
+        limpo = limpo.replace('.', '')
+    try:
+        valor = float(limpo)
+    except ValueError:
+        raise ValueError(f"valor inválido: {texto!r}")
+    # float() aceita 'nan', 'inf' e '1e400' (estoura para inf)
+    if not math.isfinite(valor):
+        raise ValueError(f"valor inválido: {texto!r}")
+    return valor
+
+
+class _Montador:
+    def __init__(self, max_linhas: int):
+        self.lote = Lote()
+        self.erros: List[Tuple[int, str]] = []
+        self.max_linhas = max_linhas
+        # IDs únicos por lote (id_comprovante é UNIQUE no histórico)
+        self._prefixo = f"LOTE_{uuid.uuid4().hex[:12]}"
+
+    def ajuste(self, numero: str, valor: str) -> None:
+        val = _valor(valor)
+        self.lote.ajustes.append({
+            'numero': _numero(numero), 'valor': abs(val), 'sinal': '+' if val >= 0 else '-',
+            'tipo': 'Lote Admin', 'id_id': f"{self._prefixo}_{len(self.lote.ajustes)}"
+        })
+
+    def saldo(self, numero: str, valor: str) -> None:
+        self.lote.saldos.append((_numero(numero), _valor(valor)))
+
+    def vencimento(self, numero: str, data: str) -> None:
+        try:
+            iso = to_iso_date(data)
+        except (ValueError, IndexError):
+            raise ValueError(f"data inválida: {data!r}")
+        self.lote.vencimentos.append((_numero(numero), iso))
+
+    def erro(self, linha: int, motivo: str) -> None:
+        self.erros.append((linha, motivo))
+
+    def resultado(self) -> Lote:
+        # Saldos são aplicados antes dos ajustes: misturar os dois no mesmo cliente perderia a ordem
+        ajustados = {d['numero'] for d in self.lote.ajustes}
+        for numero in dict.fromkeys(n for n, _ in self.lote.saldos if n in ajustados):
+            self.erros.append((0, f"{numero}: 'set' e ajuste no mesmo lote; use apenas um dos dois"))
+        if not self.lote and not self.erros:
+            self.erros.append((0, "nenhuma operação encontrada"))
+        if len(self.lote) > self.max_linhas:
+            self.erros.append((0, f"mais de {self.max_linhas} operações"))
+        if self.erros:
+            raise LoteInvalido(self.erros)
+        return self.lote
+
+
+def parse_linhas(linhas: Iterable[str], max_linhas: int = 50000) -> Lote:
+    """
+    Lote em texto (comando /lote), uma operação por linha, com a mesma sintaxe do /bf:
+        [numero] [valor]          ajuste (+ débito / - abatimento)
+        set [numero] [valor]      saldo exato
+        cobrar [numero] [dd/mm]   vencimento
+    Linhas vazias ou iniciadas por '#' são ignoradas. Um mesmo cliente não pode
+    ter `set` e ajuste no lote; vencimentos são aplicados por último. Levanta LoteInvalido.
+    """
+    montador = _Montador(max_linhas)
+    for n, linha in enumerate(linhas, 1):
+        partes = linha.split()
+        if not partes or partes[0].startswith('#'):
+            continue
+        acao = partes[0].lower()
+        try:
+            if acao == 'set' and len(partes) == 3:
+                montador.saldo(partes[1], partes[2])
+            elif acao == 'cobrar' and len(partes) == 3:
+                montador.vencimento(partes[1], partes[2])
+            elif len(partes) == 2:
+                montador.ajuste(partes[0], partes[1])
+            else:
+                raise ValueError("formato não reconhecido")
+        except ValueError as e:
+            montador.erro(n, str(e))
+    return montador.resultado()
+
+
+def _decodificar(conteudo: bytes) -> str:
+    try:
+        return conteudo.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        # Excel em português costuma salvar em Windows-1252
+        return conteudo.decode('cp1252', errors='replace')
+
+
+def parse_csv(conteudo: bytes, max_linhas: int = 50000) -> Lote:
+    """
+    Lote em CSV (documento enviado pelo admin). Separador ',', ';' ou tab, com
+    cabeçalho: `numero` obrigatório e ao menos uma de `valor` (ajuste),
+    `saldo` (saldo exato) ou `vencimento`. Uma linha pode preencher várias,
+    exceto `saldo` e `valor` para o mesmo cliente (como em parse_linhas).
+    Levanta LoteInvalido.
+    """
+    texto = _decodificar(conteudo)
+    try:
+        dialeto = csv.Sniffer().sniff(texto[:4096], delimiters=',;\t')
+    except csv.Error:
+        dialeto = csv.excel
+
+    leitor = csv.reader(io.StringIO(texto), dialeto)
+    cabecalho = next(leitor, [])
+    campos: List[Optional[str]] = [_COLUNAS.get(fold(c).strip()) for c in cabecalho]
+    if 'numero' not in campos or not {'valor', 'saldo', 'vencimento'} & set(campos):
+        raise LoteInvalido([(1, "cabeçalho deve ter 'numero' e 'valor', 'saldo' ou 'vencimento'")])
+
+    montador = _Montador(max_linhas)
+    for n, linha in enumerate(leitor, 2):
+        registro = {campo: valor.strip() for campo, valor in zip(campos, linha) if campo and valor.strip()}
+        if not registro:
+            continue
+        try:
+            numero = registro.get('numero', '')
+            if 'saldo' in registro:
+                montador.saldo(numero, registro['saldo'])
+            if 'valor' in registro:
+                montador.ajuste(numero, registro['valor'])
+            if 'vencimento' in registro:
+                montador.vencimento(numero, registro['vencimento'])
+            if registro.keys() == {'numero'}:
+                raise ValueError("linha sem valor, saldo ou vencimento")
+        except ValueError as e:
+            montador.erro(n, str(e))
+    return montador.resultado()
+
+
+def formatar_erros(erro: LoteInvalido) -> str:
+    linhas = [f"❌ Lote recusado: {erro}. Nada foi gravado.", ""]
+    for n, motivo in erro.erros[:MAX_ERROS_EXIBIDOS]:
+        linhas.append(f"• Linha {n}: {motivo}" if n else f"• {motivo}")
+    if len(erro.erros) > MAX_ERROS_EXIBIDOS:
+        linhas.append(f"... e mais {len(erro.erros) - MAX_ERROS_EXIBIDOS}.")
+    return "\n".join(linhas)
@@ -17,10 +17,102 @@ class Config:
         'Content-Type': 'application/json'
     }
 
+    # Gateway de saída (sessão HTTP compartilhada + fila ordenada por chat)
+    WPP_WORKERS = int(os.getenv("WPP_WORKERS", "4"))
+    WPP_QUEUE_SIZE = int(os.getenv("WPP_QUEUE_SIZE", "1000"))
+    WPP_POOL_SIZE = int(os.getenv("WPP_POOL_SIZE", "10"))
+    WPP_CONNECT_TIMEOUT = float(os.getenv("WPP_CONNECT_TIMEOUT", "5"))
+    WPP_READ_TIMEOUT = float(os.getenv("WPP_READ_TIMEOUT", "30"))
+
     # AI
     OLLAMA_URL = os.getenv("OLLAMA_URL")
     OLLAMA_MODEL = os.getenv("OLLAMA_MODEL")
 
+    # Pool de servidores Ollama (separados por vírgula; padrão: OLLAMA_URL)
+    OLLAMA_URLS = [u.strip() for u in os.getenv("OLLAMA_URLS", OLLAMA_URL or "").split(",") if u.strip()]
+    # Requisições simultâneas por servidor (um valor para todos ou um por URL)
+    OLLAMA_BACKEND_CONCURRENCY = [int(n) for n in os.getenv("OLLAMA_BACKEND_CONCURRENCY", "1").split(",") if n.strip()]
+    OLLAMA_FAILURE_THRESHOLD = int(os.getenv("OLLAMA_FAILURE_THRESHOLD", "3"))
+    OLLAMA_CIRCUIT_COOLDOWN = float(os.getenv("OLLAMA_CIRCUIT_COOLDOWN", "30"))
+    OLLAMA_RETRIES = int(os.getenv("OLLAMA_RETRIES", "1"))
+
+    # Streaming com parada antecipada assim que o JSON fecha
+    OLLAMA_STREAM = os.getenv("OLLAMA_STREAM", "true").lower() == "true"
+    OLLAMA_NUM_PREDICT = int(os.getenv("OLLAMA_NUM_PREDICT", "256"))
+
+    # Residência do modelo na VRAM (segundos de inatividade até descarregar; 0 = descarrega após cada uso)
+    OLLAMA_KEEP_ALIVE = int(os.getenv("OLLAMA_KEEP_ALIVE", "600"))
+    # Horas (ex: "9,14") para pré-aquecer o modelo, com antecedência em minutos
+    OLLAMA_PREWARM_HOURS = os.getenv("OLLAMA_PREWARM_HOURS", "")
+    OLLAMA_PREWARM_LEAD_MINUTES = int(os.getenv("OLLAMA_PREWARM_LEAD_MINUTES", "5"))
+    # Acima deste tempo de carga (ms) a requisição conta como carga fria
+    OLLAMA_COLD_LOAD_MS = int(os.getenv("OLLAMA_COLD_LOAD_MS", "500"))
+
+    # Confiança mínima (0-1) para aceitar uma regra de banco sem chamar a IA
+    RECEIPT_RULES_MIN_CONFIDENCE = float(os.getenv("RECEIPT_RULES_MIN_CONFIDENCE", "0.8"))
+
+    # Cache de OCR (comprovantes reenviados), salvo em ocr_cache.db ao lado do finance.db
+    OCR_CACHE_MAX_ENTRIES = int(os.getenv("OCR_CACHE_MAX_ENTRIES", "5000"))
+    OCR_CACHE_MAX_AGE_DAYS = int(os.getenv("OCR_CACHE_MAX_AGE_DAYS", "90"))
+
+    # Pré-processamento de imagem antes da IA
+    IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1280"))
+    IMAGE_GRAYSCALE = os.getenv("IMAGE_GRAYSCALE", "false").lower() == "true"
+    IMAGE_AUTOCROP = os.getenv("IMAGE_AUTOCROP", "true").lower() == "true"
+    IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+
+    # Mídias acima deste tamanho (bytes) vão para arquivo temporário em disco
+    MEDIA_SPOOL_MAX_BYTES = int(os.getenv("MEDIA_SPOOL_MAX_BYTES", str(1024 * 1024)))
+
+    # Fila de Comprovantes (processamento assíncrono)
+    RECEIPT_WORKERS = int(os.getenv("RECEIPT_WORKERS", "1"))
+    RECEIPT_QUEUE_SIZE = int(os.getenv("RECEIPT_QUEUE_SIZE", "50"))
+
+    # Agendador de cobranças
+    SCHEDULER_RESYNC_SECONDS = int(os.getenv("SCHEDULER_RESYNC_SECONDS", "900"))
+    SCHEDULER_RETRY_SECONDS = int(os.getenv("SCHEDULER_RETRY_SECONDS", "600"))
+    # Checagem do contador de alterações do banco (escritas de outros workers; 0 = desligada)
+    SCHEDULER_CHANGE_POLL_SECONDS = float(os.getenv("SCHEDULER_CHANGE_POLL_SECONDS", "2"))
+    # Com vários workers, só o líder (lease no SQLite) roda o agendador
+    SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() == "true"
+    LEADER_LEASE_SECONDS = float(os.getenv("LEADER_LEASE_SECONDS", "30"))
+
+    # Disparo dos avisos (envios simultâneos, limite de vazão e novas tentativas)
+    REMINDER_WORKERS = int(os.getenv("REMINDER_WORKERS", "4"))
+    REMINDER_RATE_PER_SECOND = float(os.getenv("REMINDER_RATE_PER_SECOND", "1.0"))
+    REMINDER_BURST = int(os.getenv("REMINDER_BURST", "5"))
+    REMINDER_RETRIES = int(os.getenv("REMINDER_RETRIES", "2"))
+    REMINDER_BACKOFF_SECONDS = float(os.getenv("REMINDER_BACKOFF_SECONDS", "2.0"))
+    REMINDER_SEND_TIMEOUT = float(os.getenv("REMINDER_SEND_TIMEOUT", "15"))
+
+    # Webhook: segundos que os IDs de mensagem ficam no SQLite para descartar reenvios (todos os workers)
+    WEBHOOK_DEDUPE_TTL = float(os.getenv("WEBHOOK_DEDUPE_TTL", "600"))
+
+    # Cache em memória de saldo/vencimento por cliente (bytes; 0 = desligado). Escritas de
+    # outros processos são detectadas pelo contador de alterações a cada CHECK_SECONDS
+    CUSTOMER_CACHE_MAX_BYTES = int(os.getenv("CUSTOMER_CACHE_MAX_BYTES", str(4 * 1024 * 1024)))
+    CUSTOMER_CACHE_CHECK_SECONDS = float(os.getenv("CUSTOMER_CACHE_CHECK_SECONDS", "1.0"))
+
+    # Linhas por página nos relatórios (/listar, /extrato) e limite do /listar top
+    REPORT_PAGE_SIZE = int(os.getenv("REPORT_PAGE_SIZE", "20"))
+    REPORT_MAX_TOP = int(os.getenv("REPORT_MAX_TOP", "100"))
+
+    # Operações por lote (/lote ou CSV enviado pelo admin)
+    BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", "50000"))
+
+    # Confirmações pendentes (enquetes) expiram após este tempo
+    CONFIRMATION_TTL_SECONDS = int(os.getenv("CONFIRMATION_TTL_SECONDS", "86400"))
+
+    # Rastreamento: traces acima de TRACE_SLOW_MS vão para TRACE_SLOW_LOG com todos os spans
+    TRACE_ENABLED = os.getenv("TRACE_ENABLED", "true").lower() == "true"
+    TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "10000"))
+    TRACE_SLOW_LOG = os.getenv("TRACE_SLOW_LOG", "slow_requests.log")
+    # Profiler por amostragem (ligado sob demanda em /debug/profiler)
+    PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "10"))
+    PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "300"))
+    # Token exigido no header X-Debug-Token pelos endpoints /debug (vazio = desabilitados)
+    DEBUG_TOKEN = os.getenv("DEBUG_TOKEN", "")
+
     # Business Logic
     ADMIN_PHONE = os.getenv("ADMIN_PHONE")
     # Garante formato JID (apenas números + @c.us)
@@ -0,0 +1,156 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import metrics
+
+LOOKUPS = metrics.counter('financebot_customer_cache_lookups', 'Consultas ao cache de clientes por resultado.',
+                          ['result'])
+
+# Linha em cache: (saldo, vencimento) ou None para "cliente não existe" (entrada negativa)
+Linha = Optional[Tuple[float, Optional[str]]]
+
+# Custo aproximado de um nó do OrderedDict (ponteiros, hash e entrada da tabela)
+_OVERHEAD_ENTRADA = 104
+
+
+def _custo(numero: str, linha: Linha) -> int:
+    custo = sys.getsizeof(numero) + _OVERHEAD_ENTRADA
+    if linha is not None:
+        custo += sys.getsizeof(linha) + sum(sys.getsizeof(v) for v in linha)
+    return custo
+
+
+class CustomerCache:
+    """
+    Cache em memória (LRU com limite em bytes) das linhas de `financeiro`
+    usadas por get_saldo/cliente_existe, incluindo entradas negativas.
+
+    Atualizado pelas escritas do próprio processo (write-through). Escritas de
+    outros processos são detectadas pelo contador `contadores.financeiro`
+    (mantido por triggers): quando ele muda sem que este processo saiba, o
+    cache inteiro é descartado.
+    """
+
+    def __init__(self, max_bytes: int = 4 * 1024 * 1024, check_interval: float = 1.0):
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self._entradas: "OrderedDict[str, Tuple[Linha, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        # Valor do contador de alterações refletido no cache (None = ainda não sincronizado)
+        self.versao: Optional[int] = None
+        self.ultima_checagem = 0.0
+        # Incrementada a cada escrita/descarte: leituras concorrentes não gravam valores antigos
+        self.geracao = 0
+        self._stats = {'hits': 0, 'negative_hits': 0, 'misses': 0, 'evictions': 0, 'flushes': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, numero: str) -> Tuple[bool, Linha]:
+        """Retorna (encontrado, linha). Linha None com encontrado=True é uma entrada negativa."""
+        with self._lock:
+            item = self._entradas.get(numero)
+            if item is None:
+                self._stats['misses'] += 1
+                resultado = 'miss'
+            else:
+                self._entradas.move_to_end(numero)
+                resultado = 'hit' if item[0] is not None else 'negative_hit'
+                self._stats['hits' if item[0] is not None else 'negative_hits'] += 1
+        LOOKUPS.inc(resultado)
+        return (False, None) if item is None else (True, item[0])
+
+    def put(self, numero: str, linha: Linha, geracao: int) -> None:
+        """Guarda o resultado de uma leitura feita quando `geracao` era a atual."""
+        with self._lock:
+            if geracao != self.geracao:
+                return  # Houve escrita/descarte durante a leitura: o valor lido pode estar velho
+            self._guardar(numero, linha)
+
+    def _guardar(self, numero: str, linha: Linha) -> None:
+        anterior = self._entradas.pop(numero, None)
+        if anterior is not None:
+            self._bytes -= anterior[1]
+        custo = _custo(numero, linha)
+        self._entradas[numero] = (linha, custo)
+        self._bytes += custo
+        while self._bytes > self.max_bytes and self._entradas:
+            _, (_, custo_antigo) = self._entradas.popitem(last=False)
+            self._bytes -= custo_antigo
+            self._stats['evictions'] += 1
+
+    def _limpar(self) -> None:
+        self._entradas.clear()
+        self._bytes = 0
+        self._stats['flushes'] += 1
+
+    def aplicar_escrita(self, antes: int, depois: int, linhas: Dict[str, Linha]) -> None:
+        """
+        Write-through após o commit. `antes`/`depois` são o contador de alterações
+        lido no início e no fim da transação (sob o lock de escrita).
+        """
+        with self._lock:
+            self.geracao += 1
+            if self.versao is not None and depois < self.versao:
+                # Commit antigo aplicado depois de um mais novo: só invalida
+                for numero in linhas:
+                    anterior = self._entradas.pop(numero, None)
+                    if anterior is not None:
+                        self._bytes -= anterior[1]
+                return
+            if antes != self.versao:
+                # Outro processo escreveu desde a última sincronização
+                self._limpar()
+            self.versao = depois
+            for numero, linha in linhas.items():
+                self._guardar(numero, linha)
+
+    def sincronizar(self, versao: int, agora: float) -> None:
+        """Descarta tudo se o contador de alterações mudou fora deste processo."""
+        with self._lock:
+            self.ultima_checagem = agora
+            if self.versao is not None and versao < self.versao:
+                return  # Leitura anterior a uma escrita já aplicada (o contador só cresce)
+            if versao != self.versao:
+                if self.versao is not None:
+                    self._limpar()
+                self.versao = versao
+                self.geracao += 1
+
+    def precisa_checar(self, agora: float) -> bool:
+        return agora - self.ultima_checagem >= self.check_interval
+
+    def invalidar(self, numeros: Iterable[str]) -> None:
+        with self._lock:
+            self.geracao += 1
+            for numero in numeros:
+                anterior = self._entradas.pop(numero, None)
+                if anterior is not None:
+                    self._bytes -= anterior[1]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            consultas = self._stats['hits'] + self._stats['negative_hits'] + self._stats['misses']
+            acertos = self._stats['hits'] + self._stats['negative_hits']
+            return {
+                **self._stats,
+                'entries': len(self._entradas),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hit_rate': round(acertos / consultas, 4) if consultas else 0.0,
+                'version': self.versao
+            }
+
+
+def from_config() -> CustomerCache:
+    from config import Config
+
+    return CustomerCache(
+        max_bytes=Config.CUSTOMER_CACHE_MAX_BYTES,
+        check_interval=Config.CUSTOMER_CACHE_CHECK_SECONDS
+    )
@@ -1,22 +1,298 @@
+import os
+import json
+import time
+import queue
 import sqlite3
 import math
 import logging
-from datetime import datetime
-from typing import Tuple, List, Optional, Any
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime
+from collections import deque
+from typing import Callable, Deque, Dict, Tuple, List, Optional, Any, Iterator
+
+import metrics
+import tracing
+import customer_cache
+from customer_cache import CustomerCache, Linha
 
 logger = logging.getLogger(__name__)
 
+DB_SECONDS = metrics.histogram('financebot_db_seconds', 'Duração das operações do Database.',
+                               ['method'], metrics.DB_BUCKETS)
+
+
+# Arredondamento para cima em SQL puro (equivalente a math.ceil, inclusive para negativos)
+_CEIL_SQL = "(CAST({x} AS INTEGER) + ({x} > CAST({x} AS INTEGER)))"
+
+_ATUALIZA_SALDO_SQL = """
+    UPDATE financeiro SET saldo = ?,
+        vencimento = CASE WHEN ? <= 0 THEN NULL ELSE vencimento END,
+        ultimo_aviso = CASE WHEN ? <= 0 THEN NULL ELSE ultimo_aviso END
+    WHERE numero = ?
+"""
+
+
+def to_iso_date(data_str: str, hoje: Optional[date] = None) -> str:
+    """
+    Converte 'dd/mm/aaaa' ou 'dd/mm' em 'AAAA-MM-DD'. Sem ano, usa a próxima
+    ocorrência a partir de hoje (inclusive). Levanta ValueError se inválida.
+    """
+    hoje = hoje or date.today()
+    partes = data_str.strip().split('/')
+    if len(partes) == 3:
+        return date(int(partes[2]), int(partes[1]), int(partes[0])).isoformat()
+    if len(partes) != 2:
+        raise ValueError(f"Data inválida: {data_str}")
+
+    dia, mes = int(partes[0]), int(partes[1])
+    try:
+        alvo = date(hoje.year, mes, dia)
+    except ValueError:
+        # 29/02 fora de ano bissexto: valida contra um ano bissexto e rola para frente
+        date(2000, mes, dia)
+        alvo = date(hoje.year, 3, 1)
+    if alvo < hoje:
+        ano = hoje.year + 1
+        try:
+            alvo = date(ano, mes, dia)
+        except ValueError:
+            alvo = date(ano, 3, 1)
+    return alvo.isoformat()
+
+
+def iso_to_br(data_iso: Optional[str]) -> Optional[str]:
+    """'AAAA-MM-DD' -> 'dd/mm' para exibição."""
+    if not data_iso or len(data_iso) < 10 or data_iso[4] != '-':
+        return data_iso
+    return f"{data_iso[8:10]}/{data_iso[5:7]}"
+
+
+@metrics.timed_methods(DB_SECONDS, exclude=('transaction', 'subscribe', 'close', 'cache_stats'))
+@tracing.traced_methods('db', exclude=('transaction', 'subscribe', 'close', 'cache_stats'))
 class Database:
-    def __init__(self, db_name: str = 'finance.db'):
+    # Callbacks de alteração de cobrança por arquivo de banco (compartilhados entre instâncias do processo)
+    _listeners: Dict[str, List[Callable[[str], None]]] = {}
+    # Cache de clientes por arquivo de banco (idem: bot, agendador e líder enxergam o mesmo)
+    _caches: Dict[str, CustomerCache] = {}
+    # Faixas (antes, depois) do contador produzidas por commits deste processo, por arquivo
+    _escritas: Dict[str, Deque[Tuple[int, int]]] = {}
+    _escritas_lock = threading.Lock()
+
+    def __init__(self, db_name: str = 'finance.db', pool_size: int = 4, busy_timeout_ms: int = 5000,
+                 cached_statements: int = 128, cache: Optional[CustomerCache] = None):
+        """`cache`: cache de clientes do arquivo (padrão: customer_cache.from_config())."""
         self.db_name = db_name
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+
+        # Pool pequeno de conexões persistentes (LIFO mantém as conexões "quentes")
+        self._pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=pool_size)
+        # Conexão emprestada pela thread atual (permite chamadas aninhadas na mesma transação)
+        self._local = threading.local()
         self._init_db()
 
-    def _get_connection(self) -> sqlite3.Connection:
-        return sqlite3.connect(self.db_name)
+        caminho = os.path.abspath(db_name)
+        if caminho not in self._caches:
+            self._caches[caminho] = cache or customer_cache.from_config()
+        self._cache = self._caches[caminho]
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Abre uma conexão em modo autocommit (transações explícitas via transaction()),
+        com WAL, synchronous=NORMAL e busy_timeout para leitores e escritores concorrentes.
+        """
+        conn = sqlite3.connect(
+            self.db_name,
+            timeout=self.busy_timeout_ms / 1000,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        return conn
+
+    @contextmanager
+    def _get_connection(self) -> Iterator[sqlite3.Connection]:
+        """Empresta uma conexão do pool (ou reutiliza a que a thread já segura)."""
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            yield held
+            return
+
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Transação explícita com BEGIN IMMEDIATE (reserva a escrita no início,
+        evitando 'database is locked' no meio da operação). Chamadas aninhadas
+        participam da transação externa.
+        """
+        with self._get_connection() as conn:
+            if conn.in_transaction:
+                yield conn
+                return
+
+            # Espera pelo lock de escrita (outro processo/thread escrevendo)
+            with tracing.span('db.lock_wait'):
+                conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def subscribe(self, callback: Callable[[str], None]) -> None:
+        """
+        Registra um callback chamado com o número do cliente sempre que saldo,
+        vencimento ou cadastro mudarem (após o commit). Vale para qualquer
+        instância de Database do processo que use o mesmo arquivo.
+        """
+        self._listeners.setdefault(os.path.abspath(self.db_name), []).append(callback)
+
+    def _notify(self, *numeros: str) -> None:
+        for callback in self._listeners.get(os.path.abspath(self.db_name), []):
+            for numero in numeros:
+                try:
+                    callback(numero)
+                except Exception as e:
+                    logger.error(f"Erro no listener do banco: {e}")
+
+    # --- Cache de clientes ---
+
+    @staticmethod
+    def _versao_clientes(conn: sqlite3.Connection) -> int:
+        """Contador de alterações de `financeiro` (incrementado pelos triggers da v5)."""
+        return conn.execute("SELECT valor FROM contadores WHERE nome = 'financeiro'").fetchone()[0]
+
+    @staticmethod
+    def _ler_clientes(conn: sqlite3.Connection, numeros: Tuple[str, ...]) -> Dict[str, Linha]:
+        linhas: Dict[str, Linha] = dict.fromkeys(numeros)
+        for i in range(0, len(numeros), 500):
+            bloco = numeros[i:i + 500]
+            marcadores = ",".join("?" * len(bloco))
+            for numero, saldo, vencimento in conn.execute(
+                f"SELECT numero, saldo, vencimento FROM financeiro WHERE numero IN ({marcadores})", bloco
+            ):
+                linhas[numero] = (saldo, vencimento)
+        return linhas
+
+    @contextmanager
+    def _escrita_clientes(self, *numeros: str) -> Iterator[sqlite3.Connection]:
+        """
+        Transação que altera `financeiro`: ao final lê as linhas gravadas e, após o
+        commit, atualiza o cache (write-through). Dentro de uma transação externa o
+        commit ainda não aconteceu, então apenas invalida; se ela for desfeita, a
+        próxima checagem do contador corrige o cache. A faixa do contador gravada
+        fica registrada para escritas_externas().
+        """
+        cache = self._cache
+        held = getattr(self._local, 'conn', None)
+        aninhada = held is not None and held.in_transaction
+        antes = depois = None
+        linhas: Dict[str, Linha] = {}
+
+        with self.transaction() as conn:
+            if not aninhada:
+                antes = self._versao_clientes(conn)
+            yield conn
+            if antes is not None:
+                depois = self._versao_clientes(conn)
+                if cache.enabled:
+                    linhas = self._ler_clientes(conn, numeros)
+
+        if antes is not None and depois != antes:
+            with self._escritas_lock:
+                self._escritas.setdefault(os.path.abspath(self.db_name), deque(maxlen=1024)).append((antes, depois))
+        if not cache.enabled:
+            return
+        if antes is not None:
+            cache.aplicar_escrita(antes, depois, linhas)
+        else:
+            cache.invalidar(numeros)
+
+    def _consultar_cache(self, numero: str) -> Tuple[bool, Linha]:
+        """Consulta o cache, descartando-o antes se outro processo alterou `financeiro`."""
+        cache = self._cache
+        if not cache.enabled:
+            return False, None
+        agora = time.monotonic()
+        if cache.precisa_checar(agora):
+            with self._get_connection() as conn:
+                cache.sincronizar(self._versao_clientes(conn), agora)
+        return cache.get(numero)
+
+    def _ler_cliente(self, numero: str) -> Linha:
+        """Lê (saldo, vencimento) do banco e guarda no cache (None = cliente inexistente)."""
+        geracao = self._cache.geracao
+        with self._get_connection() as conn:
+            linha = conn.execute(
+                "SELECT saldo, vencimento FROM financeiro WHERE numero = ?", (numero,)
+            ).fetchone()
+        if self._cache.enabled:
+            self._cache.put(numero, linha, geracao)
+        return linha
+
+    def contador_alteracoes(self) -> int:
+        """Contador de alterações de `financeiro` (muda a cada escrita de qualquer processo)."""
+        with self._get_connection() as conn:
+            return self._versao_clientes(conn)
+
+    def escritas_externas(self, desde: int) -> Tuple[int, bool]:
+        """
+        Retorna (contador atual, se outro processo alterou `financeiro` desde `desde`).
+        Os incrementos cobertos por commits deste processo não contam; na dúvida
+        (faixa perdida ou escrita aninhada não registrada), responde True.
+        """
+        atual = self.contador_alteracoes()
+        with self._escritas_lock:
+            faixas = sorted(f for f in self._escritas.get(os.path.abspath(self.db_name), ()) if f[0] >= desde)
+        versao = desde
+        for antes, depois in faixas:
+            if antes != versao:
+                break
+            versao = depois
+        return atual, versao < atual
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """Acertos, falhas, descartes e ocupação do cache de clientes deste processo."""
+        return self._cache.stats()
+
+    def close(self) -> None:
+        """Fecha as conexões ociosas do pool."""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
 
     def _init_db(self) -> None:
         """Inicializa o esquema do banco de dados e aplica migrações básicas."""
+        # Esquema já atualizado (ex: pelo processo mestre do gunicorn): só leitura, sem lock de escrita
         with self._get_connection() as conn:
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= self.SCHEMA_VERSION:
+                return
+
+        with self.transaction() as conn:
             cursor = conn.cursor()
             
             # Tabela de Clientes/Financeiro
@@ -46,11 +322,23 @@ class Database:
                     id_comprovante TEXT UNIQUE
                 )
             """)
-            conn.commit()
             self._run_migrations(conn)
 
     def _run_migrations(self, conn: sqlite3.Connection) -> None:
-        """Verifica e cria colunas ausentes para compatibilidade."""
+        """
+        Aplica, em ordem, as migrações com versão maior que `PRAGMA user_version`.
+        Roda dentro da transação de _init_db: processos concorrentes aplicam cada versão uma única vez.
+        """
+        versao = conn.execute("PRAGMA user_version").fetchone()[0]
+        for alvo, migracao in self.MIGRATIONS:
+            if alvo <= versao:
+                continue
+            migracao(self, conn)
+            conn.execute(f"PRAGMA user_version = {alvo}")
+            logger.info(f"Banco migrado para a versão {alvo}.")
+
+    def _migracao_colunas_legadas(self, conn: sqlite3.Connection) -> None:
+        """v1: Verifica e cria colunas ausentes para compatibilidade."""
         cursor = conn.cursor()
         columns = [
             ("financeiro", "vencimento", "TEXT"),
@@ -64,125 +352,481 @@ class Database:
                 cursor.execute(f"ALTER TABLE {table} ADD COLUMN {col} {dtype}")
             except sqlite3.OperationalError:
                 pass # Coluna já existe
-        conn.commit()
+
+    def _migracao_datas_iso_e_indices(self, conn: sqlite3.Connection) -> None:
+        """
+        v2: Datas em ISO 8601 (ordenáveis/consultáveis por intervalo) e índices
+        para duplicidade, cobranças, ranking e histórico por cliente.
+        """
+        # vencimento 'dd/mm' -> próxima ocorrência 'AAAA-MM-DD'
+        hoje = date.today()
+        rows = conn.execute(
+            "SELECT id, vencimento FROM financeiro WHERE vencimento IS NOT NULL AND vencimento NOT LIKE '____-__-__'"
+        ).fetchall()
+        convertidos = []
+        for row_id, venc in rows:
+            try:
+                convertidos.append((to_iso_date(venc, hoje), row_id))
+            except ValueError:
+                logger.warning(f"Vencimento inválido descartado na migração: {venc!r}")
+                convertidos.append((None, row_id))
+        conn.executemany("UPDATE financeiro SET vencimento = ? WHERE id = ?", convertidos)
+
+        # data_registro 'dd/mm/AAAA HH:MM:SS' -> 'AAAA-MM-DD HH:MM:SS'
+        conn.execute("""
+            UPDATE transacoes
+            SET data_registro = substr(data_registro, 7, 4) || '-' || substr(data_registro, 4, 2) || '-' ||
+                                substr(data_registro, 1, 2) || substr(data_registro, 11)
+            WHERE data_registro LIKE '__/__/____%'
+        """)
+
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_transacoes_data_comprovante ON transacoes (data_comprovante)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_transacoes_cliente ON transacoes (numero_cliente, id)")
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_financeiro_vencimento ON financeiro (vencimento)
+            WHERE vencimento IS NOT NULL
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_financeiro_devedores ON financeiro (saldo) WHERE saldo > 0")
+        conn.execute("ANALYZE")
+
+    def _migracao_confirmacoes_pendentes(self, conn: sqlite3.Connection) -> None:
+        """
+        v3: Confirmações pendentes (enquetes) compartilhadas entre processos,
+        identificadas pela mensagem da enquete e com expiração.
+        """
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS confirmacoes_pendentes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id TEXT NOT NULL,
+                poll_id TEXT UNIQUE,
+                dados TEXT NOT NULL,
+                criado_em REAL NOT NULL,
+                expira_em REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_confirmacoes_chat ON confirmacoes_pendentes (chat_id, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_confirmacoes_expira ON confirmacoes_pendentes (expira_em)")
+
+    def _migracao_leases(self, conn: sqlite3.Connection) -> None:
+        """v4: Leases com expiração para eleger um único processo líder (ex: agendador)."""
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS leases (
+                nome TEXT PRIMARY KEY,
+                dono TEXT NOT NULL,
+                expira_em REAL NOT NULL
+            )
+        """)
+
+    def _migracao_contador_clientes(self, conn: sqlite3.Connection) -> None:
+        """
+        v5: Contador de alterações de `financeiro`, mantido por triggers, para que
+        cada processo saiba quando descartar o cache de clientes.
+        """
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS contadores (
+                nome TEXT PRIMARY KEY,
+                valor INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        conn.execute("INSERT OR IGNORE INTO contadores (nome, valor) VALUES ('financeiro', 0)")
+        for evento in ("INSERT", "UPDATE OF numero, saldo, vencimento", "DELETE"):
+            sufixo = evento.split()[0].lower()
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_financeiro_{sufixo} AFTER {evento} ON financeiro
+                BEGIN
+                    UPDATE contadores SET valor = valor + 1 WHERE nome = 'financeiro';
+                END
+            """)
+
+    def _migracao_indice_ranking(self, conn: sqlite3.Connection) -> None:
+        """
+        v6: Índice de cobertura do ranking de devedores (saldo desc, número como
+        desempate): páginas, totais e contagem sem ler a tabela nem ordenar.
+        """
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_financeiro_ranking ON financeiro (saldo DESC, numero)
+            WHERE saldo > 0
+        """)
+        conn.execute("DROP INDEX IF EXISTS idx_financeiro_devedores")
+        conn.execute("ANALYZE")
+
+    def _migracao_eventos_webhook(self, conn: sqlite3.Connection) -> None:
+        """v7: IDs de eventos do webhook já aceitos (descarte de reenvios entre processos), com expiração."""
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS eventos_webhook (
+                chave TEXT PRIMARY KEY,
+                expira_em REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_eventos_webhook_expira ON eventos_webhook (expira_em)")
+
+    # (versão, migração) — nunca altere uma migração já publicada; acrescente uma nova
+    MIGRATIONS = [
+        (1, _migracao_colunas_legadas),
+        (2, _migracao_datas_iso_e_indices),
+        (3, _migracao_confirmacoes_pendentes),
+        (4, _migracao_leases),
+        (5, _migracao_contador_clientes),
+        (6, _migracao_indice_ranking),
+        (7, _migracao_eventos_webhook),
+    ]
+    SCHEMA_VERSION = MIGRATIONS[-1][0]
 
     def get_saldo(self, numero: str) -> Tuple[float, Optional[str]]:
         """Retorna (saldo, data_vencimento). Se não existir, retorna (0.0, None)."""
-        with self._get_connection() as conn:
-            res = conn.cursor().execute(
-                "SELECT saldo, vencimento FROM financeiro WHERE numero = ?", 
-                (numero,)
-            ).fetchone()
-            
-            if not res:
-                return 0.0, None
-            return res[0], res[1]
+        encontrado, res = self._consultar_cache(numero)
+        if not encontrado:
+            res = self._ler_cliente(numero)
+
+        if not res:
+            return 0.0, None
+        return res[0], res[1]
 
     def set_saldo(self, numero: str, valor: float) -> None:
         """Define um saldo absoluto para um cliente."""
-        with self._get_connection() as conn:
+        with self._escrita_clientes(numero) as conn:
             conn.cursor().execute("""
                 INSERT INTO financeiro (numero, saldo) VALUES (?, ?) 
                 ON CONFLICT(numero) DO UPDATE SET saldo=excluded.saldo
             """, (numero, valor))
-            conn.commit()
 
     def deletar_cliente(self, numero: str) -> None:
         """Remove permanentemente o cliente e seu histórico."""
-        with self._get_connection() as conn:
+        with self._escrita_clientes(numero) as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM financeiro WHERE numero = ?", (numero,))
             cursor.execute("DELETE FROM transacoes WHERE numero_cliente = ?", (numero,))
-            conn.commit()
+        self._notify(numero)
 
-    def get_devedores(self) -> List[Tuple[str, float]]:
-        """Retorna lista de clientes com saldo positivo (dívida)."""
+    def get_devedores(self, limite: Optional[int] = None, offset: int = 0) -> List[Tuple[str, float]]:
+        """
+        Retorna clientes com saldo positivo (dívida), do maior para o menor.
+        Com `limite`, devolve só uma página (LIMIT/OFFSET sobre idx_financeiro_ranking).
+        """
         with self._get_connection() as conn:
-            return conn.cursor().execute(
-                "SELECT numero, saldo FROM financeiro WHERE saldo > 0 ORDER BY saldo DESC"
+            return conn.execute(
+                "SELECT numero, saldo FROM financeiro WHERE saldo > 0 ORDER BY saldo DESC, numero LIMIT ? OFFSET ?",
+                (-1 if limite is None else limite, offset)
             ).fetchall()
 
-    def set_vencimento(self, numero: str, data_str: str) -> None:
+    def resumo_devedores(self) -> Tuple[int, float]:
+        """Retorna (quantidade, total) das dívidas ativas, calculados pelo SQLite."""
         with self._get_connection() as conn:
+            quantidade, total = conn.execute(
+                "SELECT COUNT(*), TOTAL(saldo) FROM financeiro WHERE saldo > 0"
+            ).fetchone()
+            return quantidade, total
+
+    def get_extrato(self, numero: str, limite: int, offset: int = 0) -> List[Tuple]:
+        """
+        Retorna uma página do histórico do cliente, da mais recente para a mais antiga:
+        (id, data_registro, tipo, valor, saldo_anterior, saldo_novo). Usa idx_transacoes_cliente.
+        """
+        with self._get_connection() as conn:
+            return conn.execute("""
+                SELECT id, data_registro, tipo, valor, saldo_anterior, saldo_novo FROM transacoes
+                WHERE numero_cliente = ? ORDER BY id DESC LIMIT ? OFFSET ?
+            """, (numero, limite, offset)).fetchall()
+
+    def contar_transacoes(self, numero: str) -> int:
+        with self._get_connection() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM transacoes WHERE numero_cliente = ?", (numero,)
+            ).fetchone()[0]
+
+    def set_vencimento(self, numero: str, data_str: str) -> None:
+        """Aceita 'dd/mm' ou 'dd/mm/aaaa'; grava em ISO. Levanta ValueError se a data for inválida."""
+        data_iso = to_iso_date(data_str)
+        with self._escrita_clientes(numero) as conn:
             conn.cursor().execute(
                 "UPDATE financeiro SET vencimento = ?, ultimo_aviso = NULL WHERE numero = ?", 
-                (data_str, numero)
+                (data_iso, numero)
             )
-            conn.commit()
+        self._notify(numero)
 
     def registrar_envio_aviso(self, numero: str, data_hoje: str) -> None:
-        with self._get_connection() as conn:
+        with self.transaction() as conn:
             conn.cursor().execute(
                 "UPDATE financeiro SET ultimo_aviso = ? WHERE numero = ?", 
                 (data_hoje, numero)
             )
-            conn.commit()
 
-    def get_pendentes_cobranca(self) -> List[Tuple]:
-        """Retorna clientes que possuem data de vencimento configurada."""
+    def registrar_envios_aviso(self, numeros: List[str], data_hoje: str) -> None:
+        """Marca o aviso do dia para vários clientes em uma única transação."""
+        if not numeros:
+            return
+        with self.transaction() as conn:
+            conn.cursor().executemany(
+                "UPDATE financeiro SET ultimo_aviso = ? WHERE numero = ?",
+                [(data_hoje, numero) for numero in numeros]
+            )
+
+    def get_pendentes_cobranca(self, inicio: str, fim: str, hoje: str) -> List[Tuple]:
+        """
+        Retorna clientes com vencimento (ISO) entre `inicio` e `fim` que ainda
+        não receberam aviso em `hoje`. Usa o índice idx_financeiro_vencimento.
+        """
+        with self._get_connection() as conn:
+            return conn.cursor().execute("""
+                SELECT numero, saldo, vencimento, ultimo_aviso FROM financeiro
+                WHERE vencimento BETWEEN ? AND ?
+                  AND (ultimo_aviso IS NULL OR ultimo_aviso <> ?)
+            """, (inicio, fim, hoje)).fetchall()
+
+    def get_agenda_cobranca(self, desde: str) -> List[Tuple[str, str, Optional[str]]]:
+        """Retorna (numero, vencimento, ultimo_aviso) de quem vence a partir de `desde` (ISO)."""
         with self._get_connection() as conn:
-            return conn.cursor().execute(
-                "SELECT numero, saldo, vencimento, ultimo_aviso FROM financeiro WHERE vencimento IS NOT NULL"
+            return conn.execute(
+                "SELECT numero, vencimento, ultimo_aviso FROM financeiro WHERE vencimento >= ?",
+                (desde,)
             ).fetchall()
 
+    def get_cobranca(self, numero: str) -> Optional[Tuple[str, Optional[str]]]:
+        """Retorna (vencimento, ultimo_aviso) do cliente, ou None se não houver vencimento."""
+        with self._get_connection() as conn:
+            return conn.execute(
+                "SELECT vencimento, ultimo_aviso FROM financeiro WHERE numero = ? AND vencimento IS NOT NULL",
+                (numero,)
+            ).fetchone()
+
+    def criar_confirmacao(self, chat_id: str, dados: dict, ttl: float) -> int:
+        """Guarda uma confirmação pendente e retorna seu ID (a enquete é vinculada depois)."""
+        now = time.time()
+        with self.transaction() as conn:
+            # Limpeza preguiçosa das expiradas (índice em expira_em)
+            conn.execute("DELETE FROM confirmacoes_pendentes WHERE expira_em <= ?", (now,))
+            cursor = conn.execute(
+                "INSERT INTO confirmacoes_pendentes (chat_id, dados, criado_em, expira_em) VALUES (?, ?, ?, ?)",
+                (chat_id, json.dumps(dados), now, now + ttl)
+            )
+            return cursor.lastrowid
+
+    def vincular_confirmacao(self, confirmacao_id: int, poll_id: str) -> None:
+        """Associa a confirmação à mensagem da enquete entregue pelo WPPConnect."""
+        with self.transaction() as conn:
+            conn.execute("UPDATE confirmacoes_pendentes SET poll_id = ? WHERE id = ?", (poll_id, confirmacao_id))
+
+    def consumir_confirmacao(self, chat_id: str, poll_id: Optional[str] = None) -> Optional[dict]:
+        """
+        Remove e retorna a confirmação respondida (DELETE ... RETURNING é atômico:
+        só um processo consome cada enquete). Com `poll_id`, só a própria enquete;
+        sem ele, a única confirmação sem enquete do chat — havendo mais de uma,
+        não há como saber qual foi respondida e nada é consumido.
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            if poll_id:
+                row = conn.execute(
+                    "DELETE FROM confirmacoes_pendentes WHERE poll_id = ? AND expira_em > ? RETURNING dados",
+                    (poll_id, now)
+                ).fetchall()
+            else:
+                ids = conn.execute("""
+                    SELECT id FROM confirmacoes_pendentes
+                    WHERE chat_id = ? AND expira_em > ? AND poll_id IS NULL LIMIT 2
+                """, (chat_id, now)).fetchall()
+                row = conn.execute(
+                    "DELETE FROM confirmacoes_pendentes WHERE id = ? RETURNING dados", (ids[0][0],)
+                ).fetchall() if len(ids) == 1 else None
+        return json.loads(row[0][0]) if row else None
+
+    def contar_confirmacoes_pendentes(self) -> int:
+        """Confirmações aguardando resposta do admin (não expiradas)."""
+        with self._get_connection() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM confirmacoes_pendentes WHERE expira_em > ?", (time.time(),)
+            ).fetchone()[0]
+
+    def reivindicar_evento(self, chave: str, ttl: float) -> bool:
+        """
+        Registra o evento do webhook por `ttl` segundos. Retorna False se outro
+        processo (ou esta mesma entrega) já o registrou e ele não expirou.
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            # Limpeza preguiçosa dos expirados (índice em expira_em)
+            conn.execute("DELETE FROM eventos_webhook WHERE expira_em <= ?", (now,))
+            cursor = conn.execute("INSERT OR IGNORE INTO eventos_webhook (chave, expira_em) VALUES (?, ?)",
+                                  (chave, now + ttl))
+            return cursor.rowcount == 1
+
+    def liberar_evento(self, chave: str) -> None:
+        """Esquece o evento: o próximo reenvio será aceito."""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM eventos_webhook WHERE chave = ?", (chave,))
+
+    def contar_eventos(self) -> int:
+        with self._get_connection() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM eventos_webhook WHERE expira_em > ?", (time.time(),)
+            ).fetchone()[0]
+
+    def adquirir_lease(self, nome: str, dono: str, ttl: float) -> bool:
+        """
+        Adquire ou renova o lease `nome` por `ttl` segundos. Só tem sucesso se o
+        lease estiver livre, expirado ou já pertencer a `dono`.
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute("""
+                INSERT INTO leases (nome, dono, expira_em) VALUES (?, ?, ?)
+                ON CONFLICT(nome) DO UPDATE SET dono = excluded.dono, expira_em = excluded.expira_em
+                WHERE leases.dono = excluded.dono OR leases.expira_em <= ?
+            """, (nome, dono, now + ttl, now))
+            atual = conn.execute("SELECT dono FROM leases WHERE nome = ?", (nome,)).fetchone()
+        return atual is not None and atual[0] == dono
+
+    def liberar_lease(self, nome: str, dono: str) -> None:
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM leases WHERE nome = ? AND dono = ?", (nome, dono))
+
     def check_duplicidade(self, id_transacao: str, data_comprovante: str) -> bool:
         """Verifica se o ID ou a Data do comprovante já existem no banco."""
+        # Duas buscas por índice (o OR em colunas diferentes forçaria varredura)
         with self._get_connection() as conn:
-            res = conn.cursor().execute(
-                "SELECT id FROM transacoes WHERE id_comprovante = ? OR data_comprovante = ?", 
-                (id_transacao, data_comprovante)
-            ).fetchone()
-            return res is not None
+            res = conn.cursor().execute("""
+                SELECT EXISTS (SELECT 1 FROM transacoes WHERE id_comprovante = ?)
+                    OR EXISTS (SELECT 1 FROM transacoes WHERE data_comprovante = ?)
+            """, (id_transacao, data_comprovante)).fetchone()
+            return bool(res[0])
 
     def cliente_existe(self, numero: str) -> bool:
-        with self._get_connection() as conn:
-            res = conn.cursor().execute("SELECT id FROM financeiro WHERE numero = ?", (numero,)).fetchone()
-            return res is not None
+        encontrado, res = self._consultar_cache(numero)
+        if not encontrado:
+            res = self._ler_cliente(numero)
+        return res is not None
         
     def registrar_transacao(self, dados: dict) -> Tuple[float, float]:
         """
         Registra uma transação financeira, atualiza o saldo e gera histórico.
         Retorna (saldo_anterior, novo_saldo).
+
+        O histórico é gravado com INSERT ... SELECT ... RETURNING, que lê o saldo
+        atual e calcula o novo (com arredondamento para cima) em um único passo,
+        dentro de uma transação BEGIN IMMEDIATE: confirmações concorrentes não
+        perdem atualizações.
         """
         numero = dados['numero']
         valor = float(dados['valor'])
-        sinal = dados['sinal']
-        
-        saldo_ant, _ = self.get_saldo(numero)
-        
-        # Cálculo financeiro seguro
-        if sinal == '+':
-            novo_saldo = math.ceil(saldo_ant + valor)
-        else:
-            novo_saldo = math.ceil(saldo_ant - valor)
-        
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Remove vencimento se a dívida for quitada (saldo <= 0)
-            limpeza_sql = ", vencimento = NULL, ultimo_aviso = NULL" if novo_saldo <= 0 else ""
-            
-            # Upsert do Saldo
-            cursor.execute(f"UPDATE financeiro SET saldo = ? {limpeza_sql} WHERE numero = ?", (novo_saldo, numero))
-            cursor.execute("INSERT OR IGNORE INTO financeiro (numero, saldo) VALUES (?, ?)", (numero, novo_saldo))
+        delta = valor if dados['sinal'] == '+' else -valor
 
-            # Log da Transação
-            cursor.execute("""
-            INSERT INTO transacoes 
-            (numero_cliente, data_registro, data_comprovante, tipo, valor, saldo_anterior, saldo_novo, pagador, banco, id_comprovante) 
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        with self._escrita_clientes(numero) as conn:
+            conn.execute("INSERT OR IGNORE INTO financeiro (numero, saldo) VALUES (?, 0)", (numero,))
+
+            # Log da Transação (saldo anterior/novo calculados pelo SQLite)
+            saldo_ant, novo_saldo = conn.execute(f"""
+                INSERT INTO transacoes 
+                (numero_cliente, data_registro, data_comprovante, tipo, valor, saldo_anterior, saldo_novo, pagador, banco, id_comprovante) 
+                SELECT ?, ?, ?, ?, ?, saldo, {_CEIL_SQL.format(x='bruto')}, ?, ?, ?
+                FROM (SELECT saldo, saldo + ? AS bruto FROM financeiro WHERE numero = ?)
+                RETURNING saldo_anterior, saldo_novo
             """, (
                 numero, 
-                datetime.now().strftime('%d/%m/%Y %H:%M:%S'), 
+                datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 
                 dados.get('data_full', 'N/A'),
                 dados['tipo'], 
                 valor, 
-                saldo_ant, 
-                novo_saldo, 
                 dados.get('pagador', 'Admin'), 
                 dados.get('banco', 'N/A'),
+                dados['id_id'],
+                delta,
+                numero
+            )).fetchall()[0]
+
+            # Atualiza o saldo; remove vencimento se a dívida for quitada (saldo <= 0)
+            conn.execute(_ATUALIZA_SALDO_SQL, (novo_saldo, novo_saldo, novo_saldo, numero))
+            
+        self._notify(numero)
+        return saldo_ant, novo_saldo
+
+    def registrar_transacoes_lote(self, lote: List[dict]) -> List[Tuple[float, float]]:
+        """
+        Aplica vários ajustes (mesmo formato de registrar_transacao) em uma única
+        transação, com executemany. Ajustes do mesmo cliente são aplicados em ordem.
+        Se qualquer linha falhar (ex: id duplicado), nada é gravado.
+        Retorna (saldo_anterior, novo_saldo) de cada ajuste.
+        """
+        if not lote:
+            return []
+
+        numeros = list(dict.fromkeys(d['numero'] for d in lote))
+        with self._escrita_clientes(*numeros) as conn:
+            resultados = self._aplicar_ajustes(conn, lote, numeros)
+
+        self._notify(*numeros)
+        return resultados
+
+    def aplicar_lote(self, ajustes: List[dict], saldos: List[Tuple[str, float]],
+                     vencimentos: List[Tuple[str, str]]) -> Tuple[int, int, int]:
+        """
+        Operações em massa do admin em uma única transação, nesta ordem: saldos
+        exatos (como set_saldo), ajustes com histórico (como registrar_transacoes_lote)
+        e vencimentos ISO (como set_vencimento; clientes inexistentes são ignorados).
+        Se qualquer linha falhar, nada é gravado.
+        Retorna quantos (ajustes, saldos, vencimentos) foram gravados.
+        """
+        numeros = list(dict.fromkeys([n for n, _ in saldos] + [d['numero'] for d in ajustes]
+                                     + [n for n, _ in vencimentos]))
+        if not numeros:
+            return 0, 0, 0
+
+        with self._escrita_clientes(*numeros) as conn:
+            conn.executemany("""
+                INSERT INTO financeiro (numero, saldo) VALUES (?, ?)
+                ON CONFLICT(numero) DO UPDATE SET saldo=excluded.saldo
+            """, saldos)
+            if ajustes:
+                self._aplicar_ajustes(conn, ajustes, list(dict.fromkeys(d['numero'] for d in ajustes)))
+            gravados = conn.executemany(
+                "UPDATE financeiro SET vencimento = ?, ultimo_aviso = NULL WHERE numero = ?",
+                ((data_iso, numero) for numero, data_iso in vencimentos)
+            ).rowcount if vencimentos else 0
+
+        self._notify(*numeros)
+        return len(ajustes), len(saldos), gravados
+
+    def _aplicar_ajustes(self, conn: sqlite3.Connection, lote: List[dict],
+                         numeros: List[str]) -> List[Tuple[float, float]]:
+        """Corpo de registrar_transacoes_lote, dentro de uma transação já aberta."""
+        agora = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        conn.executemany("INSERT OR IGNORE INTO financeiro (numero, saldo) VALUES (?, 0)",
+                         ((n,) for n in numeros))
+
+        # Saldos atuais lidos sob o lock de escrita (BEGIN IMMEDIATE)
+        saldos = {}
+        for i in range(0, len(numeros), 500):
+            bloco = numeros[i:i + 500]
+            marcadores = ",".join("?" * len(bloco))
+            saldos.update(conn.execute(
+                f"SELECT numero, saldo FROM financeiro WHERE numero IN ({marcadores})", bloco
+            ).fetchall())
+
+        historico, resultados, quitados = [], [], set()
+        for dados in lote:
+            numero = dados['numero']
+            valor = float(dados['valor'])
+            saldo_ant = saldos[numero]
+            novo_saldo = math.ceil(saldo_ant + valor if dados['sinal'] == '+' else saldo_ant - valor)
+            saldos[numero] = novo_saldo
+            if novo_saldo <= 0:
+                quitados.add(numero)
+
+            resultados.append((saldo_ant, novo_saldo))
+            historico.append((
+                numero, agora, dados.get('data_full', 'N/A'), dados['tipo'], valor,
+                saldo_ant, novo_saldo, dados.get('pagador', 'Admin'), dados.get('banco', 'N/A'),
                 dados['id_id']
             ))
-            conn.commit()
-            
-        return saldo_ant, novo_saldo
\ No newline at end of file
+
+        conn.executemany("""
+            INSERT INTO transacoes 
+            (numero_cliente, data_registro, data_comprovante, tipo, valor, saldo_anterior, saldo_novo, pagador, banco, id_comprovante) 
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, historico)
+
+        # Quitação em qualquer passo limpa o vencimento (mesma regra do ajuste individual)
+        conn.executemany(_ATUALIZA_SALDO_SQL, (
+            (saldos[n], 0 if n in quitados else 1, 0 if n in quitados else 1, n) for n in numeros
+        ))
+
+        return resultados
@@ -0,0 +1,241 @@
+"""
+Exportação das tabelas `transacoes` e `financeiro` para CSV ou Parquet.
+
+Lê por uma conexão somente leitura (WAL: não bloqueia as escritas do bot),
+em lotes de tamanho fixo com fetchmany e gravando cada lote antes de ler o
+próximo; o uso de memória não depende do tamanho do histórico. Parquet
+requer o pacote opcional `pyarrow`.
+
+Uso:
+    python export_data.py transacoes transacoes.csv --desde 2024-01-01 --ate 2024-01-31
+    python export_data.py transacoes mes.parquet --numero 5561999998888
+    python export_data.py transacoes novas.csv --estado export_estado.json   # incremental
+    python export_data.py financeiro clientes.csv
+
+O estado incremental (--estado) é guardado por tabela e conjunto de filtros:
+uma exportação filtrada nunca avança a marca da exportação completa. Em
+`financeiro` o incremental (id > ?) só traz clientes novos; alterações de
+saldo/vencimento de linhas já exportadas exigem uma exportação completa.
+"""
+import os
+import csv
+import sys
+import json
+import sqlite3
+import logging
+import argparse
+from contextlib import contextmanager
+from datetime import date, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Colunas exportadas por tabela e seu tipo no Parquet
+TABELAS: Dict[str, List[Tuple[str, str]]] = {
+    'transacoes': [
+        ('id', 'int'), ('numero_cliente', 'str'), ('data_registro', 'str'), ('data_comprovante', 'str'),
+        ('tipo', 'str'), ('valor', 'float'), ('saldo_anterior', 'float'), ('saldo_novo', 'float'),
+        ('pagador', 'str'), ('banco', 'str'), ('id_comprovante', 'str'),
+    ],
+    'financeiro': [
+        ('id', 'int'), ('numero', 'str'), ('saldo', 'float'), ('vencimento', 'str'), ('ultimo_aviso', 'str'),
+    ],
+}
+# Coluna do cliente em cada tabela (filtro --numero)
+_COLUNA_CLIENTE = {'transacoes': 'numero_cliente', 'financeiro': 'numero'}
+
+FORMATOS = ('csv', 'parquet')
+
+
+def conectar_leitura(db_name: str) -> sqlite3.Connection:
+    """Conexão somente leitura (mode=ro): nunca pega o lock de escrita do banco."""
+    caminho = os.path.abspath(db_name)
+    if not os.path.exists(caminho):
+        raise FileNotFoundError(caminho)
+    return sqlite3.connect(f"file:{caminho}?mode=ro", uri=True, isolation_level=None)
+
+
+def montar_consulta(tabela: str, desde: Optional[str] = None, ate: Optional[str] = None,
+                    numero: Optional[str] = None, apos_id: Optional[int] = None) -> Tuple[str, List[Any]]:
+    """
+    SELECT ordenado pela chave primária (sem ordenação em memória). `desde`/`ate`
+    são datas ISO inclusivas sobre data_registro (só em transacoes).
+    """
+    if tabela not in TABELAS:
+        raise ValueError(f"Tabela desconhecida: {tabela}")
+    colunas = ", ".join(nome for nome, _ in TABELAS[tabela])
+    filtros, params = [], []
+
+    if numero:
+        filtros.append(f"{_COLUNA_CLIENTE[tabela]} = ?")
+        params.append(numero)
+    if apos_id is not None:
+        filtros.append("id > ?")
+        params.append(apos_id)
+    if desde or ate:
+        if tabela != 'transacoes':
+            raise ValueError("Filtro de datas só se aplica a transacoes")
+        if desde:
+            filtros.append("data_registro >= ?")
+            params.append(date.fromisoformat(desde).isoformat())
+        if ate:
+            # data_registro é 'AAAA-MM-DD HH:MM:SS': o dia final inteiro entra
+            filtros.append("data_registro < ?")
+            params.append((date.fromisoformat(ate) + timedelta(days=1)).isoformat())
+
+    where = f" WHERE {' AND '.join(filtros)}" if filtros else ""
+    return f"SELECT {colunas} FROM {tabela}{where} ORDER BY id", params
+
+
+def iterar_lotes(conn: sqlite3.Connection, sql: str, params: Sequence[Any],
+                 tamanho: int = 5000) -> Iterator[List[tuple]]:
+    """Percorre o cursor em lotes de `tamanho` linhas (nunca fetchall)."""
+    cursor = conn.execute(sql, params)
+    try:
+        while True:
+            lote = cursor.fetchmany(tamanho)
+            if not lote:
+                return
+            yield lote
+    finally:
+        cursor.close()
+
+
+class _EscritorCSV:
+    def __init__(self, destino: str, colunas: List[Tuple[str, str]]):
+        self._arquivo = open(destino, 'w', newline='', encoding='utf-8')
+        self._csv = csv.writer(self._arquivo)
+        self._csv.writerow([nome for nome, _ in colunas])
+
+    def escrever(self, lote: List[tuple]) -> None:
+        self._csv.writerows(lote)
+
+    def fechar(self) -> None:
+        self._arquivo.close()
+
+
+class _EscritorParquet:
+    """Um row group por lote (pyarrow.parquet.ParquetWriter)."""
+
+    def __init__(self, destino: str, colunas: List[Tuple[str, str]]):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Exportação em Parquet requer o pacote 'pyarrow' (pip install pyarrow)")
+
+        tipos = {'int': pa.int64(), 'float': pa.float64(), 'str': pa.string()}
+        self._pa = pa
+        self._schema = pa.schema([(nome, tipos[tipo]) for nome, tipo in colunas])
+        self._writer = pq.ParquetWriter(destino, self._schema, compression='zstd')
+
+    def escrever(self, lote: List[tuple]) -> None:
+        # Linhas -> colunas só para o lote atual
+        colunas = [list(valores) for valores in zip(*lote)]
+        self._writer.write_table(self._pa.Table.from_arrays(
+            [self._pa.array(valores, type=campo.type) for valores, campo in zip(colunas, self._schema)],
+            schema=self._schema
+        ))
+
+    def fechar(self) -> None:
+        self._writer.close()
+
+
+@contextmanager
+def _escritor(formato: str, destino: str, colunas: List[Tuple[str, str]]) -> Iterator[Any]:
+    escritor = (_EscritorParquet if formato == 'parquet' else _EscritorCSV)(destino, colunas)
+    try:
+        yield escritor
+    finally:
+        escritor.fechar()
+
+
+def exportar(db_name: str, tabela: str, destino: str, formato: Optional[str] = None,
+             desde: Optional[str] = None, ate: Optional[str] = None, numero: Optional[str] = None,
+             apos_id: Optional[int] = None, tamanho_lote: int = 5000) -> Tuple[int, Optional[int]]:
+    """
+    Exporta `tabela` para `destino` (formato pela extensão, se não informado).
+    Todos os lotes saem do mesmo snapshot (uma transação de leitura).
+    Retorna (linhas exportadas, maior id exportado) — o id alimenta a próxima exportação incremental.
+    """
+    formato = formato or ('parquet' if destino.lower().endswith('.parquet') else 'csv')
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato desconhecido: {formato}")
+    sql, params = montar_consulta(tabela, desde, ate, numero, apos_id)
+
+    total, ultimo_id = 0, None
+    conn = conectar_leitura(db_name)
+    try:
+        conn.execute("BEGIN")  # Snapshot de leitura (WAL): escritores continuam livres
+        with _escritor(formato, destino, TABELAS[tabela]) as escritor:
+            for lote in iterar_lotes(conn, sql, params, tamanho_lote):
+                escritor.escrever(lote)
+                total += len(lote)
+                ultimo_id = lote[-1][0]
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+    logger.info(f"Exportadas {total} linhas de {tabela} para {destino} ({formato}).")
+    return total, ultimo_id
+
+
+def chave_estado(tabela: str, desde: Optional[str] = None, ate: Optional[str] = None,
+                 numero: Optional[str] = None) -> str:
+    """Chave do estado incremental: a tabela, mais os filtros que restringiram a exportação."""
+    filtros = [f"{nome}={valor}" for nome, valor in (('numero', numero), ('desde', desde), ('ate', ate)) if valor]
+    return "|".join([tabela] + filtros)
+
+
+def _ler_estado(caminho: str) -> Dict[str, int]:
+    if not os.path.exists(caminho):
+        return {}
+    with open(caminho, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _gravar_estado(caminho: str, estado: Dict[str, int]) -> None:
+    temporario = f"{caminho}.tmp"
+    with open(temporario, 'w', encoding='utf-8') as f:
+        json.dump(estado, f)
+    os.replace(temporario, caminho)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('tabela', choices=sorted(TABELAS))
+    parser.add_argument('destino', help="arquivo de saída (.csv ou .parquet)")
+    parser.add_argument('--db', default='finance.db')
+    parser.add_argument('--formato', choices=FORMATOS, help="padrão: pela extensão do destino")
+    parser.add_argument('--desde', help="data inicial ISO (AAAA-MM-DD), inclusiva")
+    parser.add_argument('--ate', help="data final ISO (AAAA-MM-DD), inclusiva")
+    parser.add_argument('--numero', help="apenas este cliente")
+    parser.add_argument('--apos-id', type=int, help="apenas linhas com id maior que este")
+    parser.add_argument('--estado', help="JSON com o último id exportado por tabela e filtros (exportação incremental)")
+    parser.add_argument('--lote', type=int, default=5000, help="linhas por leitura/gravação")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    estado = _ler_estado(args.estado) if args.estado else {}
+    chave = chave_estado(args.tabela, args.desde, args.ate, args.numero)
+    apos_id = args.apos_id if args.apos_id is not None else estado.get(chave)
+    if args.tabela == 'financeiro' and apos_id is not None:
+        logger.warning("Incremental em financeiro traz só clientes novos; saldos alterados exigem exportação completa.")
+
+    try:
+        total, ultimo_id = exportar(args.db, args.tabela, args.destino, args.formato, args.desde, args.ate,
+                                    args.numero, apos_id, args.lote)
+    except (ValueError, RuntimeError, FileNotFoundError) as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        return 1
+
+    if args.estado and ultimo_id is not None:
+        estado[chave] = ultimo_id
+        _gravar_estado(args.estado, estado)
+    print(f"{total} linhas exportadas" + (f" (último id: {ultimo_id})" if ultimo_id is not None else ""))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,34 @@
+"""
+Configuração do gunicorn: um worker por núcleo, com threads para o tráfego
+de webhook. Cada worker tem seus próprios pools (gateway, fila de
+comprovantes); o agendador roda apenas no worker eleito líder.
+"""
+import os
+import sys
+import multiprocessing
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", str(multiprocessing.cpu_count())))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = 30
+
+# Os workers criam threads (gateway, fila, agendador): não carregar o app antes do fork
+preload_app = False
+
+
+def on_starting(server):
+    """Aplica o esquema/migrações uma única vez, no processo mestre, antes dos workers."""
+    from database import Database
+
+    Database().close()
+    server.log.info("Esquema do banco verificado.")
+
+
+def worker_exit(server, worker):
+    """Libera o lease do agendador para o próximo líder assumir sem esperar a expiração."""
+    wsgi = sys.modules.get('wsgi')
+    elector = wsgi.app.extensions.get('leader_elector') if wsgi else None
+    if elector:
+        elector.stop()
@@ -0,0 +1,103 @@
+import io
+import logging
+import threading
+from typing import Dict, Tuple
+
+from PIL import Image, ImageChops, ImageOps
+
+logger = logging.getLogger(__name__)
+
+
+class ImagePreprocessor:
+    """
+    Reduz a imagem antes de enviá-la ao modelo de visão: recorta a área do
+    comprovante, limita o maior lado, opcionalmente converte para tons de cinza
+    e recodifica em JPEG. Menos pixels = menos tokens de visão e payload menor.
+    """
+
+    def __init__(self, max_side: int = 1280, grayscale: bool = False, autocrop: bool = True,
+                 jpeg_quality: int = 85, max_pdf_zoom: float = 2.0):
+        self.max_side = max_side
+        self.grayscale = grayscale
+        self.autocrop = autocrop
+        self.jpeg_quality = jpeg_quality
+        self.max_pdf_zoom = max_pdf_zoom
+
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.images = 0
+        self._lock = threading.Lock()
+
+    def process(self, image_bytes: bytes) -> Tuple[bytes, Dict]:
+        """Retorna (bytes JPEG, estatísticas). Em caso de falha devolve a imagem original."""
+        try:
+            with Image.open(io.BytesIO(image_bytes)) as img:
+                # JPEG: decodifica direto em escala reduzida (1/2, 1/4, 1/8), sem
+                # alocar a foto inteira em memória; o tamanho final continua >= max_side
+                img.draft("L" if self.grayscale else "RGB", (self.max_side, self.max_side))
+                img = ImageOps.exif_transpose(img)
+                img = img.convert("L" if self.grayscale else "RGB")
+
+                if self.autocrop:
+                    img = self._crop_to_content(img)
+
+                if max(img.size) > self.max_side:
+                    img.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+
+                out = io.BytesIO()
+                img.save(out, format="JPEG", quality=self.jpeg_quality, optimize=True)
+                result, size = out.getvalue(), img.size
+        except Exception as e:
+            logger.warning(f"Pré-processamento ignorado (imagem não suportada): {e}")
+            result, size = image_bytes, None
+
+        # Nunca piora o payload: se a recodificação ficou maior, mantém o original
+        if len(result) > len(image_bytes):
+            result = image_bytes
+
+        stats = {'bytes_in': len(image_bytes), 'bytes_out': len(result), 'size': size}
+        with self._lock:
+            self.images += 1
+            self.bytes_in += stats['bytes_in']
+            self.bytes_out += stats['bytes_out']
+
+        logger.info(f"Pré-processamento: {stats['bytes_in'] // 1024}KB -> {stats['bytes_out'] // 1024}KB ({size})")
+        return result, stats
+
+    def _crop_to_content(self, img: Image.Image, threshold: int = 40, min_area: float = 0.2) -> Image.Image:
+        """
+        Recorta as bordas com a cor de fundo (amostrada no canto superior esquerdo).
+        Descarta o recorte se ele sobrar menos que `min_area` da imagem (provável erro).
+        """
+        gray = img if img.mode == "L" else img.convert("L")
+        background = Image.new("L", gray.size, gray.getpixel((0, 0)))
+        mask = ImageChops.difference(gray, background).point(lambda p: 255 if p > threshold else 0)
+        bbox = mask.getbbox()
+        if not bbox:
+            return img
+
+        width, height = img.size
+        crop_area = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
+        if crop_area < min_area * width * height:
+            return img
+
+        margin = int(0.01 * max(width, height))
+        bbox = (max(0, bbox[0] - margin), max(0, bbox[1] - margin),
+                min(width, bbox[2] + margin), min(height, bbox[3] + margin))
+        return img.crop(bbox)
+
+    def pdf_zoom(self, page_width: float, page_height: float) -> float:
+        """Escala de renderização do PDF para o maior lado caber em `max_side` (máx. `max_pdf_zoom`)."""
+        longest = max(page_width, page_height)
+        if longest <= 0:
+            return self.max_pdf_zoom
+        return min(self.max_pdf_zoom, self.max_side / longest)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'images': self.images,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'ratio': round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else 0.0
+            }
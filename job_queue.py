@@ -0,0 +1,127 @@
+import queue
+import threading
+import time
+import uuid
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Levantada quando a fila de comprovantes está cheia (backpressure)."""
+
+
+class ReceiptQueue:
+    """
+    Fila limitada para processamento de comprovantes (imagem/PDF).
+    Um pool fixo de workers consome os jobs, mantendo o webhook livre
+    para responder imediatamente enquanto a GPU trabalha.
+    """
+
+    def __init__(self, workers: int = 1, max_size: int = 50, history_size: int = 1000):
+        self.workers = max(1, workers)
+        self.max_size = max_size
+        self.history_size = history_size
+
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue(maxsize=max_size)
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._tasks: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"receipt-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Fila de comprovantes iniciada ({self.workers} workers, capacidade {self.max_size}).")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Sinaliza os workers para encerrar após os jobs em andamento."""
+        for _ in self._threads:
+            try:
+                self._queue.put(None, timeout=timeout)
+            except queue.Full:
+                break
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads.clear()
+
+    def submit(self, kind: str, func: Callable, *args: Any) -> str:
+        """
+        Enfileira um job e retorna seu ID.
+        Levanta QueueFullError se a fila estiver no limite.
+        """
+        job_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self._jobs[job_id] = {
+                'id': job_id,
+                'kind': kind,
+                'status': 'queued',
+                'enqueued_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'error': None
+            }
+            self._tasks[job_id] = (func, args)
+            self._trim_history()
+
+        try:
+            self._queue.put_nowait(job_id)
+        except queue.Full:
+            with self._lock:
+                self._jobs[job_id]['status'] = 'rejected'
+                self._tasks.pop(job_id, None)
+            logger.warning(f"Fila de comprovantes cheia ({self.max_size}). Job {kind} rejeitado.")
+            raise QueueFullError(job_id)
+
+        return job_id
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            running = sum(1 for j in self._jobs.values() if j['status'] == 'running')
+        return {
+            'depth': self._queue.qsize(),
+            'capacity': self.max_size,
+            'running': running,
+            'workers': self.workers
+        }
+
+    def _trim_history(self) -> None:
+        """Descarta o histórico de jobs finalizados mais antigos (chamar com lock)."""
+        while len(self._jobs) > self.history_size:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if oldest['status'] in ('queued', 'running'):
+                break
+            self._jobs.pop(oldest_id)
+
+    def _worker(self) -> None:
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                return
+
+            with self._lock:
+                func, args = self._tasks.pop(job_id)
+                job = self._jobs[job_id]
+                job['status'] = 'running'
+                job['started_at'] = time.time()
+
+            try:
+                func(*args)
+                status, error = 'done', None
+            except Exception as e:
+                logger.error(f"Erro no job {job_id} ({job['kind']}): {e}", exc_info=True)
+                status, error = 'failed', str(e)
+
+            with self._lock:
+                job['status'] = status
+                job['error'] = error
+                job['finished_at'] = time.time()
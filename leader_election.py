@@ -0,0 +1,81 @@
+import os
+import uuid
+import socket
+import atexit
+import logging
+import threading
+from typing import Callable, Optional
+
+from config import Config
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderElector:
+    """
+    Elege um único processo líder entre os workers (ex: gunicorn) por meio de
+    um lease com expiração no SQLite. O líder renova o lease a cada `ttl / 3`
+    segundos; se ele morrer, outro processo assume após a expiração.
+    """
+
+    def __init__(self, name: str, on_elected: Callable[[], None], on_demoted: Callable[[], None],
+                 ttl: float = 30.0, db: Optional[Database] = None):
+        self.name = name
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.ttl = ttl
+        self.db = db or Database()
+        self.identity = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.is_leader = False
+        self.stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run_loop, name=f"leader-{self.name}", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        """Encerra a eleição e libera o lease (o próximo líder não espera a expiração)."""
+        if self.stop_event.is_set():
+            return
+        self.stop_event.set()
+        if self._thread:
+            self._thread.join(self.ttl)
+        if self.is_leader:
+            self._demote()
+            try:
+                self.db.liberar_lease(self.name, self.identity)
+            except Exception as e:
+                logger.warning(f"Falha ao liberar o lease '{self.name}': {e}")
+
+    def _run_loop(self) -> None:
+        while not self.stop_event.is_set():
+            try:
+                acquired = self.db.adquirir_lease(self.name, self.identity, self.ttl)
+            except Exception as e:
+                # Sem conseguir renovar, não há garantia de exclusividade
+                logger.error(f"Erro ao renovar o lease '{self.name}': {e}")
+                acquired = False
+
+            if acquired and not self.is_leader:
+                self.is_leader = True
+                logger.info(f"Processo {self.identity} eleito líder de '{self.name}'.")
+                self.on_elected()
+            elif not acquired and self.is_leader:
+                logger.warning(f"Processo {self.identity} perdeu o lease '{self.name}'.")
+                self._demote()
+
+            self.stop_event.wait(self.ttl / 3)
+
+    def _demote(self) -> None:
+        self.is_leader = False
+        try:
+            self.on_demoted()
+        except Exception as e:
+            logger.error(f"Erro ao rebaixar o líder de '{self.name}': {e}")
+
+
+def from_config(name: str, on_elected: Callable[[], None], on_demoted: Callable[[], None]) -> LeaderElector:
+    return LeaderElector(name, on_elected, on_demoted, ttl=Config.LEADER_LEASE_SECONDS)
@@ -0,0 +1,136 @@
+import json
+import base64
+import hashlib
+import binascii
+import tempfile
+from typing import Any, BinaryIO, Dict, Iterator, Optional, Union
+
+from config import Config
+
+# Múltiplos de 4 (Base64) e de 3 (bytes) para decodificar/codificar em blocos sem padding intermediário
+_B64_CHUNK = 4 * 256 * 1024
+_RAW_CHUNK = 3 * 256 * 1024
+
+
+class MediaBuffer:
+    """
+    Bytes de uma mídia (imagem/PDF) decodificados uma única vez para um
+    SpooledTemporaryFile: arquivos pequenos ficam em memória, os grandes vão
+    para o disco. É o handle que circula entre a fila, o bot e o AIService
+    no lugar da string Base64.
+    """
+
+    def __init__(self, spool_max: Optional[int] = None):
+        self._file: BinaryIO = tempfile.SpooledTemporaryFile(
+            max_size=Config.MEDIA_SPOOL_MAX_BYTES if spool_max is None else spool_max
+        )
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+
+    @classmethod
+    def from_base64(cls, data: Union[str, bytes], spool_max: Optional[int] = None) -> "MediaBuffer":
+        """
+        Decodifica em blocos (sem materializar todos os bytes em memória).
+        Aceita prefixo data URI e quebras de linha. Levanta ValueError se inválido.
+        """
+        if isinstance(data, bytes):
+            data = data.decode('ascii', 'ignore')
+        if data.startswith('data:'):
+            data = data[data.find(',') + 1:]
+
+        buffer = cls(spool_max)
+        pendente = ''
+        try:
+            for inicio in range(0, len(data), _B64_CHUNK):
+                bloco = pendente + ''.join(data[inicio:inicio + _B64_CHUNK].split())
+                corte = len(bloco) - len(bloco) % 4
+                buffer.write(base64.b64decode(bloco[:corte]))
+                pendente = bloco[corte:]
+            if pendente:
+                buffer.write(base64.b64decode(pendente + '=' * (-len(pendente) % 4)))
+        except (binascii.Error, ValueError) as e:
+            buffer.close()
+            raise ValueError(f"Base64 inválido: {e}") from e
+        return buffer
+
+    @classmethod
+    def from_bytes(cls, data: bytes, spool_max: Optional[int] = None) -> "MediaBuffer":
+        buffer = cls(spool_max)
+        buffer.write(data)
+        return buffer
+
+    def write(self, chunk: bytes) -> None:
+        self._file.write(chunk)
+        self._sha256.update(chunk)
+        self.size += len(chunk)
+
+    def sha256(self) -> str:
+        """Hash calculado durante a escrita (chave do cache de OCR)."""
+        return self._sha256.hexdigest()
+
+    def getvalue(self) -> bytes:
+        """Cópia única dos bytes (para Pillow/PyMuPDF)."""
+        self._file.seek(0)
+        return self._file.read()
+
+    def iter_chunks(self, size: int = _RAW_CHUNK) -> Iterator[bytes]:
+        self._file.seek(0)
+        while True:
+            chunk = self._file.read(size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __enter__(self) -> "MediaBuffer":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def as_media(media: Union[MediaBuffer, bytes, str, None]) -> Optional[MediaBuffer]:
+    """Normaliza a entrada dos extratores (handle, bytes crus ou Base64)."""
+    if media is None or isinstance(media, MediaBuffer):
+        return media
+    if isinstance(media, (bytes, bytearray)):
+        return MediaBuffer.from_bytes(bytes(media))
+    try:
+        return MediaBuffer.from_base64(media)
+    except ValueError:
+        return None
+
+
+class StreamingJSONBody:
+    """
+    Corpo de requisição JSON em que o campo `images` é codificado em Base64
+    bloco a bloco durante o envio. O `requests` usa `__len__` como
+    Content-Length e itera o objeto a cada tentativa (failover entre backends).
+    """
+
+    def __init__(self, payload: Dict[str, Any], image: Union[MediaBuffer, bytes]):
+        marcador = '__IMAGE__'
+        texto = json.dumps({**payload, 'images': [marcador]})
+        antes, depois = texto.split(json.dumps(marcador), 1)
+        self._prefix = (antes + '"').encode('utf-8')
+        self._suffix = ('"' + depois).encode('utf-8')
+        self._image = image
+
+    def __len__(self) -> int:
+        return len(self._prefix) + 4 * ((len(self._image) + 2) // 3) + len(self._suffix)
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield self._prefix
+        if isinstance(self._image, MediaBuffer):
+            for chunk in self._image.iter_chunks():
+                yield base64.b64encode(chunk)
+        else:
+            view = memoryview(self._image)
+            for inicio in range(0, len(view), _RAW_CHUNK):
+                yield base64.b64encode(view[inicio:inicio + _RAW_CHUNK])
+        yield self._suffix
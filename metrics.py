@@ -0,0 +1,308 @@
+"""
+Métricas do processo no formato texto do Prometheus (endpoint /metrics).
+
+Contadores e histogramas agregam por thread: cada thread escreve apenas no
+seu próprio fragmento (sem lock no caminho quente) e a coleta soma todos os
+fragmentos no momento do scrape. Gauges são funções avaliadas na coleta
+(profundidade de filas, confirmações pendentes etc.).
+
+Com vários workers do gunicorn, cada processo mantém os próprios valores.
+"""
+import abc
+import time
+import bisect
+import threading
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+# Segundos; escolha conforme a ordem de grandeza da operação
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+HTTP_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+AI_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 90.0, 120.0)
+
+# Acima deste número de fragmentos, os de threads encerradas são consolidados
+_MAX_SHARDS = 64
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pares = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class _ThreadSharded(abc.ABC):
+    """Base dos contadores/histogramas: um dicionário por thread, somados na coleta."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards: List[Tuple[threading.Thread, Dict[LabelValues, Any]]] = []
+        self._retired: Dict[LabelValues, Any] = {}
+
+    def _shard(self) -> Dict[LabelValues, Any]:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard: Dict[LabelValues, Any] = {}
+            with self._lock:
+                if len(self._shards) >= _MAX_SHARDS:
+                    self._retire_dead()
+                self._shards.append((threading.current_thread(), shard))
+            self._local.shard = shard
+            return shard
+
+    def _retire_dead(self) -> None:
+        """Consolida os fragmentos de threads encerradas (chamar com lock)."""
+        vivos = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                vivos.append((thread, shard))
+            else:
+                for key, value in shard.items():
+                    self._merge(self._retired, key, value)
+        self._shards = vivos
+
+    @property
+    def exposed_name(self) -> str:
+        return self.name
+
+    @abc.abstractmethod
+    def _merge(self, into: Dict[LabelValues, Any], key: LabelValues, value: Any) -> None:
+        """Soma `value` (de um fragmento) em `into[key]`."""
+
+    @abc.abstractmethod
+    def _zero(self) -> Any:
+        """Valor inicial de uma série."""
+
+    def _snapshot(self) -> Dict[LabelValues, Any]:
+        with self._lock:
+            self._retire_dead()
+            total: Dict[LabelValues, Any] = {}
+            for key, value in self._retired.items():
+                self._merge(total, key, value)
+            for _, shard in self._shards:
+                # list(items()) é atômico sob o GIL (a thread dona pode inserir chaves durante a coleta)
+                for key, value in list(shard.items()):
+                    self._merge(total, key, value)
+        # Métricas sem rótulos aparecem zeradas antes da primeira observação
+        if not self.labelnames and () not in total:
+            total[()] = self._zero()
+        return total
+
+    def _check(self, labels: LabelValues) -> LabelValues:
+        """Valida os rótulos na primeira observação de cada série (strings, na ordem de labelnames)."""
+        if len(labels) != len(self.labelnames) or not all(isinstance(v, str) for v in labels):
+            raise ValueError(f"{self.name}: esperados rótulos {self.labelnames}, recebidos {labels}")
+        return labels
+
+
+class Counter(_ThreadSharded):
+    kind = 'counter'
+
+    @property
+    def exposed_name(self) -> str:
+        return f"{self.name}_total"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        shard = self._shard()
+        atual = shard.get(labels)
+        if atual is None:
+            atual = shard[self._check(labels)] = 0
+        shard[labels] = atual + amount
+
+    def _merge(self, into, key, value) -> None:
+        into[key] = into.get(key, 0) + value
+
+    def _zero(self) -> float:
+        return 0
+
+    def value(self, *labels: str) -> float:
+        return self._snapshot().get(labels, 0)
+
+    def collect(self) -> Iterable[str]:
+        for key, value in sorted(self._snapshot().items()):
+            yield f"{self.exposed_name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_ThreadSharded):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = HTTP_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str) -> None:
+        shard = self._shard()
+        # [contagem por faixa (não cumulativa)..., +Inf, soma, total]
+        cells = shard.get(labels)
+        if cells is None:
+            cells = shard[self._check(labels)] = self._zero()
+        cells[bisect.bisect_left(self.buckets, value)] += 1
+        cells[-2] += value
+        cells[-1] += 1
+
+    def time(self, *labels: str) -> "_Timer":
+        """Context manager/decorador que observa a duração do bloco."""
+        return _Timer(self, labels)
+
+    def _merge(self, into, key, value) -> None:
+        atual = into.get(key)
+        if atual is None:
+            into[key] = list(value)
+        else:
+            for i, v in enumerate(value):
+                atual[i] += v
+
+    def _zero(self) -> List:
+        return [0] * (len(self.buckets) + 1) + [0.0, 0]
+
+    def count(self, *labels: str) -> int:
+        cells = self._snapshot().get(labels)
+        return cells[-1] if cells else 0
+
+    def collect(self) -> Iterable[str]:
+        limites = [_format_value(b) for b in self.buckets] + ['+Inf']
+        for key, cells in sorted(self._snapshot().items()):
+            acumulado = 0
+            for limite, n in zip(limites, cells):
+                acumulado += n
+                le = f'le="{limite}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {acumulado}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(cells[-2])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {cells[-1]}"
+
+
+class _Timer:
+    __slots__ = ('_histogram', '_labels', '_inicio')
+
+    def __init__(self, histogram: Histogram, labels: LabelValues):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._histogram.observe(time.perf_counter() - self._inicio, *self._labels)
+
+    def __call__(self, func: Callable) -> Callable:
+        histogram, labels = self._histogram, self._labels
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - inicio, *labels)
+        return wrapper
+
+
+GaugeValue = Union[float, Dict[LabelValues, float]]
+
+
+class Gauge:
+    """Valor calculado no momento da coleta (ex: profundidade de fila)."""
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, func: Callable[[], GaugeValue],
+                 labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.func = func
+
+    def collect(self) -> Iterable[str]:
+        valor = self.func()
+        itens = valor.items() if isinstance(valor, dict) else [((), valor)]
+        for key, v in itens:
+            key = key if isinstance(key, tuple) else (key,)
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Union[Counter, Histogram, Gauge]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Registra (ou substitui, pelo nome) uma métrica."""
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def unregister(self, name: str) -> None:
+        with self._lock:
+            self._metrics.pop(name, None)
+
+    def exposition(self) -> str:
+        with self._lock:
+            metricas = list(self._metrics.values())
+        linhas: List[str] = []
+        for metric in metricas:
+            try:
+                amostras = list(metric.collect())
+            except Exception as e:
+                # Um gauge com erro não derruba o scrape inteiro
+                linhas.append(f"# ERRO ao coletar {metric.name}: {_escape(e)}")
+                continue
+            nome = getattr(metric, 'exposed_name', metric.name)
+            linhas.append(f"# HELP {nome} {metric.documentation}")
+            linhas.append(f"# TYPE {nome} {metric.kind}")
+            linhas.extend(amostras)
+        return '\n'.join(linhas) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = HTTP_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def gauge(name: str, documentation: str, func: Callable[[], GaugeValue],
+          labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, func, labelnames))
+
+
+def timed_methods(hist: Histogram, exclude: Iterable[str] = ()) -> Callable[[type], type]:
+    """
+    Decorador de classe: observa a duração de cada método público em `hist`,
+    com o nome do método como único rótulo.
+    """
+    def decorar(cls: type) -> type:
+        for nome, attr in list(vars(cls).items()):
+            if nome.startswith('_') or nome in exclude or not callable(attr):
+                continue
+            setattr(cls, nome, hist.time(nome)(attr))
+        return cls
+    return decorar
+
+
+def exposition(registry: Optional[Registry] = None) -> str:
+    return (registry or REGISTRY).exposition()
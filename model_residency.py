@@ -0,0 +1,156 @@
+import time
+import threading
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import requests
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class ModelResidencyManager:
+    """
+    Controla por quanto tempo o modelo de visão fica carregado na VRAM do Ollama.
+
+    Em vez de descarregar após cada comprovante, cada chamada renova o
+    `keep_alive` do modelo: enquanto houver tráfego ele permanece quente e,
+    após `idle_timeout` segundos sem uso, o próprio Ollama o descarrega.
+    Opcionalmente pré-aquece o modelo antes de horários configurados.
+    O estado é mantido por servidor (pool de backends).
+    """
+
+    def __init__(self, urls: List[str], model: str, idle_timeout: int = 600,
+                 prewarm_hours: Optional[List[int]] = None, prewarm_lead_minutes: int = 5,
+                 cold_load_ms: int = 500):
+        self.urls = urls
+        self.model = model
+        self.idle_timeout = max(0, idle_timeout)
+        self.prewarm_hours = sorted(set(prewarm_hours or []))
+        self.prewarm_lead = timedelta(minutes=prewarm_lead_minutes)
+        self.cold_load_ms = cold_load_ms
+
+        self.hits = 0
+        self.misses = 0
+        self._warm_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+    @property
+    def keep_alive(self) -> str:
+        """Valor de `keep_alive` enviado junto com cada requisição ao Ollama."""
+        return f"{self.idle_timeout}s"
+
+    def is_warm(self, url: Optional[str] = None) -> bool:
+        """Modelo quente no servidor informado (ou em algum deles, se None)."""
+        now = time.time()
+        if url is not None:
+            return now < self._warm_until.get(url, 0.0)
+        return any(now < until for until in self._warm_until.values())
+
+    def record_request(self, response_json: Dict, url: str) -> bool:
+        """
+        Contabiliza se a requisição encontrou o modelo quente (hit) ou precisou
+        carregá-lo (miss). Usa o `load_duration` (ns) reportado pelo Ollama e,
+        na ausência dele, a previsão local de residência.
+        Retorna True para carga quente.
+        """
+        load_ns = response_json.get('load_duration')
+        with self._lock:
+            if load_ns is not None:
+                warm = (load_ns / 1e6) < self.cold_load_ms
+            else:
+                warm = self.is_warm(url)
+
+            if warm:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self._warm_until[url] = time.time() + self.idle_timeout
+
+        if not warm:
+            logger.info(f"Carga fria do modelo em {url} ({(load_ns or 0) / 1e9:.1f}s).")
+        return warm
+
+    def prewarm(self) -> bool:
+        """Carrega o modelo na VRAM de todos os servidores, sem gerar tokens."""
+        return all([self._prewarm(url) for url in self.urls])
+
+    def _prewarm(self, url: str) -> bool:
+        try:
+            res = requests.post(url, json={
+                "model": self.model,
+                "keep_alive": self.keep_alive
+            }, timeout=120)
+            if res.status_code == 200:
+                with self._lock:
+                    self._warm_until[url] = time.time() + self.idle_timeout
+                logger.info(f"Modelo pré-aquecido em {url}.")
+                return True
+            logger.warning(f"Falha no pré-aquecimento de {url} ({res.status_code}): {res.text}")
+        except Exception as e:
+            logger.warning(f"Falha no pré-aquecimento do modelo em {url}: {e}")
+        return False
+
+    def unload(self) -> None:
+        """Libera a VRAM do modelo em todos os servidores imediatamente."""
+        for url in self.urls:
+            try:
+                requests.post(url, json={
+                    "model": self.model,
+                    "keep_alive": 0
+                }, timeout=5)
+                with self._lock:
+                    self._warm_until.pop(url, None)
+            except Exception as e:
+                logger.warning(f"Falha ao liberar memória do modelo em {url}: {e}")
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+            'warm': self.is_warm(),
+            'idle_timeout': self.idle_timeout
+        }
+
+    def start(self) -> None:
+        """Inicia a thread de pré-aquecimento (apenas se houver horários configurados)."""
+        if not self.prewarm_hours:
+            return
+        thread = threading.Thread(target=self._prewarm_loop, name="model-prewarm", daemon=True)
+        thread.start()
+        logger.info(f"Pré-aquecimento do modelo agendado para {self.prewarm_hours}h.")
+
+    def _next_prewarm(self, now: datetime) -> datetime:
+        candidates = []
+        for day in (0, 1):
+            base = (now + timedelta(days=day)).replace(minute=0, second=0, microsecond=0)
+            for hour in self.prewarm_hours:
+                at = base.replace(hour=hour) - self.prewarm_lead
+                if at > now:
+                    candidates.append(at)
+        return min(candidates)
+
+    def _prewarm_loop(self) -> None:
+        while not self.stop_event.is_set():
+            now = datetime.now()
+            wait = (self._next_prewarm(now) - now).total_seconds()
+            if self.stop_event.wait(wait):
+                return
+            self.prewarm()
+
+
+def from_config() -> ModelResidencyManager:
+    hours = [int(h) for h in Config.OLLAMA_PREWARM_HOURS.split(',') if h.strip()]
+    return ModelResidencyManager(
+        urls=Config.OLLAMA_URLS,
+        model=Config.OLLAMA_MODEL,
+        idle_timeout=Config.OLLAMA_KEEP_ALIVE,
+        prewarm_hours=hours,
+        prewarm_lead_minutes=Config.OLLAMA_PREWARM_LEAD_MINUTES,
+        cold_load_ms=Config.OLLAMA_COLD_LOAD_MS
+    )
@@ -0,0 +1,171 @@
+import time
+import threading
+import logging
+from typing import Any, Callable, Dict, List, Optional, Set
+
+import requests
+
+from config import Config
+import tracing
+
+logger = logging.getLogger(__name__)
+
+
+class BackendError(Exception):
+    """Falha do servidor (5xx) que justifica tentar outro backend."""
+
+
+class NoBackendAvailable(Exception):
+    """Nenhum backend saudável com capacidade livre dentro do tempo de espera."""
+
+
+class Backend:
+    """Um servidor Ollama com limite de concorrência e disjuntor (circuit breaker)."""
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, url: str, max_concurrency: int = 1):
+        self.url = url
+        self.max_concurrency = max(1, max_concurrency)
+        self.outstanding = 0
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.requests = 0
+        self.failures = 0
+
+    def available(self, now: float) -> bool:
+        if self.state == self.OPEN and now >= self.open_until:
+            # Após o cooldown, libera uma requisição de teste
+            self.state = self.HALF_OPEN
+        if self.state == self.OPEN:
+            return False
+        if self.state == self.HALF_OPEN:
+            return self.outstanding == 0
+        return self.outstanding < self.max_concurrency
+
+    def stats(self) -> Dict:
+        return {
+            'url': self.url,
+            'state': self.state,
+            'outstanding': self.outstanding,
+            'max_concurrency': self.max_concurrency,
+            'requests': self.requests,
+            'failures': self.failures
+        }
+
+
+class BackendPool:
+    """
+    Distribui requisições entre vários servidores Ollama pelo critério de
+    menos requisições em andamento. Backends que falham em sequência têm o
+    disjuntor aberto por `cooldown` segundos e a requisição é repetida em outro nó.
+    """
+
+    def __init__(self, backends: List[Backend], failure_threshold: int = 3, cooldown: float = 30.0,
+                 retries: int = 1, acquire_timeout: float = 60.0):
+        if not backends:
+            raise ValueError("Nenhum backend de OCR configurado.")
+        self.backends = backends
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.retries = retries
+        self.acquire_timeout = acquire_timeout
+        self._cond = threading.Condition()
+
+    @property
+    def urls(self) -> List[str]:
+        return [b.url for b in self.backends]
+
+    def _pick(self, exclude: Set[str]) -> Optional[Backend]:
+        now = time.time()
+        candidates = [b for b in self.backends if b.url not in exclude and b.available(now)]
+        if not candidates:
+            return None
+        # Menor carga relativa; empate favorece a ordem de configuração (GPU primeiro)
+        return min(candidates, key=lambda b: b.outstanding / b.max_concurrency)
+
+    def acquire(self, exclude: Optional[Set[str]] = None) -> Backend:
+        exclude = exclude or set()
+        deadline = time.time() + self.acquire_timeout
+        with self._cond:
+            while True:
+                backend = self._pick(exclude)
+                if backend:
+                    backend.outstanding += 1
+                    backend.requests += 1
+                    return backend
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise NoBackendAvailable("Todos os backends de OCR estão ocupados ou indisponíveis.")
+                # Acorda ao liberar uma vaga ou ao expirar um cooldown
+                self._cond.wait(min(remaining, 1.0))
+
+    def release(self, backend: Backend, success: bool) -> None:
+        with self._cond:
+            backend.outstanding -= 1
+            if success:
+                backend.consecutive_failures = 0
+                if backend.state != Backend.CLOSED:
+                    logger.info(f"Backend {backend.url} recuperado.")
+                backend.state = Backend.CLOSED
+            else:
+                backend.failures += 1
+                backend.consecutive_failures += 1
+                if backend.state == Backend.HALF_OPEN or backend.consecutive_failures >= self.failure_threshold:
+                    backend.state = Backend.OPEN
+                    backend.open_until = time.time() + self.cooldown
+                    logger.warning(f"Backend {backend.url} indisponível por {self.cooldown:.0f}s.")
+            self._cond.notify_all()
+
+    def request(self, func: Callable[[Backend], Any]) -> Any:
+        """
+        Executa `func(backend)` em um backend escolhido, repetindo em outro
+        nó em caso de timeout, erro de conexão ou BackendError.
+        """
+        tried: Set[str] = set()
+        last_error: Optional[Exception] = None
+
+        for _ in range(self.retries + 1):
+            # Se todos já foram tentados, permite repetir qualquer um
+            exclude = tried if len(tried) < len(self.backends) else set()
+            with tracing.span('ai.backend_acquire'):
+                backend = self.acquire(exclude)
+            tried.add(backend.url)
+            try:
+                with tracing.span('ai.attempt') as span:
+                    span.set(backend=backend.url)
+                    result = func(backend)
+            except (requests.exceptions.RequestException, BackendError) as e:
+                self.release(backend, success=False)
+                logger.warning(f"Falha no backend {backend.url}: {e}")
+                last_error = e
+                continue
+            except Exception:
+                # Erro do próprio processamento (não do backend)
+                self.release(backend, success=True)
+                raise
+            self.release(backend, success=True)
+            return result
+
+        raise last_error
+
+    def stats(self) -> List[Dict]:
+        with self._cond:
+            return [b.stats() for b in self.backends]
+
+
+def from_config() -> BackendPool:
+    """Monta o pool a partir de OLLAMA_URLS (um limite de concorrência para todos ou um por URL)."""
+    urls = Config.OLLAMA_URLS
+    limits = Config.OLLAMA_BACKEND_CONCURRENCY
+    if len(limits) != len(urls):
+        limits = [limits[0] if limits else 1] * len(urls)
+
+    return BackendPool(
+        [Backend(url, limit) for url, limit in zip(urls, limits)],
+        failure_threshold=Config.OLLAMA_FAILURE_THRESHOLD,
+        cooldown=Config.OLLAMA_CIRCUIT_COOLDOWN,
+        retries=Config.OLLAMA_RETRIES
+    )
@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import base64
+import hashlib
+import sqlite3
+import logging
+from typing import Dict, Optional, Union
+
+from media_buffer import MediaBuffer
+
+logger = logging.getLogger(__name__)
+
+# Resultados definitivos que valem a pena guardar (None/JSON_ERROR podem ser falhas transitórias)
+CACHEABLE_ERRORS = ("INVALID_RECEIVER",)
+
+
+class OCRCache:
+    """
+    Cache persistente de extrações, endereçado pelo SHA-256 dos bytes da mídia.
+    Um comprovante reenviado (encaminhado, "recebeu?") devolve o resultado
+    anterior sem passar pela IA.
+    """
+
+    def __init__(self, db_name: str = 'ocr_cache.db', max_entries: int = 5000, max_age_days: int = 90):
+        self.db_name = db_name
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 86400
+        self.hits = 0
+        self.misses = 0
+        self._init_db()
+
+    def _get_connection(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_name)
+
+    def _init_db(self) -> None:
+        with self._get_connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS ocr_cache (
+                    hash TEXT PRIMARY KEY,
+                    resultado TEXT NOT NULL,
+                    criado_em REAL NOT NULL,
+                    acessado_em REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_ocr_cache_acessado ON ocr_cache (acessado_em)")
+            conn.commit()
+
+    @staticmethod
+    def key_for(media: Union[MediaBuffer, str]) -> Optional[str]:
+        """Hash do conteúdo decodificado (independe de quebras de linha do Base64)."""
+        if isinstance(media, MediaBuffer):
+            return media.sha256()
+        try:
+            return hashlib.sha256(base64.b64decode(media)).hexdigest()
+        except Exception:
+            return None
+
+    def get(self, key: Optional[str]) -> Union[Dict, str, None]:
+        if not key:
+            return None
+
+        with self._get_connection() as conn:
+            row = conn.execute(
+                "SELECT resultado, criado_em FROM ocr_cache WHERE hash = ?", (key,)
+            ).fetchone()
+
+            if not row or time.time() - row[1] > self.max_age:
+                self.misses += 1
+                return None
+
+            conn.execute("UPDATE ocr_cache SET acessado_em = ? WHERE hash = ?", (time.time(), key))
+            conn.commit()
+
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: Optional[str], resultado: Union[Dict, str, None]) -> None:
+        if not key or not (isinstance(resultado, dict) or resultado in CACHEABLE_ERRORS):
+            return
+
+        now = time.time()
+        try:
+            with self._get_connection() as conn:
+                conn.execute("""
+                    INSERT INTO ocr_cache (hash, resultado, criado_em, acessado_em) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(hash) DO UPDATE SET resultado=excluded.resultado, acessado_em=excluded.acessado_em
+                """, (key, json.dumps(resultado, ensure_ascii=False), now, now))
+                self._evict(conn, now)
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Falha ao gravar no cache de OCR: {e}")
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        """Remove entradas expiradas e, acima do limite, as menos acessadas."""
+        conn.execute("DELETE FROM ocr_cache WHERE criado_em < ?", (now - self.max_age,))
+        conn.execute("""
+            DELETE FROM ocr_cache WHERE hash IN (
+                SELECT hash FROM ocr_cache ORDER BY acessado_em DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0
+        }
+
+
+def default_path(finance_db: str = 'finance.db') -> str:
+    """Arquivo do cache ao lado do banco principal."""
+    return os.path.join(os.path.dirname(os.path.abspath(finance_db)), 'ocr_cache.db')
@@ -0,0 +1,260 @@
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Pattern, Tuple
+
+# Valores monetários no formato brasileiro (R$ 1.234,56)
+VALOR_RE = re.compile(r'R\$\s*(-?[\d.]+,\d{2})')
+DATA_RE = re.compile(r'\b(\d{2})/(\d{2})/(\d{4})\b')
+DATA_EXTENSO_RE = re.compile(
+    r'\b(\d{1,2})\s+(?:de\s+)?(jan|fev|mar|abr|mai|jun|jul|ago|set|out|nov|dez)[a-z]*\.?\s+(?:de\s+)?(\d{4})\b'
+)
+MESES = ['jan', 'fev', 'mar', 'abr', 'mai', 'jun', 'jul', 'ago', 'set', 'out', 'nov', 'dez']
+
+# ID fim-a-fim do Pix: E + ISPB (8) + AAAAMMDDHHMM (12) + 11 caracteres
+E2E_RE = re.compile(r'\b(E\d{20}[A-Za-z0-9]{11})\b')
+ID_LABEL_RE = re.compile(
+    r'(?:id da transa[cç][aã]o|id/transa[cç][aã]o|identificador|c[oó]digo da transa[cç][aã]o|'
+    r'autentica[cç][aã]o|n[oº°]? de controle|id do pagamento)\s*:?\s*([A-Za-z0-9][A-Za-z0-9\-]{5,})',
+    re.IGNORECASE
+)
+
+RECEBEDOR_LABELS = ('recebedor', 'destino', 'quem recebeu', 'favorecido', 'dados do recebedor',
+                    'nome do recebedor', 'para')
+PAGADOR_LABELS = ('pagador', 'origem', 'quem pagou', 'dados do pagador', 'nome do pagador', 'de')
+BANCO_LABELS = ('instituicao', 'banco')
+
+# Linhas que são apenas rótulos (ex: "Nome", "CPF") e não valores
+_SUB_LABELS = ('nome', 'cpf', 'cnpj', 'chave', 'chave pix', 'instituicao', 'agencia', 'conta', 'tipo de conta')
+
+
+def fold(text: str) -> str:
+    """Minúsculas sem acentos, para casar rótulos independentemente da grafia."""
+    nfkd = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in nfkd if not unicodedata.combining(c)).lower()
+
+
+def parse_valor_br(raw: str) -> Optional[float]:
+    """Converte '1.234,56' em 1234.56."""
+    try:
+        return float(raw.replace('.', '').replace(',', '.'))
+    except (ValueError, AttributeError):
+        return None
+
+
+def find_valor(text: str) -> Optional[float]:
+    match = VALOR_RE.search(text)
+    return parse_valor_br(match.group(1)) if match else None
+
+
+def find_date(text: str) -> Optional[str]:
+    """Retorna a primeira data do texto no formato dd/mm/yyyy."""
+    match = DATA_RE.search(text)
+    if match:
+        return match.group(0)
+    match = DATA_EXTENSO_RE.search(fold(text))
+    if match:
+        day, month, year = match.groups()
+        return f"{int(day):02d}/{MESES.index(month) + 1:02d}/{year}"
+    return None
+
+
+def find_transaction_id(text: str) -> Optional[str]:
+    match = E2E_RE.search(text)
+    if match:
+        return match.group(1)
+    match = ID_LABEL_RE.search(text)
+    return match.group(1) if match else None
+
+
+def find_labeled(lines: List[str], labels: Iterable[str], lookahead: int = 3) -> Optional[str]:
+    """
+    Procura um rótulo (ex: 'Recebedor') e retorna o valor associado,
+    seja na mesma linha ('Recebedor: Fulano') ou nas linhas seguintes.
+    """
+    folded = [fold(line).strip() for line in lines]
+    for label in labels:
+        for i, line in enumerate(folded):
+            if line == label or line == f"{label}:":
+                for j in range(i + 1, min(i + 1 + lookahead, len(lines))):
+                    value = _clean_value(lines[j], folded[j])
+                    if value:
+                        return value
+            elif line.startswith(f"{label}:"):
+                value = lines[i].split(':', 1)[1].strip()
+                if value and fold(value) not in _SUB_LABELS:
+                    return value
+    return None
+
+
+def _clean_value(original: str, folded: str) -> Optional[str]:
+    if not folded or folded.rstrip(':') in _SUB_LABELS:
+        return None
+    if folded.startswith('nome:'):
+        return original.split(':', 1)[1].strip() or None
+    if not re.search(r'[a-z]', folded):
+        return None
+    return original.strip()
+
+
+# ---------------------------------------------------------------------------
+# Regras por banco
+# ---------------------------------------------------------------------------
+
+# Peso de cada campo na confiança final (soma = 1.0)
+FIELD_WEIGHTS = {
+    'valor': 0.25,
+    'recebedor': 0.25,
+    'id_transacao': 0.2,
+    'data_texto': 0.15,
+    'pagador': 0.1,
+    'banco': 0.05
+}
+ESSENTIAL_FIELDS = ('valor', 'recebedor', 'id_transacao', 'data_texto')
+
+
+@dataclass
+class ReceiptRule:
+    """
+    Regra de extração para um layout de comprovante.
+    `markers` identificam o banco no texto (sem acentos, minúsculas); os
+    rótulos e padrões de ID têm prioridade sobre os genéricos.
+    """
+    name: str
+    markers: Tuple[str, ...] = ()
+    recebedor_labels: Tuple[str, ...] = ()
+    pagador_labels: Tuple[str, ...] = ()
+    id_patterns: Tuple[str, ...] = ()
+    banco: Optional[str] = None
+    # Multiplicador aplicado à confiança (regras genéricas pontuam menos)
+    weight: float = 1.0
+    _id_res: List[Pattern] = field(default_factory=list, init=False, repr=False)
+
+    def __post_init__(self):
+        self._id_res = [re.compile(p, re.IGNORECASE) for p in self.id_patterns]
+
+    def applies(self, folded: str) -> bool:
+        return not self.markers or any(m in folded for m in self.markers)
+
+    def match(self, text: str, folded: str) -> Optional[Tuple[Dict, float]]:
+        """Retorna (dados, confiança) ou None se faltar algum campo essencial."""
+        if not text or not self.applies(folded):
+            return None
+
+        lines = [line.strip() for line in text.splitlines() if line.strip()]
+        dados = {
+            'valor': find_valor(text),
+            'recebedor': find_labeled(lines, self.recebedor_labels + RECEBEDOR_LABELS),
+            'banco': self.banco or find_labeled(lines, BANCO_LABELS),
+            'pagador': find_labeled(lines, self.pagador_labels + PAGADOR_LABELS),
+            'id_transacao': self._find_id(text),
+            'data_texto': find_date(text)
+        }
+
+        if any(not dados[f] for f in ESSENTIAL_FIELDS):
+            return None
+
+        score = sum(w for f, w in FIELD_WEIGHTS.items() if dados.get(f))
+        return dados, round(score * self.weight, 3)
+
+    def _find_id(self, text: str) -> Optional[str]:
+        for pattern in self._id_res:
+            match = pattern.search(text)
+            if match:
+                return match.group(1)
+        return find_transaction_id(text)
+
+
+@dataclass
+class RuleMatch:
+    rule: str
+    dados: Dict
+    confidence: float
+
+
+_REGISTRY: Dict[str, ReceiptRule] = {}
+
+
+def register_rule(rule: ReceiptRule) -> ReceiptRule:
+    """Registra (ou substitui, pelo nome) uma regra de layout."""
+    _REGISTRY[rule.name] = rule
+    return rule
+
+
+def registered_rules() -> List[ReceiptRule]:
+    return list(_REGISTRY.values())
+
+
+def parse(text: str) -> Optional[RuleMatch]:
+    """Aplica todas as regras registradas e retorna a de maior confiança."""
+    if not text:
+        return None
+
+    folded = fold(text)
+    best: Optional[RuleMatch] = None
+    for rule in _REGISTRY.values():
+        result = rule.match(text, folded)
+        if result and (best is None or result[1] > best.confidence):
+            best = RuleMatch(rule.name, result[0], result[1])
+    return best
+
+
+GENERIC_RULE = register_rule(ReceiptRule(name='generic', weight=0.85))
+
+register_rule(ReceiptRule(
+    name='nubank',
+    markers=('nu pagamentos', 'nubank'),
+    recebedor_labels=('destino',),
+    pagador_labels=('origem',)
+))
+register_rule(ReceiptRule(
+    name='itau',
+    markers=('itau unibanco', 'banco itau'),
+    recebedor_labels=('dados do recebedor', 'recebedor'),
+    pagador_labels=('dados do pagador', 'pagador'),
+    id_patterns=(r'identifica[cç][aã]o no extrato\s*:?\s*([A-Za-z0-9\-]{6,})',)
+))
+register_rule(ReceiptRule(
+    name='inter',
+    markers=('banco inter', 'inter&co', 'bancointer'),
+    recebedor_labels=('quem recebeu',),
+    pagador_labels=('quem pagou',)
+))
+register_rule(ReceiptRule(
+    name='bb',
+    markers=('banco do brasil', 'sisbb'),
+    recebedor_labels=('pago para', 'recebedor'),
+    pagador_labels=('pagador', 'cliente'),
+    id_patterns=(r'\bID\s*:\s*(E[A-Za-z0-9]{31})',)
+))
+register_rule(ReceiptRule(
+    name='caixa',
+    markers=('caixa economica', 'caixa tem'),
+    recebedor_labels=('dados do recebedor',),
+    pagador_labels=('dados do pagador',),
+    id_patterns=(r'c[oó]digo da opera[cç][aã]o\s*:?\s*([A-Za-z0-9\-]{6,})',)
+))
+register_rule(ReceiptRule(
+    name='bradesco',
+    markers=('bradesco',),
+    recebedor_labels=('dados de quem recebeu', 'nome do favorecido'),
+    pagador_labels=('dados de quem pagou',)
+))
+register_rule(ReceiptRule(
+    name='santander',
+    markers=('santander',),
+    recebedor_labels=('dados do recebedor', 'para'),
+    pagador_labels=('dados do pagador', 'de')
+))
+register_rule(ReceiptRule(
+    name='picpay',
+    markers=('picpay',),
+    recebedor_labels=('para',),
+    pagador_labels=('de',)
+))
+register_rule(ReceiptRule(
+    name='mercadopago',
+    markers=('mercado pago',),
+    recebedor_labels=('para',),
+    pagador_labels=('de',)
+))
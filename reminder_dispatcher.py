@@ -0,0 +1,110 @@
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, List, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Limite de vazão: `rate` envios por segundo, com rajadas de até `capacity`."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        """Bloqueia até haver um token. Retorna True se precisou esperar (throttled)."""
+        waited = False
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self.rate
+            waited = True
+            time.sleep(wait)
+
+
+@dataclass
+class DispatchReport:
+    sent: List[str] = field(default_factory=list)
+    failed: List[str] = field(default_factory=list)
+    throttled: int = 0
+    duration: float = 0.0
+
+    def summary(self) -> str:
+        return (f"{len(self.sent)} enviadas, {len(self.failed)} falhas, "
+                f"{self.throttled} limitadas em {self.duration:.1f}s")
+
+
+class ReminderDispatcher:
+    """
+    Envia lotes de avisos com um pool limitado de threads, respeitando o
+    limite de vazão do WhatsApp e repetindo falhas com backoff exponencial
+    e jitter.
+    """
+
+    def __init__(self, send_func: Callable[[str, str], bool], workers: int = 4, rate: float = 1.0,
+                 burst: int = 5, retries: int = 2, backoff: float = 2.0):
+        self.send_func = send_func
+        self.workers = max(1, workers)
+        self.bucket = TokenBucket(rate, burst)
+        self.retries = retries
+        self.backoff = backoff
+
+    def dispatch(self, mensagens: List[Tuple[str, str]]) -> DispatchReport:
+        report = DispatchReport()
+        if not mensagens:
+            return report
+
+        inicio = time.monotonic()
+        lock = threading.Lock()
+
+        def enviar(item: Tuple[str, str]) -> None:
+            numero, msg = item
+            ok, throttled = self._send_with_retry(numero, msg)
+            with lock:
+                report.throttled += throttled
+                (report.sent if ok else report.failed).append(numero)
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="reminder") as pool:
+            list(pool.map(enviar, mensagens))
+
+        report.duration = time.monotonic() - inicio
+        return report
+
+    def _send_with_retry(self, numero: str, msg: str) -> Tuple[bool, int]:
+        throttled = 0
+        for tentativa in range(self.retries + 1):
+            if self.bucket.acquire():
+                throttled += 1
+            if self.send_func(numero, msg):
+                return True, throttled
+            if tentativa < self.retries:
+                # Backoff exponencial com jitter (evita rajadas sincronizadas)
+                time.sleep(self.backoff * (2 ** tentativa) * random.uniform(0.5, 1.5))
+        logger.warning(f"Aviso para {numero} falhou após {self.retries + 1} tentativas.")
+        return False, throttled
+
+
+def from_config(send_func: Callable[[str, str], bool]) -> ReminderDispatcher:
+    return ReminderDispatcher(
+        send_func,
+        workers=Config.REMINDER_WORKERS,
+        rate=Config.REMINDER_RATE_PER_SECOND,
+        burst=Config.REMINDER_BURST,
+        retries=Config.REMINDER_RETRIES,
+        backoff=Config.REMINDER_BACKOFF_SECONDS
+    )
@@ -1,77 +1,253 @@
-import time
+import heapq
 import threading
-import requests
 import logging
-from datetime import datetime, timedelta
-from database import Database
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Tuple
+from database import Database, iso_to_br
 from config import Config
+import reminder_dispatcher
+import wpp_gateway
+from wpp_gateway import WPPGateway
+import metrics
 
 logger = logging.getLogger(__name__)
 
+RUN_SECONDS = metrics.histogram('financebot_scheduler_run_seconds',
+                                'Duração de cada rodada de avisos do agendador.', buckets=metrics.AI_BUCKETS)
+REMINDERS = metrics.counter('financebot_reminders', 'Avisos de vencimento por resultado.', ['result'])
+REMINDERS_THROTTLED = metrics.counter('financebot_reminders_throttled',
+                                      'Envios de aviso que aguardaram o limite de vazão.')
+
+# Janela de envio (09h às 20h)
+HORA_INICIO = 9
+HORA_FIM = 20
+
+
 class PaymentScheduler:
-    def __init__(self):
+    """
+    Agenda os avisos de vencimento em uma min-heap de horários.
+    O loop dorme exatamente até o próximo aviso e acorda antes quando o banco
+    notifica mudanças (vencimento, saldo ou exclusão de cliente). Mudanças feitas
+    por outros workers são detectadas pelo contador de alterações do banco
+    (checado a cada SCHEDULER_CHANGE_POLL_SECONDS), que dispara uma recarga.
+    """
+
+    def __init__(self, gateway: Optional[WPPGateway] = None):
         self.db = Database()
+        if gateway is None:
+            gateway = wpp_gateway.from_config()
+        self.gateway = gateway
         self.stop_event = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        # Heap (horário, numero) com invalidação preguiçosa via _agenda
+        self._heap: List[Tuple[float, str]] = []
+        self._agenda: Dict[str, float] = {}
+        self._alterados: set = set()
+        # Novas tentativas após falha de envio (sobrevivem às recargas da agenda)
+        self._retentativas: Dict[str, float] = {}
+        # Contador de alterações do banco refletido na agenda
+        self._versao: Optional[int] = None
+
+        self.dispatcher = reminder_dispatcher.from_config(self._send_notification)
+        self.last_report: Optional[reminder_dispatcher.DispatchReport] = None
+
+        self.db.subscribe(self._on_change)
 
     def start(self):
-        thread = threading.Thread(target=self._run_loop, daemon=True)
-        thread.start()
+        # Reinicializável: o processo pode perder e recuperar a liderança
+        if self._thread and self._thread.is_alive():
+            return
+        # Evento novo por execução: uma thread antiga ainda terminando um envio não volta a rodar
+        self.stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, args=(self.stop_event,),
+                                        name="payment-scheduler", daemon=True)
+        self._thread.start()
         logger.info("Agendador de cobranças iniciado.")
 
-    def _run_loop(self):
-        while not self.stop_event.is_set():
+    def stop(self, timeout: float = 10.0):
+        self.stop_event.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _on_change(self, numero: str) -> None:
+        with self._lock:
+            self._alterados.add(numero)
+        self._wake.set()
+
+    def _run_loop(self, stop_event: threading.Event):
+        proxima_resync = datetime.min
+        checar = Config.SCHEDULER_CHANGE_POLL_SECONDS > 0
+        proxima_checagem = datetime.min if checar else datetime.max
+        while not stop_event.is_set():
+            self._wake.clear()
+            now = datetime.now()
             try:
-                self._check_vencimentos()
+                # Recarga completa: periódica ou quando outro processo alterou `financeiro`
+                alterado_fora = now >= proxima_checagem and self._banco_alterado()
+                if now >= proxima_resync or alterado_fora:
+                    self._recarregar(now)
+                    proxima_resync = now + timedelta(seconds=Config.SCHEDULER_RESYNC_SECONDS)
+                else:
+                    self._aplicar_alteracoes(now)
+                if now >= proxima_checagem:
+                    proxima_checagem = now + timedelta(seconds=Config.SCHEDULER_CHANGE_POLL_SECONDS)
+
+                vencidos = self._pop_vencidos(now)
+                if vencidos:
+                    self._check_vencimentos(vencidos)
             except Exception as e:
                 logger.error(f"Erro no Scheduler: {e}")
-            
-            # Verifica a cada hora
-            time.sleep(3600) 
 
-    def _check_vencimentos(self):
+            self._wake.wait(self._segundos_ate_proximo(min(proxima_resync, proxima_checagem)))
+
+    def _banco_alterado(self) -> bool:
+        """
+        True se outro processo alterou `financeiro` desde a última recarga. As
+        escritas deste processo já chegam por _on_change e só avançam a versão.
+        """
+        if self._versao is None:
+            return True
+        atual, externa = self.db.escritas_externas(self._versao)
+        if not externa:
+            self._versao = atual
+        return externa
+
+    def _segundos_ate_proximo(self, proxima: datetime) -> float:
+        alvo = proxima.timestamp()
+        with self._lock:
+            if self._heap:
+                alvo = min(alvo, self._heap[0][0])
+        return max(0.0, alvo - datetime.now().timestamp())
+
+    def _proximo_aviso(self, vencimento_iso: str, ultimo_aviso: Optional[str], now: datetime) -> Optional[datetime]:
+        """Próximo horário de aviso: véspera e dia do vencimento, dentro da janela, 1 por dia."""
+        try:
+            vencimento = date.fromisoformat(vencimento_iso)
+        except (TypeError, ValueError):
+            return None
+
+        for dia in (vencimento - timedelta(days=1), vencimento):
+            if dia.isoformat() == ultimo_aviso:
+                continue
+            inicio = datetime.combine(dia, time(HORA_INICIO))
+            fim = datetime.combine(dia, time(HORA_FIM, 59, 59))
+            if now <= fim:
+                return max(inicio, now)
+        return None
+
+    def _agendar(self, numero: str, quando: Optional[datetime]) -> None:
+        """Atualiza a agenda do cliente (chamar com lock)."""
+        if quando is None:
+            self._agenda.pop(numero, None)
+            self._retentativas.pop(numero, None)
+            return
+        # Uma nova tentativa pendente não é antecipada por recargas da agenda
+        ts = max(quando.timestamp(), self._retentativas.get(numero, 0.0))
+        self._agenda[numero] = ts
+        heapq.heappush(self._heap, (ts, numero))
+
+    def _recarregar(self, now: datetime) -> None:
+        # Lido antes da agenda: uma escrita entre as duas leituras provoca nova recarga
+        self._versao = self.db.contador_alteracoes()
+        # Quem venceu ontem já não recebe aviso; consulta indexada por vencimento
+        linhas = self.db.get_agenda_cobranca(now.date().isoformat())
+        with self._lock:
+            self._heap.clear()
+            self._agenda.clear()
+            self._alterados.clear()
+            for numero, vencimento, ultimo_aviso in linhas:
+                self._agendar(numero, self._proximo_aviso(vencimento, ultimo_aviso, now))
+        logger.info(f"Agenda de cobranças carregada ({len(self._agenda)} clientes).")
+
+    def _aplicar_alteracoes(self, now: datetime) -> None:
+        with self._lock:
+            alterados, self._alterados = self._alterados, set()
+
+        for numero in alterados:
+            cobranca = self.db.get_cobranca(numero)
+            quando = self._proximo_aviso(cobranca[0], cobranca[1], now) if cobranca else None
+            with self._lock:
+                self._agendar(numero, quando)
+
+    def _pop_vencidos(self, now: datetime) -> List[str]:
+        agora = now.timestamp()
+        vencidos = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= agora:
+                ts, numero = heapq.heappop(self._heap)
+                if self._agenda.get(numero) == ts:
+                    del self._agenda[numero]
+                    self._retentativas.pop(numero, None)
+                    vencidos.append(numero)
+        return vencidos
+
+    @RUN_SECONDS.time()
+    def _check_vencimentos(self, numeros: List[str]):
         now = datetime.now()
-        
+
         # Janela de envio (09h às 20h)
-        if not (9 <= now.hour <= 20):
+        if not (HORA_INICIO <= now.hour <= HORA_FIM):
+            self._reagendar(numeros, now)
             return
 
-        hoje_str = now.strftime("%d/%m")
         hoje_iso = now.strftime("%Y-%m-%d") # Controle de duplicidade diária
-        amanha_str = (now + timedelta(days=1)).strftime("%d/%m")
+        amanha_iso = (now + timedelta(days=1)).strftime("%Y-%m-%d")
 
-        pendentes = self.db.get_pendentes_cobranca()
+        # Revalida no banco: vence hoje/amanhã e ainda não foi avisado hoje (consulta indexada)
+        alvos = set(numeros)
+        pendentes = [c for c in self.db.get_pendentes_cobranca(hoje_iso, amanha_iso, hoje_iso) if c[0] in alvos]
 
+        mensagens = []
         for cliente in pendentes:
             numero, saldo, vencimento_db, ultimo_aviso = cliente
-            
-            if ultimo_aviso == hoje_iso:
-                continue
+            vencimento_br = iso_to_br(vencimento_db)
 
             msg = None
-            if vencimento_db == amanha_str:
+            if vencimento_db == amanha_iso:
                 msg = (f"🔔 *Lembrete*\n\n"
-                       f"Olá! Seu saldo de *R${int(saldo)}* vence *AMANHÃ* ({vencimento_db}).\n"
+                       f"Olá! Seu saldo de *R${int(saldo)}* vence *AMANHÃ* ({vencimento_br}).\n"
                        "Que tal adiantar? Envie o comprovante Pix por aqui.")
-            
-            elif vencimento_db == hoje_str:
+
+            elif vencimento_db == hoje_iso:
                 msg = (f"⚠️ *Vencimento Hoje*\n\n"
                        f"Seu pagamento de *R${int(saldo)}* vence hoje.\n"
                        "Envie o Pix e mande a foto do comprovante para baixa.")
 
             if msg:
-                if self._send_notification(numero, msg):
-                    self.db.registrar_envio_aviso(numero, hoje_iso)
-                    logger.info(f"Cobrança enviada para {numero}")
+                mensagens.append((numero, msg))
+
+        if mensagens:
+            report = self.dispatcher.dispatch(mensagens)
+            # Uma única transação para todos os avisos entregues
+            self.db.registrar_envios_aviso(report.sent, hoje_iso)
+            if report.failed:
+                # Nova tentativa mais tarde (dentro da janela do dia)
+                retry = now + timedelta(seconds=Config.SCHEDULER_RETRY_SECONDS)
+                with self._lock:
+                    for numero in report.failed:
+                        self._retentativas[numero] = retry.timestamp()
+                        self._agendar(numero, retry)
+            self.last_report = report
+            REMINDERS.inc('sent', amount=len(report.sent))
+            REMINDERS.inc('failed', amount=len(report.failed))
+            REMINDERS_THROTTLED.inc(amount=report.throttled)
+            logger.info(f"Cobranças: {report.summary()}")
+
+        # Agenda o próximo aviso (ex: do dia do vencimento, após o da véspera)
+        self._reagendar(numeros, now)
+
+    def _reagendar(self, numeros: List[str], now: datetime) -> None:
+        with self._lock:
+            pendentes = [n for n in numeros if n not in self._agenda]
+            self._alterados.update(pendentes)
+        self._aplicar_alteracoes(now)
 
     def _send_notification(self, numero: str, msg: str) -> bool:
+        # Envio síncrono: o resultado decide se o aviso é registrado ou reagendado
         to = f"{numero}@c.us" if "@" not in numero else numero
-        try:
-            res = requests.post(
-                f"{Config.WPP_API_URL}/send-message", 
-                headers=Config.HEADERS, 
-                json={"phone": to, "message": msg}
-            )
-            return res.status_code == 200
-        except Exception as e:
-            logger.error(f"Falha ao notificar {numero}: {e}")
-            return False
\ No newline at end of file
+        return self.gateway.send_text_sync(to, msg, timeout=Config.REMINDER_SEND_TIMEOUT)
@@ -0,0 +1,335 @@
+"""
+Rastreamento leve por requisição (spans com ID de correlação), log de
+requisições lentas e profiler por amostragem ligável em produção.
+
+Um trace é aberto no webhook e em cada job da fila (com o mesmo ID de
+correlação da mensagem de origem). Fora de um trace, span() não faz nada.
+Traces acima de TRACE_SLOW_MS vão para o log de lentidão com todos os spans.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from collections import Counter, deque
+from contextlib import contextmanager
+from functools import wraps
+from logging.handlers import RotatingFileHandler
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger('finance.slow')
+
+_current: "contextvars.ContextVar[Optional[Trace]]" = contextvars.ContextVar('trace', default=None)
+
+
+class Trace:
+    """Spans de uma requisição/job. Só a thread que abriu o trace escreve nele."""
+    __slots__ = ('name', 'correlation_id', 'inicio', 'wall_start', 'spans', '_open')
+
+    def __init__(self, name: str, correlation_id: Optional[str] = None, inicio: Optional[float] = None):
+        self.name = name
+        self.correlation_id = correlation_id or uuid.uuid4().hex[:16]
+        agora = time.perf_counter()
+        # `inicio` (perf_counter) permite contar a partir de antes do trace existir (ex: enfileiramento)
+        self.inicio = agora if inicio is None else inicio
+        self.wall_start = time.time() - (agora - self.inicio)
+        # [nome, início relativo (s), duração (s), profundidade, atributos]
+        self.spans: List[list] = []
+        self._open: List[list] = []
+
+    def duration(self) -> float:
+        return time.perf_counter() - self.inicio
+
+    def to_dict(self, total: Optional[float] = None) -> Dict[str, Any]:
+        total = self.duration() if total is None else total
+        return {
+            'correlation_id': self.correlation_id,
+            'name': self.name,
+            'start': round(self.wall_start, 3),
+            'total_ms': round(total * 1000, 1),
+            'spans': [
+                {'name': nome, 'start_ms': round(inicio * 1000, 1),
+                 'ms': round(dur * 1000, 1) if dur is not None else None,
+                 'depth': depth, **attrs}
+                for nome, inicio, dur, depth, attrs in self.spans
+            ]
+        }
+
+
+class _Span:
+    __slots__ = ('_trace', '_entry', '_inicio')
+
+    def __init__(self, trace: Trace, name: str):
+        self._trace = trace
+        self._entry = [name, 0.0, None, 0, {}]
+
+    def __enter__(self) -> "_Span":
+        trace = self._trace
+        self._inicio = time.perf_counter()
+        self._entry[1] = self._inicio - trace.inicio
+        self._entry[3] = len(trace._open)
+        trace.spans.append(self._entry)
+        trace._open.append(self._entry)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._entry[2] = time.perf_counter() - self._inicio
+        if exc_type is not None:
+            self._entry[4]['error'] = exc_type.__name__
+        self._trace._open.pop()
+
+    def set(self, **attrs: Any) -> None:
+        self._entry[4].update(attrs)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+    def set(self, **attrs: Any) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str):
+    """Context manager que mede um trecho dentro do trace atual (no-op sem trace)."""
+    trace = _current.get()
+    return _Span(trace, name) if trace is not None else _NOOP
+
+
+def annotate(**attrs: Any) -> None:
+    """Acrescenta atributos ao span aberto mais interno (ex: load_ms do Ollama)."""
+    trace = _current.get()
+    if trace is not None and trace._open:
+        trace._open[-1][4].update(attrs)
+
+
+def record(name: str, seconds: float, **attrs: Any) -> None:
+    """Registra um trecho já medido que terminou agora (ex: espera na fila)."""
+    trace = _current.get()
+    if trace is not None:
+        fim = time.perf_counter() - trace.inicio
+        trace.spans.append([name, fim - seconds, seconds, len(trace._open), attrs])
+
+
+def current_id() -> Optional[str]:
+    trace = _current.get()
+    return trace.correlation_id if trace is not None else None
+
+
+def set_correlation_id(correlation_id: Optional[str]) -> None:
+    trace = _current.get()
+    if trace is not None and correlation_id:
+        trace.correlation_id = correlation_id
+
+
+def traced(name: str) -> Callable[[Callable], Callable]:
+    """Decorador: executa a função dentro de um span (custo mínimo fora de um trace)."""
+    def decorar(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            trace = _current.get()
+            if trace is None:
+                return func(*args, **kwargs)
+            with _Span(trace, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorar
+
+
+def traced_methods(prefix: str, exclude: Iterable[str] = ()) -> Callable[[type], type]:
+    """Decorador de classe: um span `prefix.metodo` por método público."""
+    def decorar(cls: type) -> type:
+        for nome, attr in list(vars(cls).items()):
+            if nome.startswith('_') or nome in exclude or not callable(attr):
+                continue
+            setattr(cls, nome, traced(f"{prefix}.{nome}")(attr))
+        return cls
+    return decorar
+
+
+# --- Traces e log de lentidão ---
+
+class _Settings:
+    def __init__(self):
+        self.enabled = True
+        self.slow_seconds = 10.0
+        # Últimos traces lentos (GET /debug/slow)
+        self.recent_slow: Deque[Dict[str, Any]] = deque(maxlen=50)
+
+
+settings = _Settings()
+
+
+@contextmanager
+def trace(name: str, correlation_id: Optional[str] = None,
+          inicio: Optional[float] = None) -> Iterator[Optional[Trace]]:
+    """
+    Abre um trace (raiz) para o bloco. Traces aninhados reaproveitam o externo.
+    Ao final, se passar de TRACE_SLOW_MS, grava o detalhamento no log de lentidão.
+    """
+    if not settings.enabled or _current.get() is not None:
+        yield _current.get()
+        return
+
+    atual = Trace(name, correlation_id, inicio)
+    token = _current.set(atual)
+    try:
+        yield atual
+    finally:
+        _current.reset(token)
+        total = atual.duration()
+        if total >= settings.slow_seconds:
+            _log_slow(atual, total)
+
+
+def _log_slow(atual: Trace, total: float) -> None:
+    registro = atual.to_dict(total)
+    settings.recent_slow.append(registro)
+    slow_logger.warning(json.dumps(registro, ensure_ascii=False, default=str))
+
+
+def recent_slow() -> List[Dict[str, Any]]:
+    return list(settings.recent_slow)
+
+
+def continue_in_job(func: Callable, name: str) -> Callable:
+    """
+    Envolve um job da fila: o worker abre um trace com o mesmo ID de correlação
+    de quem enfileirou, contado desde o enfileiramento (a espera na fila vira um span).
+    """
+    correlation_id = current_id()
+    enfileirado = time.perf_counter()
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with trace(name, correlation_id, enfileirado):
+            record('queue_wait', time.perf_counter() - enfileirado)
+            return func(*args, **kwargs)
+    return wrapper
+
+
+# --- Profiler por amostragem ---
+
+# Threads paradas nestes pontos estão ociosas (workers esperando fila/socket) e são ignoradas
+_IDLE_FRAMES = {('threading.py', 'wait'), ('selectors.py', 'select'), ('socket.py', 'accept')}
+
+class SamplingProfiler:
+    """
+    Amostra as pilhas de todas as threads em intervalo fixo (sys._current_frames)
+    e agrega no formato "collapsed" (entrada de flamegraph.pl/speedscope).
+    Pode ser ligado e desligado com o processo rodando; desliga sozinho após
+    `max_seconds`.
+    """
+
+    def __init__(self, interval: float = 0.01, max_seconds: float = 300.0, max_stacks: int = 20000):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.max_stacks = max_stacks
+        self._stacks: Counter = Counter()
+        self._samples = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.started_at: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: Optional[float] = None, interval: Optional[float] = None) -> None:
+        if self.running:
+            return
+        with self._lock:
+            self._stacks.clear()
+            self._samples = 0
+        self.interval = interval or self.interval
+        duracao = min(seconds or self.max_seconds, self.max_seconds)
+        self._stop = threading.Event()
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, args=(self._stop, duracao),
+                                        name="sampling-profiler", daemon=True)
+        self._thread.start()
+        logger.warning(f"Profiler por amostragem ligado ({duracao:.0f}s, intervalo {self.interval * 1000:.0f}ms).")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+        logger.warning(f"Profiler por amostragem desligado ({self._samples} amostras).")
+
+    def _run(self, stop: threading.Event, duracao: float) -> None:
+        proprio = threading.get_ident()
+        limite = time.monotonic() + duracao
+        while not stop.wait(self.interval) and time.monotonic() < limite:
+            nomes = {t.ident: t.name for t in threading.enumerate()}
+            amostra = []
+            for ident, frame in sys._current_frames().items():
+                if ident == proprio:
+                    continue
+                if (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in _IDLE_FRAMES:
+                    continue
+                pilha = []
+                while frame is not None:
+                    code = frame.f_code
+                    pilha.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                pilha.append(nomes.get(ident, str(ident)))
+                amostra.append(';'.join(reversed(pilha)))
+            with self._lock:
+                self._samples += 1
+                for chave in amostra:
+                    if chave in self._stacks or len(self._stacks) < self.max_stacks:
+                        self._stacks[chave] += 1
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'running': self.running, 'started_at': self.started_at,
+                    'interval_ms': round(self.interval * 1000, 1), 'samples': self._samples,
+                    'stacks': len(self._stacks)}
+
+    def collapsed(self, limit: Optional[int] = None) -> str:
+        """Uma linha por pilha: 'thread;f1 (arq:linha);f2 ... contagem'."""
+        with self._lock:
+            itens = self._stacks.most_common(limit)
+        return '\n'.join(f"{pilha} {n}" for pilha, n in itens) + '\n'
+
+
+profiler = SamplingProfiler()
+
+
+def configure(enabled: bool = True, slow_ms: float = 10000, slow_log: Optional[str] = None,
+              profiler_interval_ms: float = 10, profiler_max_seconds: float = 300) -> None:
+    settings.enabled = enabled
+    settings.slow_seconds = slow_ms / 1000
+    profiler.interval = profiler_interval_ms / 1000
+    profiler.max_seconds = profiler_max_seconds
+
+    if slow_log and not any(getattr(h, 'baseFilename', None) == os.path.abspath(slow_log)
+                            for h in slow_logger.handlers):
+        handler = RotatingFileHandler(slow_log, maxBytes=10 * 1024 * 1024, backupCount=3, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        slow_logger.addHandler(handler)
+
+
+def from_config() -> None:
+    from config import Config
+
+    configure(
+        enabled=Config.TRACE_ENABLED,
+        slow_ms=Config.TRACE_SLOW_MS,
+        slow_log=Config.TRACE_SLOW_LOG,
+        profiler_interval_ms=Config.PROFILER_INTERVAL_MS,
+        profiler_max_seconds=Config.PROFILER_MAX_SECONDS
+    )
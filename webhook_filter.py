@@ -0,0 +1,105 @@
+import re
+import threading
+import logging
+from typing import Any, Dict, Optional
+
+from config import Config
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Eventos que o bot realmente trata (acks, presença etc. são descartados)
+ACCEPTED_EVENTS = frozenset({'onmessage', 'onselfmessage', 'onpollresponse'})
+
+# O WPPConnect envia "event" como primeira chave; a busca nos bytes evita o parse do Base64
+_EVENT_RE = re.compile(rb'"event"\s*:\s*"([^"]*)"')
+_GROUP_RE = re.compile(rb'"(?:chatId|from)"\s*:\s*"[^"]*@g\.us"')
+
+
+class WebhookFilter:
+    """
+    Camada de entrada do webhook: descarta eventos não usados e chats de grupo
+    direto nos bytes (antes do json), e ignora reenvios do WPPConnect pelos IDs
+    de mensagem registrados no SQLite com TTL (vale para todos os workers).
+    Conta os descartes por etapa (por processo).
+    """
+
+    def __init__(self, db: Optional[Database] = None, dedupe_ttl: float = 600.0):
+        self.db = db or Database()
+        self.dedupe_ttl = dedupe_ttl
+        self._lock = threading.Lock()
+        self._counters = {
+            'received': 0,
+            'dropped_event': 0,
+            'dropped_group': 0,
+            'dropped_invalid': 0,
+            'dropped_duplicate': 0,
+            'accepted': 0
+        }
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._counters[key] += 1
+
+    def precheck(self, raw: bytes) -> Optional[str]:
+        """Etapa sobre os bytes crus. Retorna o motivo do descarte ou None para seguir."""
+        self._count('received')
+        match = _EVENT_RE.search(raw)
+        if not match or match.group(1).decode('utf-8', 'replace') not in ACCEPTED_EVENTS:
+            self._count('dropped_event')
+            return 'event'
+        if _GROUP_RE.search(raw):
+            self._count('dropped_group')
+            return 'group'
+        return None
+
+    def reject_invalid(self) -> None:
+        self._count('dropped_invalid')
+
+    @staticmethod
+    def event_key(data: Dict[str, Any]) -> Optional[str]:
+        """ID estável do evento (mensagem ou voto) para detectar reenvios."""
+        if data.get('event') == 'onpollresponse':
+            poll = data.get('msgId')
+            poll = poll.get('_serialized') if isinstance(poll, dict) else poll
+            # Um mesmo usuário pode mudar o voto: o timestamp diferencia os votos
+            return f"poll:{poll}:{data.get('sender')}:{data.get('timestamp')}" if poll else None
+
+        msg_id = data.get('id')
+        msg_id = msg_id.get('_serialized') if isinstance(msg_id, dict) else msg_id
+        return f"msg:{msg_id}" if msg_id else None
+
+    def claim(self, key: Optional[str]) -> bool:
+        """Registra o evento. Retorna False se ele já foi visto dentro do TTL (reenvio)."""
+        if not key:
+            self._count('accepted')
+            return True
+
+        try:
+            novo = self.db.reivindicar_evento(key, self.dedupe_ttl)
+        except Exception as e:
+            # Sem o banco, melhor processar um reenvio do que perder a mensagem
+            logger.error(f"Erro ao registrar o evento {key}: {e}")
+            novo = True
+        self._count('accepted' if novo else 'dropped_duplicate')
+        return novo
+
+    def release(self, key: Optional[str]) -> None:
+        """Esquece o evento (falha no processamento): o reenvio do WPPConnect será aceito."""
+        if key:
+            try:
+                self.db.liberar_evento(key)
+            except Exception as e:
+                logger.error(f"Erro ao liberar o evento {key}: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            contadores = dict(self._counters)
+        return {**contadores, 'tracked_ids': self.db.contar_eventos()}
+
+
+def from_config(db: Optional[Database] = None) -> WebhookFilter:
+    return WebhookFilter(
+        db=db,
+        dedupe_ttl=Config.WEBHOOK_DEDUPE_TTL
+    )
@@ -0,0 +1,229 @@
+import time
+import zlib
+import queue
+import threading
+import logging
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import Config
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+OUTBOUND_SECONDS = metrics.histogram('financebot_wpp_request_seconds',
+                                     'Latência das chamadas ao WPPConnect por endpoint e resultado.',
+                                     ['endpoint', 'result'])
+
+# Callback de entrega: recebe o JSON de resposta do WPPConnect (ou None em caso de falha)
+DeliveryCallback = Callable[[Optional[Dict[str, Any]]], None]
+
+
+def message_id(obj: Any) -> Optional[str]:
+    """
+    Chave da mensagem a partir da resposta do WPPConnect ou do `msgId` de um evento.
+    Usa apenas o último trecho de 'true_5561...@c.us_3EB0...', que não depende
+    do formato do JID (@c.us/@lid) em cada lado.
+    """
+    if isinstance(obj, dict):
+        if obj.get('_serialized'):
+            return message_id(obj['_serialized'])
+        for key in ('response', 'id', 'msgId'):
+            found = message_id(obj.get(key))
+            if found:
+                return found
+        return None
+    if isinstance(obj, list):
+        return message_id(obj[0]) if obj else None
+    if isinstance(obj, str) and obj:
+        return obj.rsplit('_', 1)[-1]
+    return None
+
+
+class WPPGateway:
+    """
+    Saída única para a API do WPPConnect.
+
+    Usa uma `requests.Session` com pool de conexões keep-alive e timeouts
+    explícitos. Os envios assíncronos entram em uma fila particionada por
+    chat: cada chat cai sempre no mesmo worker, o que preserva a ordem das
+    mensagens de uma conversa sem serializar as demais.
+    """
+
+    def __init__(self, api_url: str, headers: Dict[str, str], workers: int = 4, max_queue: int = 1000,
+                 pool_size: int = 10, connect_timeout: float = 5.0, read_timeout: float = 30.0,
+                 enqueue_timeout: float = 0.0, latency_window: int = 500):
+        self.api_url = api_url
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.timeout = (connect_timeout, read_timeout)
+        self.enqueue_timeout = enqueue_timeout
+
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, self.workers))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        per_shard = max(1, max_queue // self.workers)
+        self._shards: List["queue.Queue[Optional[tuple]]"] = [queue.Queue(maxsize=per_shard) for _ in range(self.workers)]
+        self._threads: List[threading.Thread] = []
+
+        self._lock = threading.Lock()
+        self._latency: Dict[str, Deque[float]] = {}
+        self._latency_window = latency_window
+        self._counters = {'sent': 0, 'failed': 0, 'dropped': 0}
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        for i, shard in enumerate(self._shards):
+            thread = threading.Thread(target=self._worker, args=(shard,), name=f"wpp-sender-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Gateway WPPConnect iniciado ({self.workers} workers, capacidade {self.max_queue}).")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Entrega o que já está na fila e encerra os workers."""
+        for shard in self._shards:
+            try:
+                shard.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads.clear()
+        self.session.close()
+
+    # --- Envio síncrono ---
+
+    def post(self, endpoint: str, payload: Dict[str, Any], timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Envia imediatamente e retorna o JSON da resposta (ou {} se não for JSON).
+        Retorna None em caso de erro HTTP, timeout ou falha de conexão.
+        """
+        inicio = time.perf_counter()
+        ok = False
+        try:
+            with tracing.span(f"wpp.{endpoint}") as span:
+                res = self.session.post(f"{self.api_url}/{endpoint}", json=payload,
+                                        timeout=timeout or self.timeout)
+                span.set(status=res.status_code)
+            ok = 200 <= res.status_code < 300
+            if not ok:
+                logger.warning(f"WPPConnect {endpoint} respondeu {res.status_code}: {res.text[:200]}")
+                return None
+            try:
+                return res.json()
+            except ValueError:
+                return {}
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Falha no envio para WPPConnect ({endpoint}): {e}")
+            return None
+        finally:
+            self._record(endpoint, time.perf_counter() - inicio, ok)
+
+    def send_text_sync(self, to: str, msg: str, timeout: Optional[float] = None) -> bool:
+        return self.post('send-message', {"phone": to, "message": msg}, timeout) is not None
+
+    # --- Envio assíncrono (ordenado por chat) ---
+
+    def enqueue(self, chat: str, endpoint: str, payload: Dict[str, Any],
+                callback: Optional[DeliveryCallback] = None, timeout: Optional[float] = None) -> bool:
+        """
+        Agenda o envio. Com a fila do chat cheia, descarta e retorna False na hora
+        (o webhook nunca espera); quem pode esperar passa `timeout` em segundos.
+        """
+        shard = self._shards[zlib.crc32(chat.split('@')[0].encode()) % self.workers]
+        item = (endpoint, payload, callback, tracing.current_id())
+        timeout = self.enqueue_timeout if timeout is None else timeout
+        try:
+            if timeout > 0:
+                shard.put(item, timeout=timeout)
+            else:
+                shard.put_nowait(item)
+            return True
+        except queue.Full:
+            with self._lock:
+                self._counters['dropped'] += 1
+            logger.error(f"Fila de saída cheia. Mensagem para {chat} descartada ({endpoint}).")
+            return False
+
+    def send_text(self, to: str, msg: str, callback: Optional[DeliveryCallback] = None) -> bool:
+        return self.enqueue(to, 'send-message', {"phone": to, "message": msg}, callback)
+
+    def send_poll(self, to: str, name: str, choices: List[str],
+                  callback: Optional[DeliveryCallback] = None) -> bool:
+        payload = {
+            "phone": to.split('@')[0],
+            "name": name,
+            "choices": choices,
+            "options": {"selectableCount": 1}
+        }
+        return self.enqueue(to, 'send-poll-message', payload, callback)
+
+    def _worker(self, shard: "queue.Queue[Optional[tuple]]") -> None:
+        while True:
+            item = shard.get()
+            if item is None:
+                return
+            endpoint, payload, callback, correlation_id = item
+            # Envio assíncrono: trace próprio com o ID de correlação de quem enfileirou
+            with tracing.trace(f"outbound.{endpoint}", correlation_id):
+                result = self.post(endpoint, payload)
+                if callback:
+                    try:
+                        callback(result)
+                    except Exception as e:
+                        logger.error(f"Erro no callback de entrega ({endpoint}): {e}", exc_info=True)
+
+    # --- Métricas ---
+
+    def _record(self, endpoint: str, elapsed: float, ok: bool) -> None:
+        OUTBOUND_SECONDS.observe(elapsed, endpoint, 'ok' if ok else 'error')
+        with self._lock:
+            window = self._latency.get(endpoint)
+            if window is None:
+                window = self._latency[endpoint] = deque(maxlen=self._latency_window)
+            window.append(elapsed)
+            self._counters['sent' if ok else 'failed'] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        depths = [shard.qsize() for shard in self._shards]
+        with self._lock:
+            latency = {}
+            for endpoint, window in self._latency.items():
+                amostras = sorted(window)
+                n = len(amostras)
+                latency[endpoint] = {
+                    'samples': n,
+                    'avg_ms': round(sum(amostras) / n * 1000, 1),
+                    'p50_ms': round(amostras[n // 2] * 1000, 1),
+                    'p95_ms': round(amostras[min(n - 1, int(n * 0.95))] * 1000, 1),
+                    'max_ms': round(amostras[-1] * 1000, 1)
+                }
+            counters = dict(self._counters)
+        return {
+            'depth': sum(depths),
+            'depth_per_worker': depths,
+            'capacity': self.max_queue,
+            'workers': self.workers,
+            **counters,
+            'latency': latency
+        }
+
+
+def from_config() -> WPPGateway:
+    return WPPGateway(
+        Config.WPP_API_URL,
+        Config.HEADERS,
+        workers=Config.WPP_WORKERS,
+        max_queue=Config.WPP_QUEUE_SIZE,
+        pool_size=Config.WPP_POOL_SIZE,
+        connect_timeout=Config.WPP_CONNECT_TIMEOUT,
+        read_timeout=Config.WPP_READ_TIMEOUT
+    )
@@ -0,0 +1,6 @@
+"""
+Entry point de produção: gunicorn -c gunicorn.conf.py wsgi:app
+"""
+from app import create_app
+
+app = create_app()